@@ -0,0 +1,425 @@
+#!/usr/bin/env python
+"""
+This module holds the logic for the continuous IV program--the 6221 and the
+2182a are driven as separate GPIB instruments rather than as a paired stack.
+The 6221 steps its DC output, the 2182a is read directly, and the data are
+plotted and saved as they come in.
+
+The instrument I/O runs in a background thread so that plotting and saving
+never hold up the bus. In stepped mode the next bias is written as soon as a
+reading arrives, and the 2182a is already converting while the previous
+reading is being processed. If the trigger link is connected, the 6221 runs
+a list sweep that triggers the 2182a directly and the computer only has to
+collect the 2182a's buffer. The 2182a's buffer holds only the readings, so
+the timestamps of a triggered sweep are spread evenly over the time it took
+and are marked as interpolated in the saved file.
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import sys
+import os
+import time
+import queue
+import threading
+import numpy as np
+import pyqtgraph as pg
+from qtpy import QtGui, QtCore
+from qtpy.QtGui import QFileDialog
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, "dIdV"))
+import Keithley_dIdV_2182a
+import Keithley_dIdV_transport
+from Keithley_dIdV_commands import COMMANDS, PARAMS, CommandError
+
+__author__ = "Sarah Friedensen"
+__credits__ = "Sarah Friedensen"
+__license__ = "GPL3+"
+__version__ = "1.0"
+__maintainer__ = "Sarah Friedensen"
+__email__ = "safrie@sas.upenn.edu"
+__status__ = "Development"
+
+LINE_FREQUENCY = 60.0
+PLOT_INTERVAL = 100  # ms between plot/save updates
+
+
+def max_reading_rate(nplc):
+    """Fastest reading rate (readings/s) of the 2182a at the given NPLC."""
+    return LINE_FREQUENCY / nplc
+
+
+def iv_currents(start, stop, step, bidirectional=False):
+    """Bias currents for one IV sweep, optionally returning to the start."""
+    num = int(round(abs(stop - start) / abs(step), 6)) + 1
+    currents = start + np.sign(stop - start) * abs(step) * np.arange(num)
+    if bidirectional:
+        currents = np.concatenate((currents, currents[-2::-1]))
+    return currents
+
+
+class IVAcquisition(threading.Thread):
+    """Run IV sweeps in a background thread.
+
+    Readings are put on self.readings as (sweep, timestamp, current, voltage)
+    tuples, followed by None when the acquisition ends. Any error raised
+    during the run is kept in self.error. A delay the 6221's list sweep
+    would reject raises CommandError here, before anything is sent."""
+
+    def __init__(self, source, meter, currents, nplc=1.0, compliance=10.0,
+                 delay=0.0, trigger_link=False, continuous=False):
+        super().__init__(daemon=True)
+        self.source = source
+        self.meter = meter
+        self.voltmeter = Keithley_dIdV_2182a.Voltmeter2182a(meter)
+        self.currents = [float(x) for x in currents]
+        self.nplc = nplc
+        self.compliance = compliance
+        self.delay = delay
+        self.trigger_link = trigger_link
+        self.continuous = continuous
+        self.delay_command = (COMMANDS["list_delay"].render(delay)
+                              if trigger_link else None)
+        self.readings = queue.Queue()
+        self.stop_event = threading.Event()
+        self.count = 0
+        self.rate = 0.0
+        self.error = None
+
+    @property
+    def point_time(self):
+        return 1 / max_reading_rate(self.nplc) + self.delay
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            self.configure()
+            sweep = 0
+            while not self.stop_event.is_set():
+                if self.trigger_link:
+                    self.run_triggered(sweep, start)
+                else:
+                    self.run_stepped(sweep, start)
+                sweep += 1
+                if not self.continuous:
+                    break
+        except Exception as err:
+            self.error = err
+        finally:
+            try:
+                self.source.write("SOUR:CURR 0; :OUTP OFF")
+            except Exception as err:
+                self.error = self.error or err
+            self.readings.put(None)
+
+    def configure(self):
+        self.source.write("SOUR:CURR:RANG:AUTO ON; :SOUR:CURR:COMP "
+                          + str(self.compliance)
+                          + "; :SOUR:CURR 0; :OUTP ON")
+        self.meter.write(":SENS:FUNC 'VOLT'; :SENS:VOLT:DFIL:STAT OFF")
+        self.voltmeter.set_rate(self.nplc)
+
+    def put(self, sweep, stamp, current, voltage):
+        self.readings.put((sweep, stamp, current, voltage))
+        self.count += 1
+        self.rate = self.count / max(stamp, 1E-9)
+
+    def run_stepped(self, sweep, start):
+        """Step the 6221 point by point and read the 2182a after each step.
+
+        READ? is sent to the 2182a right after the bias is set and its
+        answer is collected on the next pass, so the conversion runs while
+        the previous reading is handed off."""
+        self.meter.write(":FORM:DATA ASC; :TRIG:SOUR IMM; :TRIG:COUN 1"
+                         + "; :SAMP:COUN 1")
+        self.source.write("SOUR:CURR " + str(self.currents[0]))
+        time.sleep(self.delay)
+        self.meter.write("READ?")
+        for (i, current) in enumerate(self.currents):
+            voltage = float(self.meter.read())
+            stamp = time.perf_counter() - start
+            if i + 1 < len(self.currents) and not self.stop_event.is_set():
+                self.source.write("SOUR:CURR " + str(self.currents[i + 1]))
+                time.sleep(self.delay)
+                self.meter.write("READ?")
+            self.put(sweep, stamp, current, voltage)
+            if self.stop_event.is_set():
+                break
+
+    def run_triggered(self, sweep, start):
+        """Run the sweep as 6221 list sweeps that trigger the 2182a over the
+        trigger link, one 2182a buffer's worth of points at a time.
+
+        The readings of a segment are stamped evenly between arming and
+        collecting it--the 2182a does not return when each was taken."""
+        size = Keithley_dIdV_2182a.BUFFER_SIZE
+        for first in range(0, len(self.currents), size):
+            if self.stop_event.is_set():
+                break
+            segment = self.currents[first:first + size]
+            self.voltmeter.configure_buffer(len(segment), "EXT")
+            self.voltmeter.start()
+            self.source.write("SOUR:SWE:SPAC LIST; :SOUR:LIST:CURR "
+                              + ', '.join(str(x) for x in segment)
+                              + "; :" + self.delay_command
+                              + "; :SOUR:SWE:COUN 1; :TRIG:SOUR TLIN"
+                              + "; :TRIG:DIR SOUR; :TRIG:OLIN 2"
+                              + "; :TRIG:ILIN 1; :TRIG:OUTP DEL")
+            self.source.write("SOUR:SWE:ARM")
+            self.source.write("INIT:IMM")
+            armed = time.perf_counter() - start
+            poll = max(0.05, len(segment) * self.point_time / 20)
+            while (not self.voltmeter.buffer_full()
+                   and not self.stop_event.is_set()):
+                time.sleep(poll)
+            if self.stop_event.is_set():
+                self.voltmeter.abort()
+            volts = self.voltmeter.read_buffer()[:len(segment)]
+            done = time.perf_counter() - start
+            stamps = np.linspace(armed, done, len(volts) + 1)[1:]
+            for (stamp, current, voltage) in zip(stamps, segment, volts):
+                self.put(sweep, stamp, current, voltage)
+
+
+class IVGui(QtGui.QMainWindow):
+    """Window for the continuous IV program. The widgets are built here
+    rather than in a Designer file since there are only a handful."""
+
+    def __init__(self):
+        super().__init__()
+        self.init_ui()
+
+    def init_ui(self):
+        self.setWindowTitle("Keithley 6221/2182a IV")
+        self.rm = Keithley_dIdV_transport.open_transport()
+        self.source = None
+        self.meter = None
+        self.acquisition = None
+        self.currentfile = None
+        self.sweep_curves = {}
+        self.plot_data = {}
+
+        self.SourceGPIB = QtGui.QSpinBox()
+        self.SourceGPIB.setValue(12)
+        self.MeterGPIB = QtGui.QSpinBox()
+        self.MeterGPIB.setValue(7)
+        self.StartCurr = self.current_field(-100.0)
+        self.StopCurr = self.current_field(100.0)
+        self.StepSize = self.current_field(1.0)
+        self.Rate = QtGui.QDoubleSpinBox()
+        self.Rate.setRange(0.01, 60)
+        self.Rate.setValue(1)
+        self.TriggerLink = QtGui.QCheckBox("Use trigger link")
+        self.Delay = QtGui.QDoubleSpinBox()
+        self.Delay.setRange(0, 9999)
+        self.TriggerLink.toggled.connect(self.update_delay_range)
+        self.ComplianceVoltage = QtGui.QDoubleSpinBox()
+        self.ComplianceVoltage.setRange(0.1, 105)
+        self.ComplianceVoltage.setValue(10)
+        self.Bidirectional = QtGui.QCheckBox("Sweep back to start")
+        self.Continuous = QtGui.QCheckBox("Continuous")
+        self.Continuous.setChecked(True)
+        self.FilePath = QtGui.QLineEdit()
+        self.FilePath.setReadOnly(True)
+        self.SaveNewButton = QtGui.QPushButton("Save As")
+        self.StartButton = QtGui.QPushButton("Start")
+        self.StopButton = QtGui.QPushButton("Stop")
+        self.ClearButton = QtGui.QPushButton("Clear Graph")
+        self.ExitButton = QtGui.QPushButton("Exit")
+        self.PlotWidget = pg.PlotWidget(labels={"bottom": "Current (A)",
+                                                "left": "Voltage (V)"})
+
+        form = QtGui.QFormLayout()
+        for (label, widget) in (("6221 GPIB", self.SourceGPIB),
+                                ("2182a GPIB", self.MeterGPIB),
+                                ("Start Current (uA)", self.StartCurr),
+                                ("Stop Current (uA)", self.StopCurr),
+                                ("Step Size (uA)", self.StepSize),
+                                ("Meas. Rate (PLC)", self.Rate),
+                                ("Delay (ms)", self.Delay),
+                                ("Compliance (V)", self.ComplianceVoltage),
+                                ("", self.TriggerLink),
+                                ("", self.Bidirectional),
+                                ("", self.Continuous),
+                                ("File", self.FilePath),
+                                ("", self.SaveNewButton)):
+            form.addRow(label, widget)
+        buttons = QtGui.QHBoxLayout()
+        for button in (self.StartButton, self.StopButton, self.ClearButton,
+                       self.ExitButton):
+            buttons.addWidget(button)
+        layout = QtGui.QGridLayout()
+        layout.addLayout(form, 0, 0)
+        layout.addWidget(self.PlotWidget, 0, 1)
+        layout.addLayout(buttons, 1, 0, 1, 2)
+        layout.setColumnStretch(1, 1)
+        central = QtGui.QWidget()
+        central.setLayout(layout)
+        self.setCentralWidget(central)
+
+        self.StartButton.clicked.connect(self.run_measurement)
+        self.StopButton.clicked.connect(self.stop_measurement)
+        self.ClearButton.clicked.connect(self.clear_graphs)
+        self.SaveNewButton.clicked.connect(self.new_file)
+        self.ExitButton.clicked.connect(self.exit)
+        self.timer = QtCore.QTimer()
+        self.timer.timeout.connect(self.update_data)
+
+    def current_field(self, value):
+        field = QtGui.QDoubleSpinBox()
+        field.setRange(-105000, 105000)
+        field.setValue(value)
+        return field
+
+    def update_delay_range(self, trigger_link):
+        """The 6221's list sweep has a minimum source delay (SOUR:DEL); the
+        stepped mode can run with none."""
+        self.Delay.setMinimum(PARAMS["SOUR:DEL"].low * 1E3 if trigger_link
+                              else 0)
+
+    def resource_name(self, address):
+        return "GPIB0::" + str(address) + "::INSTR"
+
+    def connect_instruments(self):
+        """Open both instruments on their own addresses. The 6221 is opened
+        over the configured transport (GPIB or LAN); the 2182a has no LAN
+        port, so it is always opened over GPIB."""
+        resources = self.rm.list_resources()
+        found = self.rm.find(resources, self.SourceGPIB.value())
+        if not found:
+            raise IOError("6221 not found")
+        self.source = self.rm.open_resource(found[0])
+        meter_rm = (self.rm if any('GPIB' in x for x in resources)
+                    else Keithley_dIdV_transport.open_transport("gpib"))
+        self.meter = meter_rm.open_resource(
+                self.resource_name(self.MeterGPIB.value()))
+        self.source.write("*RST; OUTP:RESP FAST")
+        self.meter.write("*RST")
+
+    def new_file(self):
+        filename = QFileDialog.getSaveFileName(None, 'Title', '',
+                                               'TXT (*.txt)')
+        if filename[0]:
+            self.currentfile = open(filename[0], 'w')
+            self.FilePath.setText(filename[0])
+
+    def header_string(self):
+        return ("Measured IV \n"
+                + "Start Current (uA) = " + str(self.StartCurr.value()) + "\t"
+                + "Stop Current (uA) = " + str(self.StopCurr.value()) + "\t"
+                + "Step Size (uA) = " + str(self.StepSize.value()) + "\t"
+                + "Rate (PLC) = " + str(self.Rate.value()) + "\t"
+                + "Delay (ms) = " + str(self.Delay.value()) + "\t"
+                + "Compliance Voltage (V) = "
+                + str(self.ComplianceVoltage.value()) + "\t"
+                + "Trigger Link = " + str(self.TriggerLink.isChecked())
+                + "\n\n"
+                + "Sweep\ttimestamp (s"
+                + (", interpolated" if self.TriggerLink.isChecked() else "")
+                + ")\tCurrent (A)\tVoltage (V)\n")
+
+    def run_measurement(self):
+        if self.acquisition and self.acquisition.is_alive():
+            return
+        try:
+            self.connect_instruments()
+        except Exception as err:
+            self.statusBar().showMessage("Could not connect: " + str(err))
+            return
+        try:
+            self.acquisition = IVAcquisition(
+                    self.source, self.meter,
+                    iv_currents(self.StartCurr.value() * 1E-6,
+                                self.StopCurr.value() * 1E-6,
+                                self.StepSize.value() * 1E-6,
+                                self.Bidirectional.isChecked()),
+                    nplc=self.Rate.value(),
+                    compliance=self.ComplianceVoltage.value(),
+                    delay=self.Delay.value() * 1E-3,
+                    trigger_link=self.TriggerLink.isChecked(),
+                    continuous=self.Continuous.isChecked())
+        except CommandError as err:
+            self.statusBar().showMessage("Could not start: " + str(err))
+            return
+        if self.currentfile:
+            self.currentfile.write(self.header_string())
+        self.StartButton.setEnabled(False)
+        self.acquisition.start()
+        self.timer.start(PLOT_INTERVAL)
+
+    def update_data(self):
+        """Save and plot everything the acquisition thread has read since
+        the last update."""
+        rows = []
+        finished = False
+        while True:
+            try:
+                row = self.acquisition.readings.get_nowait()
+            except queue.Empty:
+                break
+            if row is None:
+                finished = True
+                break
+            rows.append(row)
+        if rows:
+            if self.currentfile:
+                self.currentfile.write(''.join(
+                        '%d\t%.6E\t%+.6E\t%+.6E\n' % row for row in rows))
+            for (sweep, stamp, current, voltage) in rows:
+                data = self.plot_data.setdefault(sweep, ([], []))
+                data[0].append(current)
+                data[1].append(voltage)
+            for sweep in set(row[0] for row in rows):
+                if sweep not in self.sweep_curves:
+                    self.sweep_curves[sweep] = self.PlotWidget.plot(
+                            pen=pg.intColor(sweep, hues=9))
+                self.sweep_curves[sweep].setData(*self.plot_data[sweep])
+            self.statusBar().showMessage(
+                    "%d readings, %.1f readings/s (2182a maximum %.1f)"
+                    % (self.acquisition.count, self.acquisition.rate,
+                       max_reading_rate(self.acquisition.nplc)))
+        if finished:
+            self.finish_measurement()
+
+    def finish_measurement(self):
+        self.timer.stop()
+        if self.acquisition.error:
+            self.statusBar().showMessage(
+                    "Measurement stopped: " + str(self.acquisition.error))
+        if self.currentfile:
+            self.currentfile.close()
+            self.currentfile = None
+            self.FilePath.setText("")
+        self.StartButton.setEnabled(True)
+
+    def stop_measurement(self):
+        if self.acquisition:
+            self.acquisition.stop()
+
+    def clear_graphs(self):
+        self.PlotWidget.clear()
+        self.sweep_curves = {}
+        self.plot_data = {}
+
+    def exit(self):
+        self.stop_measurement()
+        if self.acquisition:
+            self.acquisition.join(5)
+        sys.exit()
+
+
+def main():
+    """Execute the UI loop"""
+    app = QtGui.QApplication(sys.argv)
+    form = IVGui()
+    form.show()
+    app.exec_()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+This module holds the direct GPIB path to the 2182a--finding it on the bus,
+setting its range and rate without the RS-232 relay through the 6221, and
+running its own trace buffer and trigger model with a binary bulk read.
+
+Every voltmeter command relayed with SYST:COMM:SER:SEND goes out over the
+6221's serial port, which is much slower than GPIB. When the 2182a also has a
+GPIB address, its settings are written to it directly, and in the
+stand-alone (non-paired) measurements it fills its buffer on its own and the
+whole buffer comes back in one REAL,32 block.
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import Keithley_dIdV_buffer
+
+__author__ = "Sarah Friedensen"
+__credits__ = "Sarah Friedensen"
+__license__ = "GPL3+"
+__version__ = "1.0"
+__maintainer__ = "Sarah Friedensen"
+__email__ = "safrie@sas.upenn.edu"
+__status__ = "Development"
+
+MODEL = "MODEL 2182"
+BUFFER_SIZE = 1024
+MIN_BUFFER = 2
+VALUE_BYTES = 4  # per REAL,32 reading
+
+
+def find_voltmeter(rm, resources, exclude=()):
+    """Return the first GPIB resource in resources that answers *IDN? as a
+    2182(a), or None. Resources in exclude (e.g. the 6221) are skipped."""
+    for name in resources:
+        if 'GPIB' not in name or name in exclude:
+            continue
+        try:
+            instrument = rm.open_resource(name)
+            if MODEL in instrument.query("*IDN?").upper():
+                return name
+        except Exception:
+            continue
+    return None
+
+
+class Voltmeter2182a(object):
+    """Thin wrapper around a 2182a VISA resource.
+
+    The buffered acquisition is: configure_buffer() to set up the trigger
+    model and trace buffer, start() to arm it, then poll buffer_full() and
+    collect everything with read_buffer()."""
+
+    def __init__(self, resource):
+        self.resource = resource
+        self.points = 0
+
+    def write(self, cmd):
+        self.resource.write(cmd)
+
+    def query(self, cmd):
+        return self.resource.query(cmd)
+
+    def set_range(self, value):
+        """Fixed voltage range (V)."""
+        self.write(":SENS:VOLT:RANG " + str(value))
+
+    def set_rate(self, nplc):
+        """Integration time in power line cycles."""
+        self.write(":SENS:VOLT:NPLC " + str(nplc))
+
+    def configure_buffer(self, points, trigger_source="IMM"):
+        """Set up the trigger model and trace buffer for points readings.
+
+        trigger_source is IMM (the 2182a free-runs at its own rate) or EXT
+        (one reading per trigger link pulse). The buffer is read back as
+        big-endian REAL,32."""
+        self.points = min(max(int(points), MIN_BUFFER), BUFFER_SIZE)
+        self.write(":ABOR; :TRAC:CLE; :TRAC:POIN " + str(self.points)
+                   + "; :TRAC:FEED SENS; :TRAC:FEED:CONT NEXT"
+                   + "; :TRIG:SOUR " + trigger_source
+                   + "; :TRIG:COUN " + str(self.points)
+                   + "; :SAMP:COUN 1; :FORM:DATA REAL,32; :FORM:BORD NORM")
+        return self.points
+
+    def start(self):
+        self.write(":INIT")
+
+    def buffer_full(self):
+        """True once the buffer has stopped filling (FEED:CONT back to
+        NEVer)."""
+        return "NEV" in self.query(":TRAC:FEED:CONT?")
+
+    def read_buffer(self):
+        """Read the whole trace buffer as one binary block. The block is
+        indefinite (#0), so it is read by its length, points readings."""
+        self.write(":TRAC:DATA?")
+        return Keithley_dIdV_buffer.decode_binary(
+                self.resource.read_raw(VALUE_BYTES * self.points))
+
+    def abort(self):
+        self.write(":ABOR; :TRAC:FEED:CONT NEV")
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+"""
+This module holds the analysis functions for saved dI/dV data--loading the
+reading/source/timestamp columns, numerical derivatives (Savitzky-Golay and
+finite difference) for dV/dI and dI/dV, cumulative trapezoid integration of
+differential conductance data back to V(I), and conversion between the
+reading units of the 6221 (UNIT V, SIEM, OHMS, W).
+
+All functions work on NumPy arrays along the last axis, so a batch of runs
+with the same number of points can be passed as a (runs x points) array.
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import numpy as np
+import Keithley_dIdV_buffer
+
+__author__ = "Sarah Friedensen"
+__credits__ = "Sarah Friedensen"
+__license__ = "GPL3+"
+__version__ = "1.0"
+__maintainer__ = "Sarah Friedensen"
+__email__ = "safrie@sas.upenn.edu"
+__status__ = "Development"
+
+# Reading units in the order of unit_switch / UnitsComboBox in the UI.
+UNITS = ("V", "S", "OHMS", "W_AVG", "W_PEAK")
+# Units of a differential reading that do not depend on the delta current.
+DIFFERENTIAL = ("S", "OHMS")
+
+
+#%% Loading
+def load_data(filename):
+    """Read a data file written by the dI/dV program.
+
+    Returns a dict of float arrays keyed by the buffer element names in
+    Keithley_dIdV_buffer.ELEMENTS. Header lines are skipped."""
+    with open(filename) as datafile:
+        rows = [line for line in datafile.read().splitlines()
+                if line[:1] in "+-.0123456789" and line.strip()]
+    values = np.array(' '.join(rows).split(), dtype=float)
+    columns = values.reshape(-1, Keithley_dIdV_buffer.NUM_ELEMENTS).T
+    return dict(zip(Keithley_dIdV_buffer.ELEMENTS, columns))
+
+
+def load_runs(filenames, element="READ"):
+    """Load one element from several files, stacked if the lengths match."""
+    runs = [load_data(x)[element] for x in filenames]
+    if len(set(len(x) for x in runs)) == 1:
+        return np.vstack(runs)
+    return runs
+
+
+#%% Derivatives
+def savgol_matrix(window, order, deriv=0):
+    """Savitzky-Golay coefficients for every position in the window.
+
+    Row t gives the weights that return the deriv-th derivative (per sample)
+    of the least-squares polynomial of the given order at position t, so the
+    middle row is the usual smoothing/derivative kernel and the outer rows
+    handle the ends of the data."""
+    if window % 2 == 0 or window <= order:
+        raise ValueError("Window must be odd and larger than the order")
+    positions = np.arange(window) - window // 2
+    vander = np.vander(positions, order + 1, increasing=True)
+    powers = np.arange(order + 1)
+    factor = np.ones(order + 1)
+    for i in range(deriv):
+        factor = factor * np.clip(powers - i, 0, None)
+    shifted = np.clip(powers - deriv, 0, None)
+    evaluate = factor * positions[:, None] ** shifted
+    return evaluate @ np.linalg.pinv(vander)
+
+
+def savgol_filter(y, window=11, order=2, deriv=0):
+    """Savitzky-Golay smoothing or derivative (per sample) along the last
+    axis, with polynomial fits at the ends instead of padding."""
+    y = np.asarray(y, dtype=float)
+    if y.shape[-1] < window:
+        raise ValueError("Need at least window points")
+    coefficients = savgol_matrix(window, order, deriv)
+    half = window // 2
+    windows = np.lib.stride_tricks.sliding_window_view(y, window, axis=-1)
+    return np.concatenate((y[..., :window] @ coefficients[:half].T,
+                           windows @ coefficients[half],
+                           y[..., -window:] @ coefficients[half + 1:].T),
+                          axis=-1)
+
+
+def derivative(y, x, method="savgol", window=11, order=2):
+    """dy/dx along the last axis.
+
+    method is "savgol" (smoothing derivative, x need not be evenly spaced as
+    long as it is monotonic) or "gradient" (second-order finite
+    differences)."""
+    y = np.asarray(y, dtype=float)
+    x = np.asarray(x, dtype=float)
+    if method == "gradient":
+        if x.ndim == 1:
+            return np.gradient(y, x, axis=-1)
+        return np.gradient(y, axis=-1) / np.gradient(x, axis=-1)
+    return (savgol_filter(y, window, order, 1)
+            / savgol_filter(np.broadcast_to(x, y.shape), window, order, 1))
+
+
+def dVdI(voltage, current, method="savgol", window=11, order=2):
+    """Differential resistance dV/dI from a V(I) curve."""
+    return derivative(voltage, current, method, window, order)
+
+
+def dIdV(voltage, current, method="savgol", window=11, order=2):
+    """Differential conductance dI/dV from a V(I) curve. Taken as 1/(dV/dI)
+    since the current is the controlled variable."""
+    return 1 / dVdI(voltage, current, method, window, order)
+
+
+#%% Integration
+def cumulative_trapezoid(y, x, initial=0.0):
+    """Cumulative trapezoid integral of y over x along the last axis. The
+    result has the same length as y and starts at initial."""
+    y = np.asarray(y, dtype=float)
+    x = np.asarray(x, dtype=float)
+    steps = 0.5 * (y[..., 1:] + y[..., :-1]) * np.diff(x, axis=-1)
+    out = np.empty(y.shape)
+    out[..., 0] = initial
+    np.cumsum(steps, axis=-1, out=out[..., 1:])
+    out[..., 1:] += np.asarray(initial)[..., None]
+    return out
+
+
+def integrate_dcon(reading, current, unit="V", delta=None, v0=0.0):
+    """Rebuild V(I) from differential conductance readings.
+
+    reading is in the given unit (see UNITS): differential resistance is
+    used directly and conductance inverted; a voltage reading is the change
+    in voltage for the delta current (A) and needs delta. v0 is the voltage
+    at the first current."""
+    resistance = convert_units(reading, unit, "OHMS", delta=delta)
+    return cumulative_trapezoid(resistance, current, v0)
+
+
+#%% Units
+def _to_volts(reading, unit, delta, current, duty_cycle):
+    if unit == "V":
+        return reading
+    elif unit == "OHMS":
+        return reading * delta
+    elif unit == "S":
+        return delta / reading
+    elif unit == "W_PEAK":
+        return reading / current
+    elif unit == "W_AVG":
+        return reading / (current * duty_cycle)
+    raise ValueError("Unknown unit " + str(unit))
+
+
+def _from_volts(volts, unit, delta, current, duty_cycle):
+    if unit == "V":
+        return volts
+    elif unit == "OHMS":
+        return volts / delta
+    elif unit == "S":
+        return delta / volts
+    elif unit == "W_PEAK":
+        return volts * current
+    elif unit == "W_AVG":
+        return volts * current * duty_cycle
+    raise ValueError("Unknown unit " + str(unit))
+
+
+def _check_units(from_unit, to_unit, delta, current):
+    """Raise ValueError for an unknown unit, or a conversion without the
+    delta or bias current it needs."""
+    for unit in (from_unit, to_unit):
+        if unit not in UNITS:
+            raise ValueError("Unknown unit " + str(unit))
+    if delta is None and set(DIFFERENTIAL) & set((from_unit, to_unit)):
+        raise ValueError("Converting " + from_unit + " to " + to_unit
+                         + " needs the delta current")
+    if current is None and (from_unit[0] == "W" or to_unit[0] == "W"):
+        raise ValueError("Converting " + from_unit + " to " + to_unit
+                         + " needs the bias current")
+
+
+def convert_units(reading, from_unit, to_unit, delta=None, current=None,
+                  duty_cycle=1.0):
+    """Convert readings between the 6221 reading units.
+
+    Units are names from UNITS or their index (units_index in the UI).
+    S and OHMS are each other's inverse. Converting between V and S or OHMS
+    needs the delta current (A) the differential reading was taken with;
+    converting to or from W needs the bias current (A) and, for average
+    power, the duty cycle (0-1). A missing one raises ValueError."""
+    from_unit = UNITS[from_unit] if isinstance(from_unit, int) else from_unit
+    to_unit = UNITS[to_unit] if isinstance(to_unit, int) else to_unit
+    reading = np.asarray(reading, dtype=float)
+    if from_unit == to_unit:
+        return reading
+    if set((from_unit, to_unit)) == set(DIFFERENTIAL):
+        return 1 / reading
+    _check_units(from_unit, to_unit, delta, current)
+    return _from_volts(_to_volts(reading, from_unit, delta, current,
+                                 duty_cycle),
+                       to_unit, delta, current, duty_cycle)
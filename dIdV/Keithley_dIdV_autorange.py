@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""
+This module holds the range pre-scan for the dI/dV program--a quick, coarse
+pass over the bias currents of a measurement that finds the largest voltage
+across the sample and picks the fixed 6221 and 2182a ranges for the real run.
+
+Autoranging (CURR:RANG:AUTO ON, RANG BEST and the 2182a's own autorange)
+slows every point, and a fixed range picked by hand either clips the data or
+throws away resolution. The source range needs no measurement: it is the
+smallest range that holds the largest bias current of the config. The
+voltage range is the smallest 2182a range that holds the largest reading of
+the pre-scan, with HEADROOM to spare for the points the pre-scan skipped.
+
+The pre-scan steps the 6221 DC output through up to SCAN_POINTS currents
+spanning the run, with the source on its fixed range and the 2182a on
+autorange at SCAN_NPLC, and turns the output off again afterwards. Each
+point is sourced only for the length of one short reading, but it is DC:
+pulsed modes see their pulse amplitude for a few ms per point.
+
+Usage:
+    scan = Keithley_dIdV_autorange.Prescan(source, voltmeter)
+    choice = scan.run(currents)
+    (choice.source_index, choice.volt_index)
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import time
+from collections import namedtuple
+import numpy as np
+import Keithley_dIdV_buffer
+import Keithley_dIdV_filters
+
+__author__ = "Sarah Friedensen"
+__credits__ = "Sarah Friedensen"
+__license__ = "GPL3+"
+__version__ = "1.0"
+__maintainer__ = "Sarah Friedensen"
+__email__ = "safrie@sas.upenn.edu"
+__status__ = "Development"
+
+# 6221 current ranges (A) in the order of SourceRangeValue in the UI.
+SOURCE_RANGES = (2E-9, 20E-9, 200E-9, 2E-6, 20E-6, 200E-6, 2E-3, 20E-3,
+                 100E-3)
+VOLT_RANGES = Keithley_dIdV_filters.VOLT_RANGES
+SOURCE_OVERRANGE = 1.05  # 6221 sources up to 105% of range
+VOLT_OVERRANGE = 1.2  # 2182a reads up to 120% of range
+HEADROOM = 1.25  # margin over the largest pre-scan reading
+SCAN_NPLC = 0.1
+SCAN_POINTS = 11
+OVERFLOW = Keithley_dIdV_buffer.OVERFLOW  # 2182a reading for an overload
+
+RangeChoice = namedtuple("RangeChoice", (
+        "peak_current", "peak_voltage", "source_index", "volt_index",
+        "elapsed"))
+
+
+def pick_range(peak, ranges, overrange=1.0):
+    """Index of the smallest range that holds peak, or of the largest
+    range if none does."""
+    for (i, value) in enumerate(ranges):
+        if abs(peak) <= value * overrange:
+            return i
+    return len(ranges) - 1
+
+
+def scan_points(low, high, count=SCAN_POINTS):
+    """count currents evenly spread from low to high (A)."""
+    return np.linspace(low, high, count)
+
+
+def thin(currents, count=SCAN_POINTS):
+    """At most count of currents, evenly spread and always including the
+    largest of each sign."""
+    currents = np.asarray(currents, dtype=float)
+    if len(currents) <= count:
+        return currents
+    picked = set(np.linspace(0, len(currents) - 1, count).astype(int))
+    picked.update((int(np.argmax(currents)), int(np.argmin(currents))))
+    return currents[sorted(picked)]
+
+
+class RelayedVoltmeter(object):
+    """The 2182a reached through the 6221's serial port, for stacks where
+    it has no GPIB address of its own."""
+
+    def __init__(self, source):
+        self.source = source
+
+    def write(self, cmd):
+        self.source.write("SYST:COMM:SER:SEND '" + cmd + "'")
+
+    def query(self, cmd):
+        self.write(cmd)
+        return self.source.query("SYST:COMM:SER:ENT?")
+
+
+class Prescan(object):
+    """Coarse pre-scan with the 6221 session source and the 2182a session
+    voltmeter (anything with write and query, such as
+    Keithley_dIdV_2182a.Voltmeter2182a). Without a voltmeter the 2182a is
+    reached through the 6221."""
+
+    def __init__(self, source, voltmeter=None):
+        self.source = source
+        self.voltmeter = voltmeter or RelayedVoltmeter(source)
+
+    def read_voltage(self):
+        reading = float(self.voltmeter.query(":READ?").split(',')[0])
+        return OVERFLOW if abs(reading) >= OVERFLOW else reading
+
+    def run(self, currents, restore_nplc=None):
+        """Pre-scan the bias currents (A) and return a RangeChoice.
+
+        restore_nplc is the 2182a rate to go back to afterwards. The 2182a
+        is left on autorange and the 6221 on the chosen fixed range with the
+        output off; set the chosen ranges before arming."""
+        start = time.perf_counter()
+        currents = thin(currents)
+        peak_current = float(np.max(np.abs(currents)))
+        source_index = pick_range(peak_current, SOURCE_RANGES,
+                                  SOURCE_OVERRANGE)
+        self.voltmeter.write(":SENS:VOLT:RANG:AUTO ON; :SENS:VOLT:NPLC "
+                             + str(SCAN_NPLC))
+        self.source.write("CURR:RANG:AUTO OFF; :CURR:RANG "
+                          + str(SOURCE_RANGES[source_index])
+                          + "; :CURR 0; :OUTP ON")
+        peak_voltage = 0.0
+        try:
+            for current in currents:
+                self.source.write("CURR " + repr(float(current)))
+                peak_voltage = max(peak_voltage, abs(self.read_voltage()))
+        finally:
+            self.source.write("CURR 0; :OUTP OFF")
+            if restore_nplc is not None:
+                self.voltmeter.write(":SENS:VOLT:NPLC " + str(restore_nplc))
+        return RangeChoice(
+                peak_current, peak_voltage, source_index,
+                pick_range(peak_voltage * HEADROOM, VOLT_RANGES,
+                           VOLT_OVERRANGE),
+                time.perf_counter() - start)
+
+    @staticmethod
+    def summary(choice):
+        return ("Pre-scan: peak %.3g A, %.3g V; ranges %g A, %g V (%.2f s)"
+                % (choice.peak_current, choice.peak_voltage,
+                   SOURCE_RANGES[choice.source_index],
+                   VOLT_RANGES[choice.volt_index], choice.elapsed))
@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+"""
+This module holds the benchmark suite for the dI/dV program--buffer decoding,
+de-interleaving, file writing, arm-sequence round trips, GUI construction and
+per-transport round-trip and bulk-transfer throughput. Everything runs
+against the simulated stack in Keithley_dIdV_fake, so no hardware is needed;
+the fake is also served over a loopback socket to measure the socket
+transport.
+
+Usage:
+    python Keithley_dIdV_bench.py [--output FILE] [--compare OLD_FILE]
+                                  [--transport gpib --transport socket ...]
+                                  [--replay TRANSCRIPT ...]
+
+Hardware transports given with --transport (see Keithley_dIdV_transport)
+are measured against the 6221 they find, with whatever is in its buffer.
+Transcripts given with --replay (see Keithley_dIdV_transcript) are used as
+fixtures: the buffer reads they hold go through the parse and save path, and
+their recorded bus time is reported by command.
+
+Results are written as JSON (by default to bench_results/bench_<version>.json)
+so that runs from different versions can be compared. The GUI benchmarks keep
+their discovery cache, checkpoint and tuning cache in a temporary directory,
+and if they cannot run the benchmark exits with an error (--no-gui skips
+them).
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import importlib
+import Keithley_dIdV_fake
+import Keithley_dIdV_buffer
+import Keithley_dIdV_transport
+import Keithley_dIdV_transcript
+
+__author__ = "Sarah Friedensen"
+__credits__ = "Sarah Friedensen"
+__license__ = "GPL3+"
+__version__ = "1.0"
+__maintainer__ = "Sarah Friedensen"
+__email__ = "safrie@sas.upenn.edu"
+__status__ = "Development"
+
+BUFFER_SIZES = (1000, 10000, 65536)
+TAB_NAMES = ("dIdV", "Delta", "FixedPulseDelta", "SweepPulseDelta")
+ROUND_TRIPS = 200
+FIRST_WINDOW_TARGET = 1.0  # s from process start to the window on screen
+
+# Run in a fresh interpreter so that module imports are part of the time.
+FIRST_WINDOW_SCRIPT = """
+import time
+start = time.perf_counter()
+import Keithley_dIdV_logic4 as logic
+app = logic.QtGui.QApplication([])
+gui = logic.dIdVGui()
+gui.show()
+app.processEvents()
+shown = time.perf_counter()
+gui.discovery.join()
+gui.check_discovery()
+print(shown - start, time.perf_counter() - start)
+"""
+
+
+def time_call(func, repeat=5):
+    """Call func repeat times and return timing statistics in seconds."""
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return {"min": times[0], "median": times[len(times) // 2],
+            "max": times[-1], "repeat": repeat}
+
+
+def filled_instrument(points, data_format):
+    """Return a fake 6221 with a full buffer in the requested data format."""
+    rm = Keithley_dIdV_fake.FakeResourceManager()
+    instrument = rm.open_resource(rm.list_resources()[0])
+    instrument.write("SOUR:DELT:HIGH 1e-6; LOW -1e-6")
+    instrument.write("TRAC:POIN " + str(points))
+    instrument.write("SOUR:DELT:ARM")
+    instrument.write("INIT:IMM")
+    instrument.write("FORM:DATA " + data_format)
+    return instrument
+
+
+#%% Benchmarks
+def bench_decode(repeat):
+    """ASCII vs. binary decode of a full buffer transfer."""
+    results = {}
+    for points in BUFFER_SIZES:
+        ascii_data = filled_instrument(points, "ASC").query("TRAC:DATA?")
+        binary = filled_instrument(points, "REAL,32")
+        binary.write("TRAC:DATA?")
+        binary_data = binary.read_raw()
+        results[str(points)] = {
+                "ascii_bytes": len(ascii_data),
+                "binary_bytes": len(binary_data),
+                "ascii_split": time_call(
+                        lambda: Keithley_dIdV_buffer.split_ascii(ascii_data),
+                        repeat),
+                "ascii_decode": time_call(
+                        lambda: Keithley_dIdV_buffer.decode_ascii(ascii_data),
+                        repeat),
+                "binary_decode": time_call(
+                        lambda: Keithley_dIdV_buffer.decode_binary(
+                                binary_data), repeat)
+                }
+    return results
+
+
+def bench_save(repeat):
+    """De-interleave and file-write throughput for a full buffer."""
+    results = {}
+    for points in BUFFER_SIZES:
+        fields = Keithley_dIdV_buffer.split_ascii(
+                filled_instrument(points, "ASC").query("TRAC:DATA?"))
+        values = Keithley_dIdV_buffer.decode_ascii(','.join(fields))
+        with tempfile.TemporaryFile('w') as savefile:
+            def write_strings():
+                savefile.seek(0)
+                savefile.write(Keithley_dIdV_buffer.format_rows(fields))
+
+            def write_values():
+                savefile.seek(0)
+                savefile.write(Keithley_dIdV_buffer.format_values(values))
+
+            results[str(points)] = {
+                    "deinterleave": time_call(
+                            lambda: Keithley_dIdV_buffer.deinterleave(fields),
+                            repeat),
+                    "write_strings": time_call(write_strings, repeat),
+                    "write_values": time_call(write_values, repeat)
+                    }
+        for k in ("write_strings", "write_values"):
+            results[str(points)][k]["points_per_s"] = (
+                    points / results[str(points)][k]["median"])
+    return results
+
+
+def bench_instrument(instrument, repeat):
+    """Query round trip and full-buffer transfer over one open resource."""
+    def round_trips():
+        for i in range(ROUND_TRIPS):
+            instrument.query("*IDN?")
+
+    def bulk(data_format):
+        instrument.write("FORM:DATA " + data_format)
+        instrument.write("TRAC:DATA?")
+        return len(instrument.read_raw())
+
+    results = {"round_trip": time_call(round_trips, repeat)}
+    results["round_trip"]["per_query"] = (results["round_trip"]["median"]
+                                          / ROUND_TRIPS)
+    for data_format in ("ASC", "REAL,32"):
+        size = bulk(data_format)
+        timing = time_call(lambda: bulk(data_format), repeat)
+        timing["bytes"] = size
+        timing["bytes_per_s"] = size / timing["median"]
+        results["bulk_" + data_format.split(',')[0].lower()] = timing
+    instrument.write("FORM:DATA ASC")
+    return results
+
+
+def bench_transport(repeat, hardware=()):
+    """Round-trip latency and bulk throughput per transport."""
+    points = BUFFER_SIZES[-1]
+    results = {"fake": bench_instrument(filled_instrument(points, "ASC"),
+                                        repeat)}
+    server = Keithley_dIdV_fake.FakeSocketServer(
+            filled_instrument(points, "ASC"))
+    server.start()
+    transport = Keithley_dIdV_transport.SocketTransport(server.host,
+                                                        server.port)
+    instrument = transport.open_resource(transport.list_resources()[0])
+    results["socket_loopback"] = bench_instrument(instrument, repeat)
+    instrument.close()
+    server.close()
+    for name in hardware:
+        transport = Keithley_dIdV_transport.open_transport(name)
+        found = transport.find(transport.list_resources(), 12)
+        if not found:
+            results[name] = {"skipped": "no 6221 found"}
+            continue
+        instrument = transport.open_resource(found[0])
+        results[name] = bench_instrument(instrument, repeat)
+        instrument.close()
+    return results
+
+
+def bench_replay(paths, repeat):
+    """Parse and save the buffer reads in recorded transcripts, and sum up
+    the recorded bus time per command."""
+    results = {}
+    for path in paths:
+        (header, entries) = Keithley_dIdV_transcript.load_transcript(path)
+        reads = [x[4] for x in entries
+                 if x[2] == "query" and "TRAC:DATA" in x[3]]
+
+        def parse_and_save():
+            with tempfile.TemporaryFile('w') as savefile:
+                for data in reads:
+                    fields = Keithley_dIdV_buffer.split_ascii(data)
+                    Keithley_dIdV_buffer.decode_fields(fields)
+                    savefile.write(Keithley_dIdV_buffer.format_rows(
+                            fields, leading=''))
+
+        bus = {}
+        for entry in entries:
+            command = (
+                    entry[2]
+                    if entry[1] == Keithley_dIdV_transcript.TRANSPORT
+                    or not entry[3] else entry[3].split(' ')[0].rstrip(';'))
+            (count, total) = bus.get(command, (0, 0.0))
+            bus[command] = (count + 1, total + entry[5])
+        results[os.path.basename(path)] = {
+                "recorded": header.get("recorded"),
+                "transport": header.get("transport"),
+                "entries": len(entries),
+                "buffer_reads": len(reads),
+                "parse_and_save": time_call(parse_and_save, repeat),
+                "bus_time": {k: {"calls": v[0], "seconds": v[1]}
+                             for (k, v) in bus.items()}
+                }
+    return results
+
+
+def fake_environment(directory):
+    """Environment variables that run the GUI against the simulated stack,
+    with the files it keeps between runs in directory instead of the user's
+    home directory."""
+    return {"KEITHLEY_TRANSPORT": "fake",
+            "KEITHLEY_CACHE": os.path.join(directory, "discovery.json"),
+            "KEITHLEY_CHECKPOINT": os.path.join(directory, "checkpoint.json"),
+            "KEITHLEY_TUNING_CACHE": os.path.join(directory, "tuning.json")}
+
+
+def load_logic(directory):
+    """Import the GUI module with the simulated stack as its transport."""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    os.environ.update(fake_environment(directory))
+    return importlib.import_module("Keithley_dIdV_logic4")
+
+
+def qt_application(logic):
+    app = logic.QtGui.QApplication.instance()
+    return app if app else logic.QtGui.QApplication([])
+
+
+def first_window(directory):
+    """Time from interpreter start to the window being shown, and to the
+    instruments being connected, in a fresh process."""
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen",
+               **fake_environment(directory))
+    try:
+        output = subprocess.run(
+                [sys.executable, "-c", FIRST_WINDOW_SCRIPT], env=env,
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                capture_output=True, text=True, check=True).stdout
+    except subprocess.CalledProcessError as err:
+        return {"failed": (err.stderr.strip().splitlines() or ["failed"])[-1]}
+    (shown, connected) = (float(x) for x in output.split()[-2:])
+    return {"shown": shown, "connected": connected,
+            "target": FIRST_WINDOW_TARGET,
+            "within_target": shown <= FIRST_WINDOW_TARGET}
+
+
+def bench_gui(repeat):
+    """dIdVGui construction time and arm round trips per tab."""
+    with tempfile.TemporaryDirectory(prefix="keithley_bench_") as directory:
+        return gui_timings(repeat, directory)
+
+
+def gui_timings(repeat, directory):
+    logic = load_logic(directory)
+    app = qt_application(logic)
+    results = {"construct": time_call(logic.dIdVGui, repeat), "arm": {},
+               "first_window": first_window(directory)}
+    gui = logic.dIdVGui()
+    gui.discovery.join()
+    gui.check_discovery()
+    for (tab, name) in enumerate(TAB_NAMES):
+        gui.TabWidget.setCurrentIndex(tab)
+        gui.update_tab()
+        # A mode is only armed into an empty buffer.
+        gui.clear_buffer()
+        gui.I_source.reset_counters()
+        timing = time_call(gui.arm_mode, 1)
+        results["arm"][name] = {
+                "time": timing["median"],
+                "writes": gui.I_source.writes,
+                "queries": gui.I_source.queries,
+                "round_trips": gui.I_source.round_trips
+                }
+    gui.close()
+    app.processEvents()
+    return results
+
+
+def run(repeat=5, gui=True, hardware=(), transcripts=()):
+    results = {
+            "version": __version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "decode": bench_decode(repeat),
+            "save": bench_save(repeat),
+            "transport": bench_transport(repeat, hardware)
+            }
+    if transcripts:
+        results["replay"] = bench_replay(transcripts, repeat)
+    if gui:
+        try:
+            results["gui"] = bench_gui(repeat)
+        except ImportError as err:
+            results["gui"] = {"failed": str(err)}
+    return results
+
+
+def compare(new, old, path=()):
+    """Yield (path, old, new) for every median timing in both result sets."""
+    for k, v in new.items():
+        if isinstance(v, dict) and isinstance(old.get(k), dict):
+            if "median" in v and "median" in old[k]:
+                yield path + (k,), old[k]["median"], v["median"]
+            else:
+                yield from compare(v, old[k], path + (k,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("--output", default=os.path.join(
+            "bench_results", "bench_" + __version__ + ".json"))
+    parser.add_argument("--compare", default=None,
+                        help="earlier result file to compare against")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--no-gui", action="store_true")
+    parser.add_argument("--transport", action="append", default=[],
+                        choices=("gpib", "tcpip", "socket"),
+                        help="also measure this hardware transport")
+    parser.add_argument("--replay", action="append", default=[],
+                        help="transcript to use as a fixture")
+    args = parser.parse_args()
+
+    results = run(args.repeat, not args.no_gui, args.transport, args.replay)
+    if os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w') as resultfile:
+        json.dump(results, resultfile, indent=2, sort_keys=True)
+    print("Results written to " + args.output)
+    if not results.get("gui", {}).get("first_window", {}).get(
+            "within_target", True):
+        print("Time to first window %.2f s is over the %.2f s target"
+              % (results["gui"]["first_window"]["shown"],
+                 FIRST_WINDOW_TARGET))
+
+    if args.compare:
+        with open(args.compare) as oldfile:
+            old = json.load(oldfile)
+        out = io.StringIO()
+        for (path, before, after) in compare(results, old):
+            out.write("%-50s %10.3e %10.3e %7.2fx\n"
+                      % ('/'.join(path), before, after, before / after))
+        print("benchmark" + ' ' * 41 + "   old (s)    new (s)  speedup")
+        print(out.getvalue())
+
+    gui = results.get("gui", {})
+    failed = gui.get("failed") or gui.get("first_window", {}).get("failed")
+    if failed:
+        sys.exit("GUI benchmark failed: " + failed
+                 + " (run with --no-gui to leave it out)")
+
+
+if __name__ == '__main__':
+    main()
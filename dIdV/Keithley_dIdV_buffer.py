@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""
+This module holds the functions that turn the contents of the 6221 trace
+buffer into data--decoding ASCII and binary transfers, checking that a
+transfer is whole, splitting the interleaved reading elements into columns,
+and formatting rows for the save file.
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import numpy as np
+
+__author__ = "Sarah Friedensen"
+__credits__ = "Sarah Friedensen"
+__license__ = "GPL3+"
+__version__ = "1.0"
+__maintainer__ = "Sarah Friedensen"
+__email__ = "safrie@sas.upenn.edu"
+__status__ = "Development"
+
+# Elements requested with FORM:ELEM, in the order they come out of the buffer.
+ELEMENTS = ("READ", "TST", "RNUM", "SOUR", "AVOL")
+ELEMENT_STRING = ", ".join(ELEMENTS)
+NUM_ELEMENTS = len(ELEMENTS)
+COLUMNS = {x: i for (i, x) in enumerate(ELEMENTS)}
+OVERFLOW = 9.9E37  # stored for a reading over range
+INVALID = 9.91E37  # stored when no valid reading could be taken
+FETCH_TRIES = 3  # transfers of a range before keeping what came back
+
+
+def split_ascii(data):
+    """Split an ASCII TRAC:DATA? response into its string fields."""
+    return data.strip().split(',')
+
+
+def decode_ascii(data):
+    """Decode an ASCII TRAC:DATA? response into a float array."""
+    return np.array(split_ascii(data), dtype=float)
+
+
+def decode_fields(fields, num_elements=NUM_ELEMENTS):
+    """Convert string fields into a (readings x elements) float array."""
+    return np.array(fields, dtype=float).reshape(-1, num_elements)
+
+
+def check_transfer(fields, count, previous=None):
+    """Decode and check the string fields of a transfer of count readings.
+    previous is the reading just before the first one, if there is one.
+
+    Returns (values, problems): the (readings x elements) array, or None if
+    the fields do not decode, and a list of what is wrong with the transfer
+    (the wrong number of readings, gaps in the reading numbers, timestamps
+    going backwards). A transfer with problems is worth fetching again."""
+    if len(fields) % NUM_ELEMENTS:
+        return (None, ["%d fields are not whole readings" % len(fields)])
+    try:
+        values = decode_fields(fields)
+    except ValueError:
+        return (None, ["Fields do not decode"])
+    problems = []
+    if len(values) != count:
+        problems.append("%d of %d readings" % (len(values), count))
+    (numbers, times) = (values[:, COLUMNS["RNUM"]], values[:, COLUMNS["TST"]])
+    if previous is not None:
+        numbers = np.concatenate(([previous[COLUMNS["RNUM"]]], numbers))
+        times = np.concatenate(([previous[COLUMNS["TST"]]], times))
+    gaps = np.flatnonzero(np.diff(numbers) != 1)
+    if len(gaps):
+        problems.append("reading number jumps from %d to %d%s"
+                        % (numbers[gaps[0]], numbers[gaps[0] + 1],
+                           " (%d gaps)" % len(gaps) if len(gaps) > 1 else ""))
+    backwards = np.count_nonzero(np.diff(times) < 0)
+    if backwards:
+        problems.append("timestamp goes backwards %d times" % backwards)
+    return (values, problems)
+
+
+def find_sentinels(values, elements=("READ", "AVOL")):
+    """Indices of the readings with an over range or invalid value (or a
+    value that is not finite) in any of elements."""
+    columns = values[:, [COLUMNS[x] for x in elements]]
+    bad = ~np.isfinite(columns) | (np.abs(columns) >= OVERFLOW)
+    return np.flatnonzero(bad.any(axis=1))
+
+
+def decode_binary(raw, byte_order='>'):
+    """Decode a REAL,32 TRAC:DATA? response into a float array.
+
+    Accepts both the indefinite (#0) and definite (#<n><length>) IEEE-488.2
+    block headers. byte_order is '>' for FORM:BORD NORM and '<' for SWAP."""
+    if raw[:1] != b'#':
+        raise ValueError("Binary block does not start with '#'")
+    digits = int(raw[1:2])
+    if digits:
+        length = int(raw[2:2 + digits])
+        payload = raw[2 + digits:2 + digits + length]
+    else:
+        payload = raw[2:]
+        payload = payload[:len(payload) - len(payload) % 4]
+    return np.frombuffer(payload, dtype=byte_order + 'f4').astype(float)
+
+
+def deinterleave(values, num_elements=NUM_ELEMENTS):
+    """Split interleaved readings into one sequence per element."""
+    return [values[i::num_elements] for i in range(num_elements)]
+
+
+def format_rows(fields, num_elements=NUM_ELEMENTS, leading='\n'):
+    """Format string fields as tab-separated rows, one reading per line.
+
+    Pass leading='' when appending to rows that were already written."""
+    return (leading
+            + '\n'.join('\t'.join(fields[i:i + num_elements])
+                        for i in range(0, len(fields), num_elements))
+            + '\n')
+
+
+def format_values(values, num_elements=NUM_ELEMENTS, fmt='%+.6E'):
+    """Format a float array the same way format_rows formats strings."""
+    rows = np.asarray(values).reshape(-1, num_elements)
+    line = '\t'.join([fmt] * num_elements)
+    return '\n' + '\n'.join(line % tuple(row) for row in rows.tolist()) + '\n'
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+"""
+This module holds the run checkpoints of the dI/dV program--a small record,
+rewritten after every chunk of readings is saved, of where a run had got to,
+so a run cut short by a crash or a restart can be finished instead of taken
+again.
+
+A checkpoint holds the data file and the byte offsets in it, the tab and
+its config (with a hash to check it by), the UI settings of the run, the
+readings saved so far and the reading number and timestamp of the last one.
+It is deleted when the run ends normally (or is stopped); one that is still
+there at startup is an unfinished run.
+
+An unfinished run is recovered from the 6221 buffer if the buffer still
+holds it: the reading at the checkpointed position must have the
+checkpointed reading number and timestamp. The readings of that arm are then
+read again from the start of the buffer (and the rest as the 6221 takes
+them). Otherwise the run is resumed at the next unmeasured segment (see
+Keithley_dIdV_modes.Mode.remaining): readings of a partly measured segment
+are dropped from the file and the rest of the run is armed and appended
+after a note line.
+
+Checkpoints are kept in ~/.keithley_dIdV_checkpoint.json, or wherever
+KEITHLEY_CHECKPOINT points.
+
+Usage:
+    checkpoint = Keithley_dIdV_checkpoint.load()
+    if checkpoint and checkpoint.buffer_intact(source):
+        rows = Keithley_dIdV_checkpoint.saved_rows(checkpoint.path,
+                                                   checkpoint.offset)
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import os
+import json
+import time
+import hashlib
+import Keithley_dIdV_buffer
+import Keithley_dIdV_config
+
+__author__ = "Sarah Friedensen"
+__credits__ = "Sarah Friedensen"
+__license__ = "GPL3+"
+__version__ = "1.0"
+__maintainer__ = "Sarah Friedensen"
+__email__ = "safrie@sas.upenn.edu"
+__status__ = "Development"
+
+CHECKPOINT_FILE = os.environ.get(
+        "KEITHLEY_CHECKPOINT",
+        os.path.join(os.path.expanduser("~"),
+                     ".keithley_dIdV_checkpoint.json"))
+# Getter and setter of each kind of settings widget, most specific first.
+ACCESSORS = (("currentIndex", "setCurrentIndex"),
+             ("isChecked", "setChecked"),
+             ("value", "setValue"),
+             ("text", "setText"))
+
+
+def config_hash(config):
+    """Hash of a mode config that is the same from one session to the
+    next (hash() of strings is not). Values are hashed as strings, so a
+    setting held as 5.0 or "5.0" hashes the same."""
+    text = repr((type(config).__name__,) + tuple(str(x) for x in config))
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def read_widgets(widgets):
+    """{name: value} of the settings widgets in widgets ({name: widget})."""
+    state = {}
+    for (name, widget) in widgets.items():
+        for (getter, setter) in ACCESSORS:
+            if hasattr(widget, getter):
+                state[name] = getattr(widget, getter)()
+                break
+    return state
+
+
+def restore_widgets(widgets, state):
+    """Set the widgets in widgets ({name: widget}) to the values of state
+    without sending their signals."""
+    for (name, value) in state.items():
+        widget = widgets.get(name)
+        if widget is None:
+            continue
+        for (getter, setter) in ACCESSORS:
+            if hasattr(widget, getter):
+                blocked = widget.blockSignals(True)
+                getattr(widget, setter)(value)
+                widget.blockSignals(blocked)
+                break
+
+
+def saved_rows(path, end):
+    """[(offset, fields)] of each reading saved in the data file at path
+    before byte end: where its line starts and its string fields. Header
+    and note lines are skipped."""
+    with open(path, 'rb') as datafile:
+        text = datafile.read(end)
+    rows = []
+    offset = 0
+    for line in text.splitlines(True):
+        stripped = line.strip().decode()
+        if stripped and stripped[:1] in "+-.0123456789":
+            rows.append((offset, stripped.split()))
+        offset += len(line)
+    return rows
+
+
+class Checkpoint(object):
+    """Where a run had got to.
+        path            data file
+        tab, mode       tab index and mode name of the run
+        config_type     class name (in Keithley_dIdV_config) of its config
+        config_values   the config's values
+        config_hash     config_hash() of the config
+        widgets         UI settings of the run (see read_widgets)
+        expected        readings the current arm of the 6221 stores
+        resumed_from    readings of the run saved before the current arm
+        buffer_offset   byte offset in path of the current arm's readings
+        buffer_points   readings of the current arm saved so far
+        offset          byte offset in path after the last saved reading
+        last_reading    [reading number, timestamp] of that reading
+        segment_points  readings per segment of the mode
+        saved           time of the last save"""
+
+    FIELDS = ("path", "tab", "mode", "config_type", "config_values",
+              "config_hash", "widgets", "expected",
+              "resumed_from", "buffer_offset", "buffer_points", "offset",
+              "last_reading", "segment_points", "saved")
+
+    def __init__(self, **values):
+        for name in self.FIELDS:
+            setattr(self, name, values.get(name))
+
+    @property
+    def points(self):
+        """Readings of the run saved so far."""
+        return self.resumed_from + self.buffer_points
+
+    @property
+    def segments_done(self):
+        return self.points // self.segment_points
+
+    def run_config(self):
+        """The config of the run, or None if it does not match its
+        hash."""
+        try:
+            config = getattr(Keithley_dIdV_config, self.config_type)(
+                    *self.config_values)
+        except (AttributeError, TypeError):
+            return None
+        return config if config_hash(config) == self.config_hash else None
+
+    def update(self, points, offset, last_reading):
+        """Record readings of the current arm saved up to byte offset, the
+        last of them with last_reading (reading number, timestamp)."""
+        self.buffer_points = int(points)
+        self.offset = int(offset)
+        self.last_reading = [float(x) for x in last_reading]
+
+    def save(self, filename=None):
+        """Write the checkpoint; the old one is replaced in one step so a
+        crash mid-write leaves one or the other."""
+        filename = filename or CHECKPOINT_FILE
+        self.saved = time.time()
+        values = {x: getattr(self, x) for x in self.FIELDS}
+        values["segments_done"] = self.segments_done
+        try:
+            with open(filename + ".tmp", 'w') as checkfile:
+                json.dump(values, checkfile, indent=2)
+            os.replace(filename + ".tmp", filename)
+        except OSError:
+            pass
+
+    def buffer_intact(self, source):
+        """True if the 6221 buffer still holds the readings of the current
+        arm: the last saved one is there with the same reading number and
+        timestamp."""
+        if not self.buffer_points:
+            return False
+        try:
+            if int(source.query("TRAC:POIN:ACT?")) < self.buffer_points:
+                return False
+            values = Keithley_dIdV_buffer.decode_fields(
+                    Keithley_dIdV_buffer.split_ascii(source.query(
+                            "TRAC:DATA:SEL? " + str(self.buffer_points - 1)
+                            + ", 1")))
+        except ValueError:
+            return False
+        columns = Keithley_dIdV_buffer.COLUMNS
+        return (len(values) == 1
+                and [values[0, columns["RNUM"]], values[0, columns["TST"]]]
+                == self.last_reading)
+
+    def summary(self):
+        return ("%s run into %s stopped after %d readings (%d segments) on "
+                % (self.mode, self.path, self.points, self.segments_done)
+                + time.strftime("%Y-%m-%d %H:%M:%S",
+                                time.localtime(self.saved)))
+
+
+def load(filename=None):
+    """The checkpoint of an unfinished run, or None."""
+    try:
+        with open(filename or CHECKPOINT_FILE) as checkfile:
+            values = json.load(checkfile)
+    except (OSError, ValueError):
+        return None
+    return Checkpoint(**{x: values.get(x) for x in Checkpoint.FIELDS})
+
+
+def clear(filename=None):
+    try:
+        os.remove(filename or CHECKPOINT_FILE)
+    except OSError:
+        pass
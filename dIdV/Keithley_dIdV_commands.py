@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""
+This module holds the SCPI command model for the part of the 6221/2182a
+command set the program uses--the allowed range of every parameter, the
+checks between parameters (pulse width against source delay and cycle
+interval, points against the buffer size), and the templates the commands
+are rendered from.
+
+Commands are checked here before anything is sent, so a bad setting is
+reported at once instead of coming back as an instrument error after a bus
+round trip (or not at all). Each template is built once when the module is
+loaded and rendering only fills in the values.
+
+Usage:
+    cmd = COMMANDS["delta"].render(high, low, delay, count, "OFF")
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+__author__ = "Sarah Friedensen"
+__credits__ = "Sarah Friedensen"
+__license__ = "GPL3+"
+__version__ = "1.0"
+__maintainer__ = "Sarah Friedensen"
+__email__ = "safrie@sas.upenn.edu"
+__status__ = "Development"
+
+MAX_CURRENT = 105E-3  # A
+MAX_BUFFER = 65536
+LINE_PERIOD = 1 / 60.0  # s per power line cycle
+TOLERANCE = 1E-9  # relative, for UI values converted to SI units at a limit
+
+
+class CommandError(ValueError):
+    """A command value or combination of values the instrument would
+    reject."""
+
+
+class Param(object):
+    """One command parameter: its type and either a range or a set of
+    allowed values."""
+
+    def __init__(self, kind=float, low=None, high=None, choices=None,
+                 unit=""):
+        self.kind = kind
+        self.low = low
+        self.high = high
+        self.choices = choices
+        self.unit = unit
+
+    def validate(self, header, value):
+        if self.choices:
+            value = str(value).upper()
+            if value not in self.choices:
+                raise CommandError(header + " must be one of "
+                                   + ', '.join(self.choices) + ", not "
+                                   + value)
+            return value
+        try:
+            value = self.kind(value)
+        except (TypeError, ValueError):
+            raise CommandError(header + " must be a number, not "
+                               + repr(value))
+        if ((self.low is not None
+                and value < self.low - TOLERANCE * abs(self.low))
+                or (self.high is not None
+                    and value > self.high + TOLERANCE * abs(self.high))):
+            raise CommandError(header + " = " + str(value) + " " + self.unit
+                               + " is outside " + str(self.low) + " to "
+                               + str(self.high) + " " + self.unit)
+        return value
+
+
+CURRENT = Param(float, -MAX_CURRENT, MAX_CURRENT, unit="A")
+ON_OFF = Param(choices=("ON", "OFF"))
+
+PARAMS = {
+        "SOUR:DCON:STAR": CURRENT,
+        "SOUR:DCON:STEP": CURRENT,
+        "SOUR:DCON:STOP": CURRENT,
+        "SOUR:DCON:DELTA": Param(float, 0, MAX_CURRENT, unit="A"),
+        "SOUR:DCON:DELAY": Param(float, 1E-3, 9999.999, unit="s"),
+        "SOUR:DCON:CAB": ON_OFF,
+        "SOUR:DELT:HIGH": CURRENT,
+        "SOUR:DELT:LOW": CURRENT,
+        "SOUR:DELT:DEL": Param(float, 1E-3, 9999.999, unit="s"),
+        "SOUR:DELT:COUN": Param(int, 1, MAX_BUFFER),
+        "SOUR:DELT:CAB": ON_OFF,
+        "SOUR:PDEL:HIGH": CURRENT,
+        "SOUR:PDEL:LOW": CURRENT,
+        "SOUR:PDEL:WIDT": Param(float, 50E-6, 12E-3, unit="s"),
+        "SOUR:PDEL:SDEL": Param(float, 16E-6, 11.966E-3, unit="s"),
+        "SOUR:PDEL:COUN": Param(int, 1, MAX_BUFFER),
+        "SOUR:PDEL:INT": Param(int, 5, 999999, unit="PLC"),
+        "SOUR:PDEL:SWE": ON_OFF,
+        "SOUR:PDEL:LME": Param(choices=("1", "2")),
+        "SOUR:SWE:COUN": Param(int, 1, 9999),
+        "SOUR:SWE:CAB": ON_OFF,
+        "SOUR:SWE:SPAC": Param(choices=("LIN", "LOG", "LIST")),
+        "SOUR:SWE:POIN": Param(int, 1, 65535),
+        "SOUR:DEL": Param(float, 1E-3, 999999.999, unit="s"),
+        "SOUR:CURR:STAR": CURRENT,
+        "SOUR:CURR:STOP": CURRENT,
+        "SOUR:CURR:STEP": CURRENT,
+        "TRAC:POIN": Param(int, 1, MAX_BUFFER),
+        "CURR:COMP": Param(float, 0.1, 105, unit="V"),
+        "SENS:AVER:TCON": Param(choices=("MOV", "REP")),
+        "SENS:AVER:WIND": Param(float, 0, 10, unit="%"),
+        "SENS:AVER:COUN": Param(int, 2, 300),
+        "SENS:VOLT:NPLC": Param(float, 0.01, 60, unit="PLC"),
+        "SENS:VOLT:RANG": Param(float, 0, 120, unit="V")
+        }
+
+
+#%% Checks between parameters
+def check_sweep(values, start, step, stop):
+    if not values[step]:
+        raise CommandError("Step size must not be zero")
+    if (values[stop] - values[start]) * values[step] < 0:
+        raise CommandError("Step size has the wrong sign for a sweep from "
+                           + str(values[start]) + " to "
+                           + str(values[stop]) + " A")
+
+
+def check_dcon(values):
+    check_sweep(values, "SOUR:DCON:STAR", "SOUR:DCON:STEP", "SOUR:DCON:STOP")
+    for k in ("SOUR:DCON:STAR", "SOUR:DCON:STOP"):
+        if abs(values[k]) + values["SOUR:DCON:DELTA"] > MAX_CURRENT:
+            raise CommandError("Bias plus delta current exceeds "
+                               + str(MAX_CURRENT) + " A")
+
+
+def check_delta(values):
+    if values["SOUR:DELT:HIGH"] == values["SOUR:DELT:LOW"]:
+        raise CommandError("Delta high and low currents are the same")
+
+
+def check_pulse(values):
+    width = values["SOUR:PDEL:WIDT"]
+    if values["SOUR:PDEL:SDEL"] >= width:
+        raise CommandError("Source delay must be shorter than the pulse "
+                           + "width")
+    if width >= values["SOUR:PDEL:INT"] * LINE_PERIOD:
+        raise CommandError("Pulse width must be shorter than the cycle "
+                           + "interval")
+
+
+def check_linear(values):
+    check_sweep(values, "SOUR:CURR:STAR", "SOUR:CURR:STEP", "SOUR:CURR:STOP")
+
+
+class Command(object):
+    """A program message built from a fixed list of headers.
+
+    The first header is absolute and the rest are relative to its path, the
+    way they are written in the message (SOUR:DEL then CURR:STAR is
+    SOUR:CURR:STAR). render() checks every value against PARAMS and then the
+    checks given, and fills in the template."""
+
+    def __init__(self, first, *rest, checks=()):
+        self.texts = (first,) + rest
+        self.headers = []
+        path = []
+        for text in self.texts:
+            nodes = path + text.split(':')
+            self.headers.append(':'.join(nodes))
+            path = nodes[:-1]
+        self.template = '; '.join(x + " %s" for x in self.texts)
+        self.checks = checks
+
+    def values(self, *args):
+        if len(args) != len(self.headers):
+            raise CommandError(self.texts[0] + " takes "
+                               + str(len(self.headers)) + " values")
+        values = {}
+        for (header, value) in zip(self.headers, args):
+            param = PARAMS.get(header)
+            values[header] = param.validate(header, value) if param else value
+        for check in self.checks:
+            check(values)
+        return values
+
+    def render(self, *args):
+        values = self.values(*args)
+        return self.template % tuple(str(values[x]) for x in self.headers)
+
+
+COMMANDS = {
+        "dcon": Command("SOUR:DCON:STAR", "STEP", "STOP", "DELTA", "DELAY",
+                        "CAB", checks=(check_dcon,)),
+        "delta": Command("SOUR:DELT:HIGH", "LOW", "DEL", "COUN", "CAB",
+                         checks=(check_delta,)),
+        "fpd": Command("SOUR:PDEL:HIGH", "LOW", "WIDT", "SDEL", "COUN", "INT",
+                       "SWE", "LME", checks=(check_pulse,)),
+        "spd_pulse": Command("SOUR:PDEL:WIDT", "COUN", "LME", "SWE"),
+        "spd_sweep": Command("SOUR:SWE:COUN", "CAB"),
+        "spd_linear": Command("SOUR:DEL", "CURR:STAR", "STOP", "STEP",
+                              checks=(check_linear,)),
+        "spd_log": Command("SOUR:DEL", "CURR:STAR", "STOP"),
+        "spd_log_points": Command("SOUR:SWE:SPAC", "POIN"),
+        "list_delay": Command("SOUR:DEL"),
+        "trace": Command("TRAC:POIN"),
+        "compliance": Command("CURR:COMP"),
+        "filter": Command("SENS:AVER:TCON", "WIND", "COUN")
+        }
+
+
+def setting_key(cmd):
+    """The setting a command sets: its first header, or for a message
+    relayed to the 2182a, the relayed header."""
+    (header, _, rest) = cmd.strip().partition(' ')
+    if header.upper() == "SYST:COMM:SER:SEND":
+        return header + " " + rest.strip('\'" ').split(' ')[0]
+    return header
+
+
+def check_buffer(points):
+    """The readings a run will store must fit in the trace buffer."""
+    if not 1 <= points <= MAX_BUFFER:
+        raise CommandError(str(points) + " readings do not fit in the "
+                           + str(MAX_BUFFER) + "-reading buffer")
+
+
+def check_sweep_pulse(width, cycle_delay):
+    """Sweep pulse delta: pulse width against the sweep delay (the cycle
+    interval)."""
+    if width >= cycle_delay:
+        raise CommandError("Pulse width must be shorter than the cycle "
+                           + "interval")
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+"""
+This module holds the measurement configurations for the four dI/dV program
+modes--one small immutable object per mode with the settings as entered in
+the UI, and everything derived from them: the values in SI units, the number
+of readings, the span of bias currents, the parameter string for the data
+file header, the SCPI commands to arm the mode and the expected duration.
+
+Configs are named tuples, so they are compact (no instance dict), hashable
+and compare by value. The derived strings and commands are worked out the
+first time they are asked for and memoized by config value, so rebuilding a
+config from the UI after every edit costs almost nothing when nothing
+changed, and the GUI, the arm path and the file header all share one result.
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import functools
+from collections import namedtuple
+from Keithley_dIdV_commands import COMMANDS, check_buffer, check_sweep_pulse
+from Keithley_dIdV_pulse import PulseTiming, DEFAULT_SOURCE_DELAY
+
+__author__ = "Sarah Friedensen"
+__credits__ = "Sarah Friedensen"
+__license__ = "GPL3+"
+__version__ = "1.0"
+__maintainer__ = "Sarah Friedensen"
+__email__ = "safrie@sas.upenn.edu"
+__status__ = "Development"
+
+LINE_PERIOD = 1 / 60.0  # s per power line cycle
+MEMO_SIZE = 64  # derived results kept per method
+SWEEP_TYPES = ("Linear", "Log", "Custom")
+
+
+def num_points_sweep(start, stop, step):
+    """Calculate the number of points in a sweep."""
+    return int(abs((stop - start)//step) + 1)
+
+
+memoized = functools.lru_cache(maxsize=MEMO_SIZE)
+
+
+class Config(object):
+    """Behaviour shared by the mode configs. filter_count is the number of
+    readings the repeating filter averages into each stored one (1 if the
+    filter is off or moving)."""
+
+    __slots__ = ()
+
+    @property
+    def duration(self):
+        """Expected seconds for the measurement itself."""
+        return self.points * self.reading_period()
+
+    def reading_period(self):
+        return self.filter_count * self.conversion_period()
+
+    def bias_range(self):
+        """(lowest, highest) bias current in A."""
+        (low, high) = sorted((self.low, self.high))
+        return (low * 1E-6, high * 1E-6)
+
+
+class DIdVConfig(Config, namedtuple("DIdVConfig", (
+        "start", "stop", "step", "delta", "delay", "rate", "compliance",
+        "cab", "filter_command", "filter_count"))):
+    """Differential conductance. Currents in uA, delay in ms, rate in PLC
+    (as the string sent to the 2182a)."""
+
+    __slots__ = ()
+
+    @property
+    def currents(self):
+        """(start, stop, step, delta) in A."""
+        return (self.start * 1E-6, self.stop * 1E-6, self.step * 1E-6,
+                self.delta * 1E-6)
+
+    @property
+    def points(self):
+        (start, stop, step, delta) = self.currents
+        return num_points_sweep(start, stop, step)
+
+    def bias_range(self):
+        (start, stop, step, delta) = self.currents
+        return (min(start, stop) - abs(delta), max(start, stop) + abs(delta))
+
+    def conversion_period(self):
+        return self.delay * 1E-3 + float(self.rate) * LINE_PERIOD
+
+    @memoized
+    def parameter_string(self):
+        return ("Measured Differential Conductance \n"
+                + "Start Current (uA) = " + str(self.start) + "\t"
+                + "End Current (uA) = " + str(self.stop) + "\t"
+                + "Step Size (uA) = " + str(self.step) + "\t"
+                + "Delta Current (uA) = " + str(self.delta) + "\t"
+                + "Delay (ms) = " + str(self.delay) + "\t"
+                + "Rate (PLC) = " + self.rate + "\t"
+                + "Compliance Voltage (V) = " + str(self.compliance) + "\t"
+                + str(self.filter_command)
+                + "\n" + "\n"
+                )
+
+    @memoized
+    def commands(self):
+        (start, stop, step, delta) = self.currents
+        return (COMMANDS["dcon"].render(start, step, stop, delta,
+                                        self.delay * 1E-3, self.cab),
+                COMMANDS["trace"].render(self.points))
+
+
+class DeltaConfig(Config, namedtuple("DeltaConfig", (
+        "high", "low", "count", "delay", "rate", "noise_target",
+        "compliance", "cab", "filter_command", "filter_count"))):
+    """Delta. Currents in uA, delay in ms, rate in PLC (as the string sent
+    to the 2182a), noise target in nV."""
+
+    __slots__ = ()
+
+    @property
+    def points(self):
+        return self.count
+
+    @property
+    def noise_target_volts(self):
+        return self.noise_target * 1E-9
+
+    def conversion_period(self):
+        return self.delay * 1E-3 + float(self.rate) * LINE_PERIOD
+
+    @memoized
+    def parameter_string(self):
+        return ("Measured Delta \n"
+                + "High Current (uA) = " + str(self.high) + "\t"
+                + "Low Current (uA) = " + str(self.low) + "\t"
+                + "Pulse Count = " + str(self.count) + "\t"
+                + "Delay (ms) = " + str(self.delay) + "\t"
+                + "Measurement Rate (PLC) = " + self.rate + "\t"
+                + "Compliance Voltage (V) = " + str(self.compliance) + "\t"
+                + str(self.filter_command)
+                + "\n" + "\n"
+                )
+
+    @memoized
+    def commands(self):
+        return (COMMANDS["delta"].render(
+                        self.high * 1E-6, self.low * 1E-6, self.delay * 1E-3,
+                        self.count, self.cab),
+                COMMANDS["trace"].render(self.count))
+
+
+class FixedPulseDeltaConfig(Config, namedtuple("FixedPulseDeltaConfig", (
+        "high", "low", "count", "delay", "width", "cycle", "low_measure",
+        "compliance", "filter_command", "filter_count"))):
+    """Fixed pulse delta. Currents in uA, source delay and pulse width in us,
+    cycle interval in PLC."""
+
+    __slots__ = ()
+
+    @property
+    def points(self):
+        return self.count
+
+    @property
+    def duty_cycle(self):
+        """Percent of the cycle interval the pulse is on."""
+        return self.width * 1E-6 / (self.cycle * 0.016667) * 100
+
+    def conversion_period(self):
+        return self.cycle * LINE_PERIOD
+
+    def timing(self):
+        return PulseTiming(self.width * 1E-6, self.delay * 1E-6, self.cycle,
+                           int(self.low_measure), self.filter_count)
+
+    @memoized
+    def parameter_string(self):
+        return ("Measured Fixed Pulse Delta \n"
+                + "High Current (uA) = " + str(self.high) + "\t"
+                + "Low Current (uA) = " + str(self.low) + "\t"
+                + "Pulse Count = " + str(self.count) + "\t"
+                + "Delay (ms) = " + str(self.delay) + "\t"
+                + "Pulse Width (us) = " + str(self.width) + "\t"
+                + "Cycle Interval (PLC) = " + str(self.cycle) + "\t"
+                + "Low Measurements = " + self.low_measure + "\t"
+                + "Compliance Voltage (V) = " + str(self.compliance) + "\t"
+                + str(self.filter_command)
+                + "\n" + "\n"
+                )
+
+    @memoized
+    def commands(self):
+        return (COMMANDS["fpd"].render(
+                        self.high * 1E-6, self.low * 1E-6, self.width * 1E-6,
+                        self.delay * 1E-6, self.count, self.cycle, "OFF",
+                        self.low_measure),
+                COMMANDS["trace"].render(self.count))
+
+
+class SweepPulseDeltaConfig(Config, namedtuple("SweepPulseDeltaConfig", (
+        "sweep_type", "start", "stop", "step", "sweep_points", "width",
+        "cycle", "low_measure", "num_sweeps", "compliance", "cab",
+        "filter_command", "filter_string", "filter_count"))):
+    """Sweep pulse delta. sweep_type indexes SWEEP_TYPES. Currents in uA,
+    pulse width in us, cycle interval in PLC; sweep_points is the number of
+    points in one sweep. filter_string goes in the header of custom
+    sweeps."""
+
+    __slots__ = ()
+
+    @property
+    def points(self):
+        return self.sweep_points * self.num_sweeps
+
+    @property
+    def cycle_delay(self):
+        """Cycle interval in s, as sent with SOUR:DEL."""
+        return self.cycle * 16.667E-3
+
+    def bias_range(self):
+        (low, high) = sorted((self.start, self.stop))
+        return (low * 1E-6, high * 1E-6)
+
+    def conversion_period(self):
+        return self.cycle_delay
+
+    def timing(self):
+        return PulseTiming(self.width * 1E-6, DEFAULT_SOURCE_DELAY,
+                           self.cycle, int(self.low_measure),
+                           self.filter_count)
+
+    @memoized
+    def parameter_string(self):
+        if self.sweep_type < 2:
+            return ("Measured Sweep Pulse Delta \n"
+                    + "Sweep type = " + ("Log \t" if self.sweep_type
+                                         else "Linear \t")
+                    + "Start Current (uA) = " + str(self.start) + "\t"
+                    + "Stop Current (uA) = " + str(self.stop) + "\t"
+                    + ("Step Size (uA) = " + str(self.step) + "\t"
+                       if not self.sweep_type else "")
+                    + "Pulse Count = " + str(self.sweep_points) + "\t"
+                    + "Pulse Width (us) = " + str(self.width) + "\t"
+                    + "Cycle Interval (PLC) = " + str(self.cycle) + "\t"
+                    + "Low Measurements = " + self.low_measure + "\t"
+                    + "Number Sweeps = " + str(self.num_sweeps) + "\t"
+                    + "Compliance Voltage (V) = " + str(self.compliance)
+                    + "\t" + str(self.filter_command)
+                    + "\n" + "\n"
+                    )
+        return ("Measured Sweep Pulse Delta \n"
+                + "Sweep Type = Custom \t"
+                + "Pulse Count = " + str(self.sweep_points) + "\t"
+                + "Pulse Width (us) = " + str(self.width * 1E-6 * 1E6) + "\t"
+                + "Low Measurements = " + self.low_measure + "\t"
+                + "Number Sweeps = " + str(self.num_sweeps) + "\t"
+                + self.filter_string
+                + "\n" + "\n"
+                )
+
+    @memoized
+    def commands(self):
+        check_buffer(self.points)
+        check_sweep_pulse(self.width * 1E-6, self.cycle_delay)
+        commands = [
+                COMMANDS["spd_pulse"].render(
+                        self.width * 1E-6,
+                        self.sweep_points, # or points*num_sweeps
+                        self.low_measure, "ON"),
+                COMMANDS["spd_sweep"].render(self.num_sweeps, self.cab)]
+        if self.sweep_type == 0:
+            commands += [
+                    "SOUR:SWE:SPAC LIN",
+                    COMMANDS["spd_linear"].render(
+                            self.cycle_delay, self.start * 1E-6,
+                            self.stop * 1E-6, self.step * 1E-6)]
+        elif self.sweep_type == 1:
+            commands += [
+                    COMMANDS["spd_log_points"].render("LOG",
+                                                      self.sweep_points),
+                    COMMANDS["spd_log"].render(self.cycle_delay,
+                                               self.start * 1E-6,
+                                               self.stop * 1E-6)]
+        else:
+            commands.append("SOUR:SWE:SPAC LIST")
+        commands.append(COMMANDS["trace"].render(self.points))
+        return tuple(commands)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+This module holds the background instrument discovery for the dI/dV
+program--opening the transport, finding the 6221 and the 2182a, and resetting
+the 6221, all off the UI thread.
+
+Creating a VISA resource manager and listing resources can take seconds on a
+machine with many VISA interfaces, and a wedged bus can hang them outright.
+Discovery therefore runs in a thread that the UI checks on with a timer
+(giving up after a timeout), and the resource list from the last successful
+run is cached so the 6221 can be opened straight away next time without
+listing the bus first.
+
+If the 6221 is already set up by this program (OUTP:RESP SLOW, nothing in
+the error queue), it is attached warm: its state is read in one batched
+query and only the settings that differ from the UI are written afterwards.
+It is only reset when its state is unknown or inconsistent, so restarting
+the program does not wipe the configuration or disturb a biased sample.
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import os
+import json
+import time
+import threading
+import Keithley_dIdV_transport
+import Keithley_dIdV_2182a
+
+__author__ = "Sarah Friedensen"
+__credits__ = "Sarah Friedensen"
+__license__ = "GPL3+"
+__version__ = "1.0"
+__maintainer__ = "Sarah Friedensen"
+__email__ = "safrie@sas.upenn.edu"
+__status__ = "Development"
+
+CACHE_FILE = os.environ.get(
+        "KEITHLEY_CACHE",
+        os.path.join(os.path.expanduser("~"), ".keithley_dIdV_cache.json"))
+TIMEOUT = 10.0  # s
+
+# Settings read back on a warm attach, by the header the program writes them
+# with.
+STATE_QUERIES = ("OUTP:RESP", "OUTP", "CURR:RANG:AUTO", "CURR:RANG",
+                 "SOUR:PDEL:RANG", "SOUR:SWE:RANG", "CURR:COMP", "UNIT")
+
+
+def load_cache():
+    try:
+        with open(CACHE_FILE) as cachefile:
+            return json.load(cachefile)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache):
+    try:
+        with open(CACHE_FILE, 'w') as cachefile:
+            json.dump(cache, cachefile, indent=2)
+    except OSError:
+        pass
+
+
+def query_state(source):
+    """Read the 6221 identity, the settings in STATE_QUERIES and the first
+    error in one query. Returns {} if the answer does not parse."""
+    headers = ("*IDN",) + STATE_QUERIES + ("SYST:ERR",)
+    answer = source.query(
+            "*IDN?; " + "; ".join(":" + x + "?" for x in headers[1:]))
+    values = [x.strip() for x in answer.split(';')]
+    return dict(zip(headers, values)) if len(values) == len(headers) else {}
+
+
+def state_consistent(state):
+    """True if the state looks like a 6221 this program set up (it always
+    sets OUTP:RESP SLOW) with no errors waiting."""
+    return (bool(state) and "6221" in state["*IDN"]
+            and state["OUTP:RESP"].upper().startswith("SLOW")
+            and state["SYST:ERR"].startswith("0"))
+
+
+def _normal(value):
+    value = value.strip().strip('"\'').upper()
+    value = {"ON": "1", "OFF": "0"}.get(value, value)
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def setting_matches(current, wanted):
+    """Compare an instrument answer with a value the program would write
+    (ON/1, 2e-3/+2.000000E-03 and so on count as equal)."""
+    if current is None:
+        return False
+    (current, wanted) = (_normal(current), _normal(wanted))
+    if isinstance(current, float) and isinstance(wanted, float):
+        return abs(current - wanted) <= 1E-6 * max(abs(wanted), 1E-30)
+    return current == wanted
+
+
+class Discovery(threading.Thread):
+    """Find and connect to the 6221 at the given GPIB address.
+
+    Pass the session pool from an earlier discovery to reuse it and its open
+    sessions; otherwise the transport set in the environment is opened (see
+    Keithley_dIdV_transport) with a new pool on top.
+    When the thread has finished, the results are in source_list, source,
+    nvpr (the 2182a-present query), voltmeter_name, resources and error, and
+    warm and state say whether the 6221 was attached without a reset and
+    what it was set to. Pass warm=False to always reset."""
+
+    def __init__(self, address, transport=None, warm=True):
+        super().__init__(daemon=True)
+        self.address = address
+        self.transport = transport
+        self.cache = load_cache()
+        self.resources = tuple(self.cache.get("resources", ()))
+        self.source_list = []
+        self.source = None
+        self.nvpr = 0
+        self.voltmeter_name = None
+        self.allow_warm = warm
+        self.warm = False
+        self.state = {}
+        self.error = None
+        self.started = time.perf_counter()
+        self.elapsed = None
+
+    @property
+    def timed_out(self):
+        return (self.is_alive()
+                and time.perf_counter() - self.started > TIMEOUT)
+
+    def run(self):
+        try:
+            if self.transport is None:
+                self.transport = Keithley_dIdV_transport.SessionPool(
+                        Keithley_dIdV_transport.open_transport())
+            if not self.connect(self.resources):
+                self.resources = tuple(self.transport.list_resources())
+                self.connect(self.resources)
+            if self.source:
+                self.voltmeter_name = Keithley_dIdV_2182a.find_voltmeter(
+                        self.transport, self.resources, self.source_list[:1])
+                self.cache["resources"] = list(self.resources)
+                save_cache(self.cache)
+        except Exception as err:
+            self.error = err
+        self.elapsed = time.perf_counter() - self.started
+
+    def connect(self, resources):
+        """Open and reset the 6221 if it is among resources. A stale cached
+        resource that cannot be opened counts as not found."""
+        self.source_list = self.transport.find(resources, self.address)
+        if not self.source_list:
+            return False
+        try:
+            source = self.transport.open_resource(self.source_list[0])
+            state = query_state(source) if self.allow_warm else {}
+            self.warm = state_consistent(state)
+            self.state = state if self.warm else {}
+            if not self.warm:
+                source.write('*RST; OUTP:RESP SLOW')
+            self.nvpr = source.query('SOUR:DCON:NVPR?')
+        except Exception:
+            self.source_list = []
+            return False
+        self.source = source
+        return True
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""
+This module holds the dry run for the dI/dV program--the complete SCPI
+script a measurement would send, the buffer size it needs and how long each
+phase of the run should take, worked out without any hardware.
+
+The GUI runs its own arm and start code against a RecordingSession in place
+of the 6221, so the script is what a real run would send (settings a warm
+attach found already set are left out, as they would be) and takes
+milliseconds to produce. Plans can be saved and compared with diff() to spot
+settings that change, or get resent, between two configurations.
+
+Usage:
+    python Keithley_dIdV_dryrun.py OLD_PLAN NEW_PLAN
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import sys
+import difflib
+import Keithley_dIdV_buffer
+
+__author__ = "Sarah Friedensen"
+__credits__ = "Sarah Friedensen"
+__license__ = "GPL3+"
+__version__ = "1.0"
+__maintainer__ = "Sarah Friedensen"
+__email__ = "safrie@sas.upenn.edu"
+__status__ = "Development"
+
+LINE_PERIOD = 1 / 60.0  # s per power line cycle
+COMMAND_TIME = 2E-3  # s per GPIB transaction
+ARM_SETTLE = 0.0  # s; run_measurement polls right after INIT:IMM
+POLL_INTERVAL = 2.0  # s between buffer checks during a run
+FIELD_BYTES = 16  # bytes per ASCII buffer field, with separator
+TRANSFER_RATE = 100E3  # bytes/s for TRAC:DATA? over GPIB
+
+# Answers for the queries the arm and start code makes, by the end of the
+# header. Anything else is answered with DEFAULT_ANSWER.
+ANSWERS = {
+        "ARM?": "1",
+        "*OPC?": "1",
+        "TRAC:POIN:ACT?": "0",
+        "NVPR?": "1",
+        "SYST:ERR?": '0,"No error"'
+        }
+DEFAULT_ANSWER = "0"
+
+
+class RecordingSession(object):
+    """Stand-in for an instrument session that records what is sent, with
+    prefix in front, and answers queries from ANSWERS. Sessions can share a
+    script list to keep the order of messages to several instruments."""
+
+    def __init__(self, script=None, prefix=""):
+        self.script = [] if script is None else script
+        self.prefix = prefix
+        self.answer = ""
+
+    def write(self, message):
+        self.script.append(self.prefix + message)
+        if message.rstrip().endswith('?'):
+            self.answer = self._answer(message)
+        return len(message)
+
+    def query(self, message):
+        self.script.append(self.prefix + message)
+        return self._answer(message)
+
+    def _answer(self, message):
+        message = message.strip().upper()
+        for (end, answer) in ANSWERS.items():
+            if message.endswith(end):
+                return answer
+        return DEFAULT_ANSWER
+
+    def read(self):
+        return self.answer
+
+    def read_raw(self, length=None):
+        return self.answer.encode('ascii')
+
+    def clear(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class Plan(object):
+    """The outcome of a dry run: the script, the readings the run stores and
+    the predicted phases, as (name, seconds) in run order."""
+
+    def __init__(self, name, script, points, reading_period):
+        self.name = name
+        self.script = list(script)
+        self.points = points
+        self.reading_period = reading_period
+        measure = points * reading_period
+        polls = int(measure // POLL_INTERVAL) + 1
+        self.phases = [
+                ("configure", len(self.script) * COMMAND_TIME),
+                ("arm", ARM_SETTLE),
+                ("measure", measure),
+                ("read out", polls * COMMAND_TIME
+                 + points * Keithley_dIdV_buffer.NUM_ELEMENTS * FIELD_BYTES
+                 / TRANSFER_RATE)]
+
+    @property
+    def duration(self):
+        return sum(x[1] for x in self.phases)
+
+    def format(self):
+        lines = ["Dry run: " + self.name,
+                 "Buffer points: " + str(self.points),
+                 "Reading period (s): %.6g" % self.reading_period]
+        lines += ["Phase %s (s): %.3f" % x for x in self.phases]
+        lines.append("Total (s): %.3f" % self.duration)
+        lines.append("Script:")
+        lines += self.script
+        return '\n'.join(lines) + '\n'
+
+    def save(self, path):
+        with open(path, 'w') as planfile:
+            planfile.write(self.format())
+
+    def diff(self, other):
+        """Unified diff from other (a Plan or saved plan text) to this
+        plan."""
+        old = other.format() if isinstance(other, Plan) else other
+        return ''.join(difflib.unified_diff(
+                old.splitlines(True), self.format().splitlines(True),
+                "before", "after"))
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        print("Usage: python Keithley_dIdV_dryrun.py OLD_PLAN NEW_PLAN")
+        return 2
+    with open(argv[0]) as oldfile, open(argv[1]) as newfile:
+        sys.stdout.writelines(difflib.unified_diff(
+                oldfile.readlines(), newfile.readlines(), argv[0], argv[1]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+This module holds the error monitor for the 6221--a background thread that
+drains the instrument's error queue while the bus is idle and ties each
+error to the commands sent since the queue was last read.
+
+Reading SYST:ERR? after every command would double the number of bus
+transactions. Instead the monitor waits for a gap in the traffic (nothing
+sent for IDLE_TIME) and then reads the queue BATCH entries per query until it
+is empty. drain() can also be called directly, e.g. right after arming, to
+catch a bad configuration before a long run starts.
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import time
+import queue
+import threading
+from collections import deque
+
+__author__ = "Sarah Friedensen"
+__credits__ = "Sarah Friedensen"
+__license__ = "GPL3+"
+__version__ = "1.0"
+__maintainer__ = "Sarah Friedensen"
+__email__ = "safrie@sas.upenn.edu"
+__status__ = "Development"
+
+BATCH = 4  # SYST:ERR? per query
+MAX_ERRORS = 32  # the 6221 queue holds 32 entries
+INTERVAL = 1.0  # s between checks for idle time
+IDLE_TIME = 0.5  # s without traffic before the queue is read
+HISTORY = 100
+
+
+def parse_error(text):
+    """Split a SYST:ERR? answer like -222,"Parameter data out of range"
+    into (code, message)."""
+    (code, _, message) = text.strip().partition(',')
+    try:
+        return (int(code), message.strip().strip('"'))
+    except ValueError:
+        return (None, text.strip())
+
+
+def format_error(error):
+    """One-line description of an error and the commands it may come
+    from."""
+    return ("6221 error " + str(error["code"]) + ": " + error["message"]
+            + (" (after: " + " | ".join(error["commands"][-3:]) + ")"
+               if error["commands"] else ""))
+
+
+class ErrorMonitor(threading.Thread):
+    """Drain the error queue of a LoggedSession in the background.
+
+    Errors found are dicts with time, code, message and commands (the
+    commands written since the previous drain, the most likely culprits).
+    They are kept in history and handed out once by new_errors()."""
+
+    def __init__(self, session, interval=INTERVAL, idle_time=IDLE_TIME):
+        super().__init__(daemon=True)
+        self.session = session
+        self.interval = interval
+        self.idle_time = idle_time
+        self.found = queue.Queue()
+        self.history = deque(maxlen=HISTORY)
+        self.checked = session.sequence
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            if self.session.idle < self.idle_time or self.session.awaiting:
+                continue
+            try:
+                self.drain()
+            except Exception:
+                # The session has gone away; whoever owns it will notice.
+                pass
+
+    def stop(self):
+        self.stop_event.set()
+
+    def drain(self, hand_out=True):
+        """Read the error queue until it is empty and return the errors.
+        With hand_out=False they are not passed on to new_errors() (for
+        callers that report them themselves)."""
+        errors = []
+        with self.session.lock:
+            commands = self.session.since(self.checked)
+            while len(errors) < MAX_ERRORS:
+                answers = self.session.query(
+                        '; '.join([":SYST:ERR?"] * BATCH)).split(';')
+                entries = [parse_error(x) for x in answers]
+                errors += [x for x in entries if x[0]]
+                if any(x[0] == 0 or x[0] is None for x in entries):
+                    break
+            self.checked = self.session.sequence
+        errors = [{"time": time.time(), "code": code, "message": message,
+                   "commands": commands} for (code, message) in errors]
+        for error in errors:
+            self.history.append(error)
+            if hand_out:
+                self.found.put(error)
+        return errors
+
+    def new_errors(self):
+        """Errors found since the last call, without waiting."""
+        errors = []
+        while True:
+            try:
+                errors.append(self.found.get_nowait())
+            except queue.Empty:
+                return errors
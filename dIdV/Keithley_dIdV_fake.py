@@ -0,0 +1,548 @@
+#!/usr/bin/env python
+"""
+This module holds a stand-in for the VISA layer so the dI/dV program can be
+exercised without hardware--a fake resource manager and a simulated 6221/2182a
+stack that understands the subset of SCPI the program sends.
+
+The module can be dropped in wherever the `visa` module is used, e.g.
+Keithley_dIdV_transport.visa = Keithley_dIdV_fake, and FakeSocketServer
+serves a simulated instrument over a loopback socket like the 6221's
+Ethernet port.
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import time
+import random
+import socket
+import struct
+import threading
+from collections import deque
+
+__author__ = "Sarah Friedensen"
+__credits__ = "Sarah Friedensen"
+__license__ = "GPL3+"
+__version__ = "1.0"
+__maintainer__ = "Sarah Friedensen"
+__email__ = "safrie@sas.upenn.edu"
+__status__ = "Development"
+
+VOWELS = "AEIOU"
+
+ARM_QUERIES = {
+        "SOUR:DCON:ARM": "DCON",
+        "SOUR:DELT:ARM": "DELT",
+        "SOUR:PDEL:ARM": "PDEL",
+        "SOUR:SWE:ARM": "SWE"
+        }
+
+NO_ERROR = '0,"No error"'
+
+
+def short_form(node):
+    """Return the SCPI short form of a single header node.
+
+    The short form is the first four characters, or the first three if the
+    fourth is a vowel. Trailing numeric suffixes and the query mark are kept.
+    """
+    node = node.upper()
+    query = node.endswith('?')
+    node = node.rstrip('?')
+    stem = node.rstrip("0123456789")
+    suffix = node[len(stem):]
+    if len(stem) > 4:
+        stem = stem[:3] if stem[3] in VOWELS else stem[:4]
+    return stem + suffix + ('?' if query else '')
+
+
+def split_message(message):
+    """Split a program message into (header, arguments) pairs.
+
+    Semicolons inside quoted strings are left alone, and a header that does
+    not start with a colon continues from the path of the previous header in
+    the same message, the way SCPI compound commands work."""
+    parts = []
+    current = ''
+    quote = None
+    for char in message:
+        if quote:
+            quote = None if char == quote else quote
+        elif char in "'\"":
+            quote = char
+        elif char == ';':
+            parts.append(current)
+            current = ''
+            continue
+        current += char
+    parts.append(current)
+
+    path = []
+    for part in parts:
+        part = part.strip()
+        if not part:
+            continue
+        header, _, args = part.partition(' ')
+        if header.startswith('*'):
+            yield header.upper(), args.strip()
+            continue
+        if header.startswith(':'):
+            path = []
+            header = header[1:]
+        nodes = path + [short_form(x) for x in header.split(':')]
+        path = nodes[:-1]
+        yield ':'.join(nodes), args.strip()
+
+
+class FakeInstrument(object):
+    """Simulated 6221 current source with a 2182a on its serial port.
+
+    Settings written to the instrument are stored and echoed back by the
+    matching query, the trace buffer fills when a measurement is initiated,
+    and every transaction is counted so callers can measure round trips.
+    Set reading_rate (readings/s) to make the buffer fill over time and
+    latency (s) to charge a fixed bus cost per transaction."""
+
+    idn = "KEITHLEY INSTRUMENTS INC.,MODEL 6221,1234567,D03  /700x"
+
+    def __init__(self, resource_name, reading_rate=None, latency=0.0,
+                 resistance=100.0, noise=1E-7, voltmeter=True, seed=0):
+        self.resource_name = resource_name
+        self.reading_rate = reading_rate
+        self.latency = latency
+        self.resistance = resistance
+        self.noise = noise
+        self.voltmeter = voltmeter
+        self.random = random.Random(seed)
+        self.timeout = 2000
+        self.read_termination = None
+        self.write_termination = '\n'
+        self.writes = 0
+        self.queries = 0
+        self.reads = 0
+        self.closed = False
+        self.output = b''
+        self.linked = []
+        self.reset()
+
+    def __repr__(self):
+        return "<" + type(self).__name__ + "(" + self.resource_name + ")>"
+
+    #%% Bookkeeping
+    def reset(self):
+        """Return the simulated stack to its power-on state."""
+        self.settings = {
+                "FORM:DATA": "ASC",
+                "FORM:ELEM": "READ, TST, RNUM, SOUR, AVOL",
+                "FORM:BORD": "NORM",
+                "TRAC:POIN": "65536",
+                "SENS:AVER": "0",
+                "SENS:AVER:TCON": "MOV",
+                "SENS:AVER:WIND": "0",
+                "SENS:AVER:COUN": "10",
+                "UNIT": "V",
+                "CURR:COMP": "10",
+                "OUTP:RESP": "FAST"
+                }
+        self.voltmeter_settings = {
+                "SENS:VOLT:RANG": "1",
+                "SENS:VOLT:NPLC": "5"
+                }
+        self.serial_output = ""
+        self.errors = deque([])
+        self.buffer = []
+        self.armed = None
+        self.running = False
+        self.start_time = None
+
+    def reset_counters(self):
+        """Zero the transaction counters."""
+        self.writes = 0
+        self.queries = 0
+        self.reads = 0
+
+    @property
+    def round_trips(self):
+        return self.writes + self.queries + self.reads
+
+    def _charge(self):
+        if self.closed:
+            raise IOError("Resource " + self.resource_name + " is closed")
+        if self.latency:
+            time.sleep(self.latency)
+
+    #%% VISA-like interface
+    def write(self, message):
+        self.writes += 1
+        self._charge()
+        responses = self._execute(message)
+        if responses:
+            self.output = self._join(responses)
+        return len(message)
+
+    def read_raw(self, length=None):
+        self.reads += 1
+        self._charge()
+        (data, self.output) = (self.output, b'')
+        return data
+
+    def read(self):
+        return self.read_raw().decode('ascii')
+
+    def query(self, message):
+        self.queries += 1
+        self._charge()
+        self.output = self._join(self._execute(message))
+        (data, self.output) = (self.output, b'')
+        return data.decode('ascii')
+
+    def clear(self):
+        self.output = b''
+
+    def close(self):
+        self.closed = True
+
+    def _join(self, responses):
+        data = b';'.join(x if isinstance(x, bytes) else x.encode('ascii')
+                         for x in responses)
+        return data if data.endswith(b'\n') else data + b'\n'
+
+    #%% Command execution
+    def _execute(self, message):
+        responses = []
+        for (header, args) in split_message(message):
+            if header.endswith('?'):
+                responses.append(self._query(header[:-1], args))
+            else:
+                self._command(header, args)
+        return responses
+
+    def _command(self, header, args):
+        if header == "*RST":
+            self.reset()
+        elif header == "*CLS":
+            self.errors.clear()
+        elif header == "TRAC:CLE":
+            self.buffer = []
+            self.running = False
+        elif header == "TRAC:POIN":
+            if not 1 <= int(float(args)) <= 65536:
+                self.errors.append('-222,"Parameter data out of range"')
+            else:
+                self.settings[header] = str(int(float(args)))
+        elif header in ARM_QUERIES:
+            if self.voltmeter:
+                self.armed = ARM_QUERIES[header]
+            else:
+                self.errors.append('-221,"Settings conflict"')
+        elif header in ("INIT", "INIT:IMM"):
+            if self.armed:
+                self._start()
+            else:
+                self.errors.append('-221,"Settings conflict"')
+        elif header == "SOUR:SWE:ABOR":
+            self.armed = None
+            self.running = False
+        elif header == "SYST:COMM:SER:SEND":
+            answers = []
+            for (v_header, v_args) in split_message(args.strip("'\"")):
+                if v_header == "READ?":
+                    answers.append('%+.6E' % (
+                            self.source_current() * self.resistance
+                            + self.random.gauss(0, self.noise)))
+                elif v_header.endswith('?'):
+                    answers.append(self.voltmeter_settings.get(v_header[:-1],
+                                                               "0"))
+                else:
+                    self.voltmeter_settings[v_header] = v_args
+            self.serial_output = ';'.join(answers)
+        else:
+            self.settings[header] = args
+
+    def _query(self, header, args):
+        if header == "*IDN":
+            return self.idn
+        elif header == "*OPC":
+            return "1"
+        elif header == "SOUR:DCON:NVPR":
+            return "1" if self.voltmeter else "0"
+        elif header == "TRAC:POIN:ACT":
+            return str(self._available())
+        elif header == "TRAC:DATA":
+            return self._format(self.buffer[:self._available()])
+        elif header == "TRAC:DATA:SEL":
+            (start, count) = (int(x) for x in args.split(','))
+            stop = min(start + count, self._available())
+            return self._format(self.buffer[start:stop])
+        elif header in ARM_QUERIES:
+            return "1" if self.armed == ARM_QUERIES[header] else "0"
+        elif header in ("STAT:QUE", "SYST:ERR", "STAT:QUE:NEXT",
+                        "SYST:ERR:NEXT"):
+            return self.errors.popleft() if self.errors else NO_ERROR
+        elif header.startswith("SENS:VOLT"):
+            return self.voltmeter_settings.get(header, "0")
+        elif header == "SYST:COMM:SER:ENT":
+            (answer, self.serial_output) = (self.serial_output, "")
+            return answer
+        return self.settings.get(header, "0")
+
+    #%% Simulated measurement
+    def _start(self):
+        if self.armed == "SWE":
+            # Plain list sweep: no readings of its own, but every step
+            # triggers the voltmeters on the trigger link.
+            currents = [float(x) for x in
+                        self.settings.get("SOUR:LIST:CURR", "0").split(',')]
+            for meter in self.linked:
+                meter.trigger_sweep(currents)
+            self.armed = None
+            return
+        points = int(self.settings["TRAC:POIN"])
+        sources = self._source_values(points)
+        rate = self.reading_rate or 10.0
+        self.buffer = []
+        for (i, current) in enumerate(sources):
+            volt = current * self.resistance + self.random.gauss(0, self.noise)
+            self.buffer.append((volt, i / rate, i, current,
+                                volt + self.random.gauss(0, self.noise)))
+        self.running = True
+        self.start_time = time.time()
+
+    def source_current(self):
+        """DC output current, 0 with the output off."""
+        if self.settings.get("OUTP", "OFF") not in ("ON", "1"):
+            return 0.0
+        return float(self.settings.get("SOUR:CURR",
+                                       self.settings.get("CURR", 0)))
+
+    def _source_values(self, points):
+        """Bias currents the armed mode would step through."""
+        get = self.settings.get
+        if self.armed == "DCON":
+            start = float(get("SOUR:DCON:STAR", 0))
+            step = float(get("SOUR:DCON:STEP", 1E-6))
+            return [start + step * i for i in range(points)]
+        elif self.armed == "DELT":
+            (high, low) = (float(get("SOUR:DELT:HIGH", 1E-3)),
+                           float(get("SOUR:DELT:LOW", -1E-3)))
+            return [(high - low) / 2 for i in range(points)]
+        elif get("SOUR:PDEL:SWE", "OFF") == "ON":
+            start = float(get("SOUR:CURR:STAR", 0))
+            stop = float(get("SOUR:CURR:STOP", 1E-6))
+            per_sweep = max(int(float(get("SOUR:PDEL:COUN", points))), 1)
+            step = (stop - start) / max(per_sweep - 1, 1)
+            return [start + step * (i % per_sweep) for i in range(points)]
+        return [float(get("SOUR:PDEL:HIGH", 1E-3)) for i in range(points)]
+
+    def _available(self):
+        if not self.running:
+            return len(self.buffer)
+        if self.reading_rate is None:
+            return len(self.buffer)
+        elapsed = time.time() - self.start_time
+        return min(len(self.buffer), int(elapsed * self.reading_rate))
+
+    def _format(self, readings):
+        elements = [x.strip() for x in self.settings["FORM:ELEM"].split(',')]
+        fields = [i for (i, x) in enumerate(("READ", "TST", "RNUM", "SOUR",
+                                             "AVOL")) if x in elements]
+        values = [reading[i] for reading in readings for i in fields]
+        if self.settings["FORM:DATA"].startswith("REAL"):
+            order = '<' if self.settings["FORM:BORD"] == "SWAP" else '>'
+            return (b'#0' + struct.pack(order + str(len(values)) + 'f',
+                                        *values) + b'\n')
+        return ','.join('%+.6E' % x for x in values)
+
+
+class FakeVoltmeter(FakeInstrument):
+    """Simulated 2182a on its own GPIB address.
+
+    Readings are the output current of the linked 6221 times the sample
+    resistance plus noise. With TRIG:SOUR EXT the voltmeter takes one reading
+    per step of a 6221 list sweep, as it would over the trigger link."""
+
+    idn = "KEITHLEY INSTRUMENTS INC.,MODEL 2182A,1234568,C02  /A02"
+
+    def __init__(self, resource_name, source=None, **kwargs):
+        self.source = source
+        super().__init__(resource_name, **kwargs)
+
+    def reset(self):
+        self.settings = {
+                "FORM:DATA": "ASC",
+                "FORM:BORD": "NORM",
+                "SENS:VOLT:NPLC": "5",
+                "SENS:VOLT:RANG": "1",
+                "TRIG:SOUR": "IMM",
+                "TRIG:COUN": "1",
+                "SAMP:COUN": "1",
+                "TRAC:POIN": "1024",
+                "TRAC:FEED": "SENS",
+                "TRAC:FEED:CONT": "NEV"
+                }
+        self.voltmeter_settings = self.settings
+        self.errors = deque([])
+        self.buffer = []
+        self.last = 0.0
+        self.armed = None
+        self.running = False
+        self.start_time = None
+
+    def _reading(self, current=None):
+        if current is None:
+            current = self.source.source_current() if self.source else 0.0
+        self.last = (current * self.resistance
+                     + self.random.gauss(0, self.noise))
+        return self.last
+
+    def _store(self, readings):
+        if self.settings["TRAC:FEED:CONT"] != "NEXT":
+            return
+        size = int(self.settings["TRAC:POIN"])
+        self.buffer += readings[:size - len(self.buffer)]
+        if len(self.buffer) >= size:
+            self.settings["TRAC:FEED:CONT"] = "NEV"
+
+    def trigger_sweep(self, currents):
+        """Take one reading per list sweep step if waiting for triggers."""
+        if self.armed and self.settings["TRIG:SOUR"] == "EXT":
+            self._store([self._reading(x) for x in currents])
+            self.running = True
+            self.start_time = time.time()
+
+    def _command(self, header, args):
+        if header == "*RST":
+            self.reset()
+        elif header == "*CLS":
+            self.errors.clear()
+        elif header == "TRAC:CLE":
+            self.buffer = []
+        elif header == "TRAC:POIN":
+            if not 2 <= int(float(args)) <= 1024:
+                self.errors.append('-222,"Parameter data out of range"')
+            else:
+                self.settings[header] = str(int(float(args)))
+        elif header in ("INIT", "INIT:IMM"):
+            self.armed = True
+            if self.settings["TRIG:SOUR"] == "IMM":
+                count = (int(float(self.settings["TRIG:COUN"]))
+                         * int(float(self.settings["SAMP:COUN"])))
+                self._store([self._reading() for i in range(count)])
+        elif header == "ABOR":
+            self.armed = None
+        else:
+            self.settings[header] = args
+
+    def _query(self, header, args):
+        if header == "*IDN":
+            return self.idn
+        elif header == "*OPC":
+            return "1"
+        elif header in ("READ", "MEAS:VOLT", "SENS:DATA:FRES"):
+            return '%+.6E' % self._reading()
+        elif header in ("FETC", "SENS:DATA", "DATA"):
+            return '%+.6E' % self.last
+        elif header == "TRAC:POIN:ACT":
+            return str(self._available())
+        elif header == "TRAC:DATA":
+            values = self.buffer[:self._available()]
+            if self.settings["FORM:DATA"].startswith("REAL"):
+                order = '<' if self.settings["FORM:BORD"] == "SWAP" else '>'
+                return (b'#0' + struct.pack(order + str(len(values)) + 'f',
+                                            *values) + b'\n')
+            return ','.join('%+.6E' % x for x in values)
+        elif header in ("STAT:QUE", "SYST:ERR", "STAT:QUE:NEXT",
+                        "SYST:ERR:NEXT"):
+            return self.errors.popleft() if self.errors else NO_ERROR
+        return self.settings.get(header, "0")
+
+
+class FakeResourceManager(object):
+    """Stand-in for visa.ResourceManager.
+
+    Opening the same resource twice returns the same simulated instrument,
+    the way a real stack keeps its state between sessions. Resources listed in
+    voltmeters open as stand-alone 2182a voltmeters linked to the first
+    current source. Keyword arguments are passed on to every simulated
+    instrument created."""
+
+    def __init__(self, resources=("GPIB0::12::INSTR",), voltmeters=(),
+                 **kwargs):
+        self.resource_names = tuple(resources) + tuple(voltmeters)
+        self.voltmeters = tuple(voltmeters)
+        self.kwargs = kwargs
+        self.instruments = {}
+        self.opened = 0
+
+    def list_resources(self, query='?*::INSTR'):
+        return self.resource_names
+
+    def open_resource(self, resource_name, **kwargs):
+        if resource_name not in self.resource_names:
+            raise ValueError("Unknown resource " + resource_name)
+        self.opened += 1
+        instrument = self.instruments.get(resource_name)
+        if instrument is None and resource_name in self.voltmeters:
+            source = self.open_resource(self.resource_names[0])
+            instrument = FakeVoltmeter(resource_name, source, **self.kwargs)
+            source.linked.append(instrument)
+            self.instruments[resource_name] = instrument
+        elif instrument is None:
+            instrument = FakeInstrument(resource_name, **self.kwargs)
+            self.instruments[resource_name] = instrument
+        instrument.closed = False
+        return instrument
+
+    def close(self):
+        for instrument in self.instruments.values():
+            instrument.close()
+
+
+class FakeSocketServer(threading.Thread):
+    """Serve one simulated instrument over TCP on the loopback interface,
+    newline-terminated like the 6221's raw socket port. Port 0 picks a free
+    port; the one chosen is in self.port."""
+
+    def __init__(self, instrument, host='127.0.0.1', port=0):
+        super().__init__(daemon=True)
+        self.instrument = instrument
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind((host, port))
+        self.server.listen(1)
+        (self.host, self.port) = self.server.getsockname()
+
+    def run(self):
+        while True:
+            try:
+                (connection, address) = self.server.accept()
+            except OSError:
+                return
+            self.serve(connection)
+
+    def serve(self, connection):
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        pending = b''
+        with connection:
+            while True:
+                try:
+                    chunk = connection.recv(65536)
+                except OSError:
+                    return
+                if not chunk:
+                    return
+                pending += chunk
+                while b'\n' in pending:
+                    (line, _, pending) = pending.partition(b'\n')
+                    message = line.decode('ascii').strip()
+                    if message == '\x03':
+                        self.instrument.clear()
+                    elif message:
+                        self.instrument.write(message)
+                        if '?' in message:
+                            connection.sendall(self.instrument.read_raw())
+
+    def close(self):
+        self.server.close()
+
+
+ResourceManager = FakeResourceManager
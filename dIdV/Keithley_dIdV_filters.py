@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""
+This module holds the software filters for post-processing raw readings--the
+moving and repeating averages of the 6221 (SENS:AVER:TCON MOV/REP with its
+window and count) and median and Hampel spike filters.
+
+Taking data with the instrument filter off and applying the same filter here
+afterwards gives the readings the instrument would have returned, without
+slowing the acquisition by the filter count and without committing to one
+filter setting before the run.
+
+Instrument filter model:
+    Moving (MOV): when the filter starts (or restarts) the stack is filled
+        with copies of the first reading. Every new reading pushes out the
+        oldest one and one filtered reading is returned per raw reading.
+    Repeating (REP): count readings are averaged into one filtered reading
+        and the stack is emptied, so there is one output per count inputs.
+    Window: given in % of the measurement range. A reading further than the
+        window from the current filter average restarts the filter with that
+        reading. A window of 0 turns the window off.
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import numpy as np
+
+__author__ = "Sarah Friedensen"
+__credits__ = "Sarah Friedensen"
+__license__ = "GPL3+"
+__version__ = "1.0"
+__maintainer__ = "Sarah Friedensen"
+__email__ = "safrie@sas.upenn.edu"
+__status__ = "Development"
+
+# Voltmeter ranges (V) in the order of VoltmeterRangeValue in the UI.
+VOLT_RANGES = (10E-3, 100E-3, 1.0, 10.0, 100.0)
+
+MIN_BLOCK = 16
+MAX_BLOCK = 8192
+MAD_SCALE = 1.4826
+
+
+def window_width(window, range_value):
+    """Convert a filter window in % of range to an absolute half-width."""
+    return abs(window) * 1E-2 * range_value
+
+
+def _moving_chunk(x, count, history):
+    """Moving average of x given the count-1 readings already in the stack."""
+    ext = np.concatenate((history, x))
+    sums = np.concatenate(([0.0], np.cumsum(ext)))
+    return (sums[count:] - sums[:-count]) / count
+
+
+def moving_average(x, count, window=0, range_value=1.0):
+    """Reproduce the 6221 moving average filter on raw readings.
+
+    Returns one filtered reading per raw reading."""
+    x = np.asarray(x, dtype=float)
+    count = int(count)
+    out = np.empty_like(x)
+    width = window_width(window, range_value)
+    (pos, block, history, last) = (0, MIN_BLOCK, None, None)
+    while pos < len(x):
+        if history is None:
+            history = np.repeat(x[pos], count - 1)
+        chunk = x[pos:pos + block]
+        avg = _moving_chunk(chunk, count, history)
+        if width:
+            prev = np.concatenate(([avg[0] if last is None else last],
+                                   avg[:-1]))
+            outside = np.abs(chunk - prev) > width
+            outside[0] &= last is not None
+            if outside.any():
+                j = int(np.argmax(outside))
+                out[pos:pos + j] = avg[:j]
+                (pos, block, history, last) = (pos + j, MIN_BLOCK, None, None)
+                continue
+        out[pos:pos + len(chunk)] = avg
+        history = np.concatenate((history, chunk))[len(chunk):]
+        (pos, block, last) = (pos + len(chunk), min(2 * block, MAX_BLOCK),
+                              avg[-1])
+    return out
+
+
+def repeating_average(x, count, window=0, range_value=1.0):
+    """Reproduce the 6221 repeating average filter on raw readings.
+
+    Returns one filtered reading per complete group of count readings;
+    readings left over at the end (or discarded by a window restart) do not
+    produce an output."""
+    x = np.asarray(x, dtype=float)
+    count = int(count)
+    width = window_width(window, range_value)
+    if not width:
+        usable = len(x) - len(x) % count
+        return x[:usable].reshape(-1, count).mean(axis=1)
+
+    out = []
+    (pos, block) = (0, MIN_BLOCK)
+    divisor = np.arange(1, count + 1)
+    while len(x) - pos >= count:
+        usable = min((len(x) - pos) // count, block) * count
+        groups = x[pos:pos + usable].reshape(-1, count)
+        running = np.cumsum(groups, axis=1) / divisor
+        outside = np.abs(groups[:, 1:] - running[:, :-1]) > width
+        bad_rows = outside.any(axis=1)
+        if not bad_rows.any():
+            out.append(running[:, -1])
+            (pos, block) = (pos + usable, min(2 * block, MAX_BLOCK))
+            continue
+        row = int(np.argmax(bad_rows))
+        out.append(running[:row, -1])
+        pos += row * count + int(np.argmax(outside[row])) + 1
+        block = MIN_BLOCK
+    return np.concatenate(out) if out else np.empty(0)
+
+
+FILTER_TYPES = {
+        "MOV": moving_average,
+        "REP": repeating_average
+        }
+
+
+def instrument_filter(x, filter_type, count, window=0, range_value=1.0):
+    """Apply the filter the 6221 would apply for SENS:AVER:TCON filter_type;
+    WIND window; COUN count. range_value is the measurement range in the
+    same units as x (see VOLT_RANGES)."""
+    return FILTER_TYPES[filter_type.upper()[:3]](x, count, window,
+                                                 range_value)
+
+
+def _sliding(x, size):
+    """Centered sliding windows along the last axis, edges padded."""
+    if not size % 2:
+        raise ValueError("Filter size must be odd")
+    half = size // 2
+    pad = [(0, 0)] * (x.ndim - 1) + [(half, half)]
+    return np.lib.stride_tricks.sliding_window_view(
+            np.pad(x, pad, mode='edge'), size, axis=-1)
+
+
+def median_filter(x, size):
+    """Centered running median of odd length size along the last axis."""
+    x = np.asarray(x, dtype=float)
+    return np.median(_sliding(x, size), axis=-1)
+
+
+def hampel_filter(x, size, n_sigmas=3.0):
+    """Replace spikes by the local median.
+
+    A reading is a spike if it lies more than n_sigmas robust standard
+    deviations (scaled median absolute deviation over a centered window of
+    odd length size) from the local median. Returns the filtered readings and
+    a boolean mask of the readings that were replaced."""
+    x = np.asarray(x, dtype=float)
+    windows = _sliding(x, size)
+    median = np.median(windows, axis=-1)
+    mad = MAD_SCALE * np.median(np.abs(windows - median[..., None]), axis=-1)
+    spikes = np.abs(x - median) > n_sigmas * mad
+    return np.where(spikes, median, x), spikes
@@ -11,13 +11,27 @@ This file is part of Keithley_dIdV
 import sys
 import os
 import time
-import visa
-import numpy as np
 import re
+import functools
 from collections import deque
 import Keithley_dIdV_design2
+import Keithley_dIdV_buffer
+import Keithley_dIdV_filters
+import Keithley_dIdV_2182a
+import Keithley_dIdV_discovery
+import Keithley_dIdV_snapshot
+import Keithley_dIdV_errors
+import Keithley_dIdV_dryrun
+import Keithley_dIdV_config
+import Keithley_dIdV_modes
+import Keithley_dIdV_autorange
+import Keithley_dIdV_tuning
+import Keithley_dIdV_checkpoint
+import Keithley_dIdV_trace
+from Keithley_dIdV_trace import TraceError
+from Keithley_dIdV_commands import COMMANDS, CommandError, setting_key
 # import pyqtgraph as pg
-from qtpy import QtGui
+from qtpy import QtGui, QtCore
 #from qtpy.QtCore import QBasicTimer, QTimer
 from qtpy.QtGui import QFileDialog, QMessageBox, QInputDialog
 
@@ -29,6 +43,14 @@ __maintainer__ = "Sarah Friedensen"
 __email__ = "safrie@sas.upenn.edu"
 __status__ = "Development"
 
+SETTINGS_DELAY = 300  # ms without edits before changed settings are sent
+# Why a run stopped reading the buffer (dIdVGui.stop_reason)
+(COMPLETE, NOISE_TARGET, USER_STOP, TIMEOUT, BUFFER_FAULT) = (
+        "complete", "noise target reached", "stopped by the user",
+        "timed out", "buffer fault")
+# The reasons that mean readings the run should have stored are missing
+LOST_READINGS = (TIMEOUT, BUFFER_FAULT)
+
 class dIdVGui(QtGui.QMainWindow, Keithley_dIdV_design2.Ui_MainWindow):
     """This class holds all the methods necessary for running the user
     interface. It is defined as a class so that the logic is accessible while
@@ -48,34 +70,28 @@ class dIdVGui(QtGui.QMainWindow, Keithley_dIdV_design2.Ui_MainWindow):
 
         super(dIdVGui, self).__init__(parent)
         self.setupUi(self)
+        self.add_noise_target_field()
+        self.add_dry_run_button()
+        self.add_auto_range_checkbox()
+        self.add_tune_button()
+        self.add_duty_limit_fields()
         #pg.setConfigOptions(antialias=True)
-        #%% Initial Differential Conductance Variables
-        self.dIdV_rate = self.dIdVRate.value()
-        self.dIdV_start = self.dIdVStartCurr.value()
-        self.dIdV_stop = self.dIdVStopCurr.value()
-        self.dIdV_step = self.dIdVStepSize.value()
-        self.dIdV_delta = self.dIdVDeltaCurr.value()
-        self.dIdV_delay = self.dIdVDelay.value()
-
-        #%% Initial Delta Variables
-        #self.delta_rate = self.DeltaRate.value()
-        self.delta_high = self.DeltaHighCurr.value()
-        self.delta_low = self.DeltaLowCurr.value()
-        self.delta_num_points = self.DeltaPulseCount.value()
-        self.delta_delay = self.DeltaDelay.value()
-
-
-        #%% Initial Fixed Pulse Delta Variables
+        #%% Measurement modes and configs
+        # One Keithley_dIdV_modes object per tab, in tab order, and the
+        # Keithley_dIdV_config object each one last built from the UI.
+        self.modes = [mode(i) for (i, mode) in
+                      enumerate(Keithley_dIdV_modes.registered())]
+        self.mode_updaters = [functools.partial(self.update_mode_vars, i)
+                              for i in range(len(self.modes))]
+        self.configs = {}
+        for mode in self.modes[self.TabWidget.count():]:
+            self.TabWidget.addTab(mode.create_tab(self), mode.name)
 
         #%% Initial Sweep Pulse Delta Variables
         self.compliance_list = []
         self.I_list = []
         self.I_list_float = []
         self.cycle_list = []
-        self.spd_start = self.SweepPulseDeltaStartI.value() * 1E-6
-        self.spd_end = self.SweepPulseDeltaEndI.value() * 1E-6
-        self.spd_step = self.SweepPulseDeltaIStep.value() * 1E-6
-        self.spd_delay = self.SweepPulseDeltaCycle.value() * 16.667E-3
         self.spd_type_index = self.SweepTypeComboBox.currentIndex()
 
         self.spd_points_switch = {
@@ -94,12 +110,6 @@ class dIdVGui(QtGui.QMainWindow, Keithley_dIdV_design2.Ui_MainWindow):
         self.compliance_list_points = 0
         self.cycle_list_points = 0
 
-        self.spd_sweep_arm_switch = {
-            0: self.spd_arm_linear_sweep,
-            1: self.spd_arm_log_sweep,
-            2: self.spd_arm_custom_sweep
-            }
-
         #$%% Initial Filtering Variables
         self.filter_on = False
         self.filter_command = None
@@ -112,8 +122,24 @@ class dIdVGui(QtGui.QMainWindow, Keithley_dIdV_design2.Ui_MainWindow):
         self.I_source_list = None
         self.I_source = None
         self.V_meter_connected = 0
-        self.rm = visa.ResourceManager()
-        self.resources = self.rm.list_resources()
+        self.V_meter = None
+        self.rm = None
+        self.resources = ()
+        self.discovery = None
+        self.discovery_pending = False
+        self.attach_state = {}
+        self.sent_settings = {}
+        self.dirty_slots = []
+        self.settings_timer = QtCore.QTimer()
+        self.settings_timer.setSingleShot(True)
+        self.settings_timer.timeout.connect(self.flush_settings)
+        self.snapshot = Keithley_dIdV_snapshot.Snapshot()
+        self.error_monitor = None
+        self.instrument_errors = []
+        self.error_timer = QtCore.QTimer()
+        self.error_timer.timeout.connect(self.check_instrument_errors)
+        self.discovery_timer = QtCore.QTimer()
+        self.discovery_timer.timeout.connect(self.check_discovery)
         self.connected = False
         self.armed = 0
         self.num_points = 0
@@ -123,6 +149,15 @@ class dIdVGui(QtGui.QMainWindow, Keithley_dIdV_design2.Ui_MainWindow):
         self.avg_volt_array = []
         self.curr_array = []
         self.num_array = []
+        self.points_read = 0
+        self.integrity_problems = []
+        self.sentinel_readings = 0
+        self.sweep_averager = None
+        self.noise_monitor = None
+        self.stop_reason = None
+        self.checkpoint = None
+        self.run_widgets = {}
+        self.trace_buffer = None
 
         self.source_range_type_index = self.SourceRangeType.currentIndex()
         self.source_range_index = self.SourceRangeValue.currentIndex()
@@ -159,61 +194,51 @@ class dIdVGui(QtGui.QMainWindow, Keithley_dIdV_design2.Ui_MainWindow):
                         self.GPIB: self.update_GPIB,
                         self.ComplianceVoltage: self.update_compliance,
                         self.FilePath: self.new_file,
-                        self.dIdVDelay: self.update_dIdV_vars,
-                        self.dIdVDeltaCurr: self.update_dIdV_vars,
+                        self.dIdVDelay: self.mode_updaters[0],
+                        self.dIdVDeltaCurr: self.mode_updaters[0],
                         self.dIdVRate: self.update_volt_rate,
-                        self.dIdVStartCurr: self.update_dIdV_vars,
-                        self.dIdVStepSize: self.update_dIdV_vars,
-                        self.dIdVStopCurr: self.update_dIdV_vars,
-                        self.dIdVFilterWindow: self.update_dIdV_vars,
-                        self.dIdVFilterCount: self.update_dIdV_vars,
-                        self.DeltaDelay: self.update_delta_vars,
-                        self.DeltaHighCurr: self.update_delta_vars,
-                        self.DeltaLowCurr: self.update_delta_vars,
-                        self.DeltaPulseCount: self.update_delta_vars,
+                        self.dIdVStartCurr: self.mode_updaters[0],
+                        self.dIdVStepSize: self.mode_updaters[0],
+                        self.dIdVStopCurr: self.mode_updaters[0],
+                        self.dIdVFilterWindow: self.mode_updaters[0],
+                        self.dIdVFilterCount: self.mode_updaters[0],
+                        self.DeltaDelay: self.mode_updaters[1],
+                        self.DeltaHighCurr: self.mode_updaters[1],
+                        self.DeltaLowCurr: self.mode_updaters[1],
+                        self.DeltaPulseCount: self.mode_updaters[1],
                         self.DeltaRate: self.update_volt_rate,
                         #Add Filtering
-                        self.DeltaFilterWindow: self.update_delta_vars,
-                        self.DeltaFilterCount: self.update_delta_vars,
-                        self.FixedPulseDeltaCount:
-                            self.update_fixed_pulse_delta_vars,
-                        self.FixedPulseDeltaCycle:
-                            self.update_fixed_pulse_delta_vars,
-                        self.FixedPulseDeltaDelay:
-                            self.update_fixed_pulse_delta_vars,
-                        self.FixedPulseDeltaHighI:
-                            self.update_fixed_pulse_delta_vars,
-                        self.FixedPulseDeltaLowI:
-                            self.update_fixed_pulse_delta_vars,
-                        self.FixedPulseDeltaWidth:
-                            self.update_fixed_pulse_delta_vars,
+                        self.DeltaFilterWindow: self.mode_updaters[1],
+                        self.DeltaFilterCount: self.mode_updaters[1],
+                        self.DeltaNoiseTarget: self.mode_updaters[1],
+                        self.FixedPulseDeltaCount: self.mode_updaters[2],
+                        self.FixedPulseDeltaDutyLimit: self.mode_updaters[2],
+                        self.FixedPulseDeltaCycle: self.mode_updaters[2],
+                        self.FixedPulseDeltaDelay: self.mode_updaters[2],
+                        self.FixedPulseDeltaHighI: self.mode_updaters[2],
+                        self.FixedPulseDeltaLowI: self.mode_updaters[2],
+                        self.FixedPulseDeltaWidth: self.mode_updaters[2],
                         self.FixedPulseDeltaFilterWindow:
-                            self.update_fixed_pulse_delta_vars,
-                        self.FixedPulseDeltaFilterCount:
-                            self.update_fixed_pulse_delta_vars,
-                        self.SweepPulseDeltaCycle:
-                            self.update_sweep_pulse_delta_vars,
-                        self.SweepPulseDeltaEndI:
-                            self.update_sweep_pulse_delta_vars,
-                        self.SweepPulseDeltaIStep:
-                            self.update_sweep_pulse_delta_vars,
-                        self.SweepPulseDeltaPoints:
-                            self.update_sweep_pulse_delta_vars,
-                        self.SweepPulseDeltaStartI:
-                            self.update_sweep_pulse_delta_vars,
-                        self.SweepPulseDeltaSweeps:
-                            self.update_sweep_pulse_delta_vars,
-                        self.SweepPulseDeltaWidth:
-                            self.update_sweep_pulse_delta_vars,
+                            self.mode_updaters[2],
+                        self.FixedPulseDeltaFilterCount: self.mode_updaters[2],
+                        self.SweepPulseDeltaCycle: self.mode_updaters[3],
+                        self.SweepPulseDeltaEndI: self.mode_updaters[3],
+                        self.SweepPulseDeltaIStep: self.mode_updaters[3],
+                        self.SweepPulseDeltaPoints: self.mode_updaters[3],
+                        self.SweepPulseDeltaStartI: self.mode_updaters[3],
+                        self.SweepPulseDeltaSweeps: self.mode_updaters[3],
+                        self.SweepPulseDeltaWidth: self.mode_updaters[3],
+                        self.SweepPulseDeltaDutyLimit: self.mode_updaters[3],
                         self.SweepPulseDeltaFilterWindow:
-                            self.update_sweep_pulse_delta_vars,
-                        self.SweepPulseDeltaFilterCount:
-                            self.update_sweep_pulse_delta_vars
+                            self.mode_updaters[3],
+                        self.SweepPulseDeltaFilterCount: self.mode_updaters[3]
                         },
                 "button1": {
                         # Buttons on the UI. Set to do nothing at runtime.
                         # Signal is "clicked"
                         self.StartButton: self.run_measurement,
+                        self.DryRunButton: self.dry_run,
+                        self.TuneButton: self.tune_rate,
                         self.ComplianceVoltageList:
                             self.create_compliance_list,
                         self.SaveNewButton: self.new_file,
@@ -234,8 +259,8 @@ class dIdVGui(QtGui.QMainWindow, Keithley_dIdV_design2.Ui_MainWindow):
                         # run. Signal is "clicked""
                         self.ComplianceAbortCheckBox:
                             self.set_compliance_abort,
-                        self.FixedPulseDeltaLowMeasure: self.set_low_measure,
-                        self.SweepPulseDeltaLowMeasure: self.set_low_measure,
+                        self.FixedPulseDeltaLowMeasure: self.mode_updaters[2],
+                        self.SweepPulseDeltaLowMeasure: self.mode_updaters[3],
                         self.dIdVFilterCheckbox: self.update_filter_on,
                         self.DeltaFilterCheckbox: self.update_filter_on,
                         self.FixedPulseDeltaFilterCheckbox:
@@ -263,22 +288,6 @@ class dIdVGui(QtGui.QMainWindow, Keithley_dIdV_design2.Ui_MainWindow):
                 8: "CURR:RANG 100e-3"
         }
 
-        self.source_range_type_switch = {
-                1: "CURR:RANG:AUTO ON", # Delta autorange
-                2: "SOUR:PDEL:RANG BEST", # Fixed Pulse Delta best range
-                3: "SOUR:SWE:RANG BEST", # Sweep Pulse Delta best range
-                4: "CURR:RANG:AUTO OFF", # Delta Fixed range
-                5: "SOUR:PDEL:RANG FIX", # Fixed Pulse Delta Fixed range
-                6: "SOUR:SWE:RANG FIX" # Sweep Pulse Delta Fixed range
-                }
-
-        self.source_range_type_query = {
-                0: "CURR:RANG:AUTO?",
-                1: "CURR:RANG:AUTO?", # Delta range query
-                2: "SOUR:PDEL:RANG?", # Fixed Pulse Delta range type query
-                3: "SOUR:SWE:RANG?" # Sweep Pulse Delta range query
-                }
-
         self.volt_range_switch = {
                 0: "SYST:COMM:SER:SEND ':SENS:VOLT:RANG 10e-3'",
                 1: "SYST:COMM:SER:SEND ':SENS:VOLT:RANG 100e-3'",
@@ -303,55 +312,6 @@ class dIdVGui(QtGui.QMainWindow, Keithley_dIdV_design2.Ui_MainWindow):
                 4: "Reading (W, peak)"
                 }
 
-        self.update_variables_switch = {
-                0: self.update_dIdV_vars,
-                1: self.update_delta_vars,
-                2: self.update_fixed_pulse_delta_vars,
-                3: self.update_sweep_pulse_delta_vars
-                }
-
-        self.arm_switch = {
-                0: self.arm_dIdV,
-                1: self.arm_delta,
-                2: self.arm_fixed_pulse_delta,
-                3: self.arm_sweep_pulse_delta
-                }
-
-        self.query_arm_switch = {
-                0: "SOUR:DCON:ARM?",
-                1: "SOUR:DELT:ARM?",
-                2: "SOUR:PDEL:ARM?",
-                3: "SOUR:PDEL:ARM?"
-                }
-
-        self.measurement_type_switch = {
-                0: self.get_dIdV_parameter_string,
-                1: self.get_delta_parameter_string,
-                2: self.get_fpd_parameter_string,
-                3: self.get_spd_parameter_string
-                }
-
-        self.filter_window_switch = {
-                0: self.dIdVFilterWindow.value,
-                1: self.DeltaFilterWindow.value,
-                2: self.FixedPulseDeltaFilterWindow.value,
-                3: self.SweepPulseDeltaFilterWindow.value
-                }
-
-        self.filter_count_switch = {
-                0: self.dIdVFilterCount.value,
-                1: self.DeltaFilterCount.value,
-                2: self.FixedPulseDeltaFilterCount.value,
-                3: self.SweepPulseDeltaFilterCount.value
-                }
-
-        self.filter_on_switch = {
-                0: self.dIdVFilterCheckbox.isChecked,
-                1: self.DeltaFilterCheckbox.isChecked,
-                2: self.FixedPulseDeltaFilterCheckbox.isChecked,
-                3: self.SweepPulseDeltaFilterCheckbox.isChecked
-                }
-
         self.error_messages = {
                 0: ("Invalid DC source (6221) address. Ensure the instrument "
                     + "is connected with the correct GPIB address input."),
@@ -364,191 +324,161 @@ class dIdVGui(QtGui.QMainWindow, Keithley_dIdV_design2.Ui_MainWindow):
 
     #%% Initial function calls
         for k, v in self.signals_slots_dict["combo"].items():
-            k.currentIndexChanged.connect(v)
+            k.currentIndexChanged.connect(self.checked(v))
         for k, v in self.signals_slots_dict["field"].items():
-            k.editingFinished.connect(v)
+            k.editingFinished.connect(
+                    v if k in (self.GPIB, self.FilePath) else self.defer(v))
         for k, v in self.signals_slots_dict["button1"].items():
             k.clicked.connect(v)
         for k, v in self.signals_slots_dict["button2"].items():
             k.clicked.connect(v)
         for k, v in self.signals_slots_dict["checkbox"].items():
-            k.clicked.connect(v)
+            k.clicked.connect(self.checked(v))
         for k, v in self.signals_slots_dict["tab"].items():
-            k.currentChanged.connect(v)
+            k.currentChanged.connect(self.checked(v))
 
         self.update_GPIB()
-        self.update_sweep_pulse_delta_vars()
-        self.update_fixed_pulse_delta_vars()
-        self.update_delta_vars()
-        self.update_dIdV_vars()
-
-
-    #%% Differential Conductance Methods
-    def update_dIdV_vars(self):
-        self.dIdV_start = self.dIdVStartCurr.value() * 1E-6
-        self.dIdV_stop = self.dIdVStopCurr.value() * 1E-6
-        self.dIdV_step = self.dIdVStepSize.value() * 1E-6
-        self.dIdV_delta = self.dIdVDeltaCurr.value() * 1E-6
-        self.dIdV_delay = self.dIdVDelay.value() * 1E-3
-        #self.dIdV_rate = self.dIdVRate.value()
-        self.update_volt_rate()
-        #self.set_low_measure()
-        self.dIdV_num_points = self.num_points_sweep(
-                self.dIdV_start, self.dIdV_stop, self.dIdV_step)
-        self.num_points = self.dIdV_num_points
-        self.set_filtering()
-        self.dIdV_parameter_string = ("Measured Differential Conductance \n"
-                    + "Start Current (uA) = " + str(self.dIdVStartCurr.value())
-                    + "\t"
-                    + "End Current (uA) = " + str(self.dIdVStopCurr.value())
-                    + "\t"
-                    + "Step Size (uA) = " + str(self.dIdVStepSize.value())
-                    + "\t"
-                    + "Delta Current (uA) = " + str(self.dIdVDeltaCurr.value())
-                    + "\t"
-                    + "Delay (ms) = " + str(self.dIdVDelay.value()) + "\t"
-                    + "Rate (PLC) = " + self.voltmeter_rate + "\t"
-                    + "Compliance Voltage (V) = "
-                    + str(self.compliance_voltage) + "\t"
-                    + str(self.filter_command)
-                    + "\n" + "\n"
-                    )
-        #print(self.num_points)
-
-    def get_dIdV_parameter_string(self):
-#        print(self.dIdV_parameter_string)
-        return self.dIdV_parameter_string
-
-    #%% Delta Methods
-    def update_delta_vars(self):
-        self.delta_high = self.DeltaHighCurr.value()*1E-6
-        self.delta_low = self.DeltaLowCurr.value()*1E-6
-        self.delta_num_points = self.DeltaPulseCount.value()
-        self.num_points = self.delta_num_points
-        #print(self.num_points)
-        self.delta_delay = self.DeltaDelay.value()*1E-3
-        self.delta_rate = self.DeltaRate.value()
-        self.update_volt_rate()
-        self.set_filtering()
-        self.delta_parameter_string = ("Measured Delta \n"
-                    + "High Current (uA) = " + str(self.DeltaHighCurr.value())
-                    + "\t"
-                    + "Low Current (uA) = " + str(self.DeltaLowCurr.value())
-                    + "\t"
-                    + "Pulse Count = " + str(self.delta_num_points) + "\t"
-                    + "Delay (ms) = " + str(self.DeltaDelay.value()) + "\t"
-                    + "Measurement Rate (PLC) = " + self.voltmeter_rate + "\t"
-                    + "Compliance Voltage (V) = "
-                    + str(self.compliance_voltage) + "\t"
-                    + str(self.filter_command)
-                    + "\n" + "\n"
-                    )
-
-    def get_delta_parameter_string(self):
-#        print(self.delta_parameter_string)
-        return self.delta_parameter_string
-
-    #%% Fixed Pulse Delta Methods
-    def update_fixed_pulse_delta_vars(self):
-        self.fpd_high = self.FixedPulseDeltaHighI.value() * 1E-6
-        self.fpd_low = self.FixedPulseDeltaLowI.value() * 1E-6
-        self.fpd_delay = self.FixedPulseDeltaDelay.value() * 1E-6
-        self.fpd_num_points = self.FixedPulseDeltaCount.value()
-        self.num_points = self.fpd_num_points
-        #print(self.num_points)
-        self.fpd_width = self.FixedPulseDeltaWidth.value() * 1E-6
-        self.fpd_cycle = self.FixedPulseDeltaCycle.value()
-        self.DutyCycle.setValue(self.fpd_width/(self.fpd_cycle * 0.016667) * 100)
-        self.set_low_measure()
-        self.set_filtering()
-        self.fpd_parameter_string = ("Measured Fixed Pulse Delta \n"
-                 + "High Current (uA) = "
-                 + str(self.FixedPulseDeltaHighI.value()) + "\t"
-                 + "Low Current (uA) = "
-                 + str(self.FixedPulseDeltaLowI.value()) + "\t"
-                 + "Pulse Count = " + str(self.fpd_num_points) + "\t"
-                 + "Delay (ms) = " + str(self.FixedPulseDeltaDelay.value())
-                 + "\t"
-                 + "Pulse Width (us) = "
-                 + str(self.FixedPulseDeltaWidth.value()) + "\t"
-                 + "Cycle Interval (PLC) = " + str(self.fpd_cycle) + "\t"
-                 + "Low Measurements = " + self.low_measure + "\t"
-                 + "Compliance Voltage (V) = " + str(self.compliance_voltage)
-                 + "\t" + str(self.filter_command)
-                 + "\n" + "\n"
-                )
-
-    def get_fpd_parameter_string(self):
-#        print(self.fpd_parameter_string)
-        return self.fpd_parameter_string
+        for update in reversed(self.mode_updaters):
+            update()
+
+
+    #%% Measurement Mode Methods
+    @property
+    def current_mode(self):
+        return self.modes[self.current_tab]
+
+    @property
+    def trace(self):
+        """The Keithley_dIdV_trace.TraceBuffer of the 6221 session."""
+        if (self.trace_buffer is None
+                or self.trace_buffer.source is not self.I_source):
+            self.trace_buffer = Keithley_dIdV_trace.TraceBuffer(
+                    self.I_source, self.drain_errors)
+        return self.trace_buffer
+
+    def drain_errors(self):
+        """Read the 6221 error queue now. The errors are also reported like
+        those the error monitor finds."""
+        return self.error_monitor.drain() if self.error_monitor else []
+
+    def update_mode_vars(self, tab):
+        """Rebuild the config of a tab from the UI. For the current tab, its
+        rate and filter are also sent and num_points set."""
+        mode = self.modes[tab]
+        current = tab == self.current_tab
+        if current:
+            if mode.rate_widget:
+                self.update_volt_rate()
+            self.set_filtering()
+        self.set_compliance_abort()
+        self.configs[tab] = mode.configure(self)
+        if current:
+            self.num_points = mode.expected_points(self.configs[tab])
+        mode.configured(self, self.configs[tab])
+
+    def show_pulse_timing(self, timing, duty_limit):
+        """Show what the pulse timing allows (see Keithley_dIdV_pulse)."""
+        self.statusBar().showMessage("Pulse timing: "
+                                     + timing.summary(duty_limit))
+
+    def arm_mode(self, config=None):
+        """Check all commands of the current tab, send them, then arm.
+
+        Pass config to arm part of the tab's run instead (the rest of a
+        resumed run)."""
+        # MOSTLY WORKING VERIFY BUFFER
+        mode = self.current_mode
+        self.update_mode_vars(self.current_tab)
+        if config is not None:
+            self.num_points = mode.expected_points(config)
+        commands = mode.commands(self.configs[self.current_tab]
+                                 if config is None else config)
+        mode.prepare(self)
+        self.update_source_range_type()
+        self.armed = mode.arm(self, commands)
+        if self.armed:
+            self.trace.arm(self.num_points)
+
+    def add_dry_run_button(self):
+        """Add the Dry Run button next to Clear Graphs."""
+        self.DryRunButton = QtGui.QPushButton("Dry Run",
+                                              self.BelowGraphsWidget)
+        self.DryRunButton.setToolTip(
+                "Print the commands, buffer size and timing of a run of this "
+                "tab without sending anything to the instruments.")
+        self.horizontalLayout.insertWidget(1, self.DryRunButton)
+        self.dry_runs = {}
+
+    def add_tune_button(self):
+        """Add the Tune Rate button next to Dry Run."""
+        self.TuneButton = QtGui.QPushButton("Tune Rate",
+                                            self.BelowGraphsWidget)
+        self.TuneButton.setToolTip(
+                "Measure the noise and time per point of a few voltmeter "
+                "rates and filter counts with short delta bursts, and set "
+                "the fastest that meets a noise target.")
+        self.horizontalLayout.insertWidget(2, self.TuneButton)
+        self.tune_target = 10.0  # nV
+
+    def add_auto_range_checkbox(self):
+        """Add the Pre-scan Ranges checkbox under the source range boxes."""
+        self.AutoRangeCheckBox = QtGui.QCheckBox("Pre-scan Ranges",
+                                                 self.TopWidget)
+        self.AutoRangeCheckBox.setToolTip(
+                "Before each run, step quickly through the bias currents to "
+                "find the largest voltage, then set fixed source and "
+                "voltmeter ranges for it. The currents are held as DC, so "
+                "a pulse delta tab with a duty limit is not pre-scanned.")
+        self.SourceRangeGridLayout.addWidget(self.AutoRangeCheckBox,
+                                             2, 0, 1, 2)
+
+    def add_duty_limit_fields(self):
+        """Add a duty cycle limit field to each pulse delta tab. The pulse
+        timing is checked against it whenever the settings change; 0 is no
+        limit."""
+        for (name, frame, layout, row) in (
+                ("FixedPulseDelta", self.FixedPulseDeltaParameterFrame,
+                 self.gridLayout_10, 3),
+                ("SweepPulseDelta", self.SweepPulseDeltaParameterFrame,
+                 self.gridLayout_9, 6)):
+            field = QtGui.QDoubleSpinBox(frame)
+            field.setMaximum(100)
+            field.setToolTip(
+                    "Highest duty cycle the sample can take without "
+                    "heating. The fastest cycle interval that keeps under "
+                    "it is shown in the status bar. 0 is no limit. A limit "
+                    "also turns off Pre-scan Ranges for this tab.")
+            field_layout = QtGui.QVBoxLayout()
+            field_layout.addWidget(QtGui.QLabel("Duty Limit (%)", frame))
+            field_layout.addWidget(field)
+            layout.addLayout(field_layout, row, 0, 1, 1)
+            setattr(self, name + "DutyLimit", field)
+
+    def add_noise_target_field(self):
+        """Add the noise target field to the Delta tab.
+
+        A delta run stops on its own once the Allan deviation floor of the
+        readings drops below the target. A target of 0 turns this off."""
+        self.DeltaNoiseTargetLayout = QtGui.QVBoxLayout()
+        self.DeltaNoiseTargetLabel = QtGui.QLabel("Noise Target (nV)",
+                                                  self.DeltaParameterFrame)
+        self.DeltaNoiseTarget = QtGui.QDoubleSpinBox(self.DeltaParameterFrame)
+        self.DeltaNoiseTarget.setMaximum(1E6)
+        self.DeltaNoiseTarget.setToolTip(
+                "Stop the run once the Allan deviation of the readings "
+                "reaches this level. 0 runs the full pulse count.")
+        self.DeltaNoiseTargetLayout.addWidget(self.DeltaNoiseTargetLabel)
+        self.DeltaNoiseTargetLayout.addWidget(self.DeltaNoiseTarget)
+        self.gridLayout_4.addLayout(self.DeltaNoiseTargetLayout, 2, 1, 1, 1)
 
     #%% Sweep Pulse Delta Methods
-    def update_sweep_pulse_delta_vars(self):
-        self.spd_start = self.SweepPulseDeltaStartI.value() * 1E-6
-        self.spd_end = self.SweepPulseDeltaEndI.value() * 1E-6
-        self.spd_step = self.SweepPulseDeltaIStep.value() * 1E-6
-        self.spd_delay = self.SweepPulseDeltaCycle.value() * 16.667E-3
-        self.spd_type_index = int(self.SweepTypeComboBox.currentIndex())
-        self.spd_num_sweeps = self.SweepPulseDeltaSweeps.value()
-        self.spd_points = self.spd_points_switch.get(
-                self.spd_type_index, None)()
-        if self.spd_type_index != 1:
-            self.SweepPulseDeltaPoints.setReadOnly(False)
-            self.SweepPulseDeltaPoints.setValue(self.spd_points)
-            self.SweepPulseDeltaPoints.setReadOnly(True)
-        self.spd_num_points = self.spd_points * self.spd_num_sweeps
-        self.num_points = self.spd_num_points
-        #print(self.num_points)
-        self.spd_width = self.SweepPulseDeltaWidth.value() * 1E-6
-        self.set_low_measure()
-        self.set_filtering()
-        self.update_spd_parameter_string()
-
-
-    def get_spd_parameter_string(self):
-        return self.spd_parameter_string
-
-    def update_spd_parameter_string(self):
-        if self.spd_type_index < 2:
-            self.spd_parameter_string = ("Measured Sweep Pulse Delta \n"
-                 + "Sweep type = " + ("Log \t" if self.spd_type_index
-                                      else "Linear \t")
-                 + "Start Current (uA) = "
-                 + str(self.SweepPulseDeltaStartI.value()) + "\t"
-                 + "Stop Current (uA) = "
-                 + str(self.SweepPulseDeltaEndI.value()) + "\t"
-                 + ("Step Size (uA) = "
-                    + str(self.SweepPulseDeltaIStep.value()) + "\t"
-                    if not self.spd_type_index else "")
-                 + "Pulse Count = " + str(self.spd_points) + "\t"
-                 + "Pulse Width (us) = "
-                 + str(self.SweepPulseDeltaWidth.value()) + "\t"
-                 + "Cycle Interval (PLC) = "
-                 + str(self.SweepPulseDeltaCycle.value()) + "\t"
-                 + "Low Measurements = " + self.low_measure + "\t"
-                 + "Number Sweeps = " + str(self.spd_num_sweeps) + "\t"
-                 + "Compliance Voltage (V) = " + str(self.compliance_voltage)
-                 + "\t" + str(self.filter_command)
-                 + "\n" + "\n"
-                 )
-        else:
-            self.spd_parameter_string = ("Measured Sweep Pulse Delta \n"
-                     + "Sweep Type = Custom \t"
-                     + "Pulse Count = " + str(self.spd_points) + "\t"
-                     + "Pulse Width (us) = " + str(self.spd_width * 1E6) + "\t"
-                     + "Low Measurements = " + self.low_measure + "\t"
-                     + "Number Sweeps = " + str(self.spd_num_sweeps) + "\t"
-                     + (("\n" + self.get_filter_string() if self.filter_on
-                         else "\n #NoFilter")
-                     + "\n" + "\n"
-                     ))
-
     def spd_get_linear_num(self):
 #        print(self.num_points_sweep(self.spd_start, self.spd_end,
 #                                      self.spd_step))
-        return (self.num_points_sweep(self.SweepPulseDeltaStartI.value(),
-                                      self.SweepPulseDeltaEndI.value(),
-                                      self.SweepPulseDeltaIStep.value()))
+        return Keithley_dIdV_config.num_points_sweep(
+                self.SweepPulseDeltaStartI.value(),
+                self.SweepPulseDeltaEndI.value(),
+                self.SweepPulseDeltaIStep.value())
 
     def spd_get_log_num(self):
         return self.SweepPulseDeltaPoints.value()
@@ -558,8 +488,12 @@ class dIdVGui(QtGui.QMainWindow, Keithley_dIdV_design2.Ui_MainWindow):
 
     def update_spd_sweep_type(self):
         self.spd_type_index = self.SweepTypeComboBox.currentIndex()
-        self.update_sweep_pulse_delta_vars()
-        self.update_spd_parameter_string()
+        self.update_mode_vars(3)
+        self.set_spd_read_only()
+
+    def set_spd_read_only(self):
+        """Make the Sweep Pulse Delta fields the sweep type does not use
+        read only."""
         if self.spd_type_index == 1:
             self.SweepPulseDeltaStartI.setReadOnly(False)
             self.SweepPulseDeltaEndI.setReadOnly(False)
@@ -703,115 +637,133 @@ class dIdVGui(QtGui.QMainWindow, Keithley_dIdV_design2.Ui_MainWindow):
             #print(self.I_source.query("SOUR:LIST:DEL?"))
             self.update_spd_sweep_type()
 
-    def spd_arm_linear_sweep(self):
-        self.I_source.write("SOUR:SWE:SPAC LIN")
-        self.cmd = ("SOUR:DEL " + str(self.spd_delay)
-                    + "; CURR:STAR " + str(self.spd_start)
-                    + "; STOP " + str(self.spd_end)
-                    + "; STEP " + str(self.spd_step)
-                    )
-        self.I_source.write(self.cmd)
-
-    def spd_arm_log_sweep(self):
-        self.I_source.write("SOUR:SWE:SPAC LOG; POIN " + str(self.spd_points))
-        self.cmd = ("SOUR:DEL " + str(self.spd_delay)
-                    + "; CURR:STAR " + str(self.spd_start)
-                    + "; STOP " + str(self.spd_end)
-                    )
-        self.I_source.write(self.cmd)
-
-    def spd_arm_custom_sweep(self):
-        self.I_source.write("SOUR:SWE:SPAC LIST")
-
     #%% Filtering Methods
     def set_filtering(self):
-        self.cmd = ("SENS:AVER:TCON " + self.get_filter_type()
-                    + "; WIND "
-                    + str(self.filter_window_switch.get(self.current_tab, 0)())
-                    + "; COUN "
-                    + str(self.filter_count_switch.get(self.current_tab, 10)())
-                    )
-        self.filter_command = self.cmd
+        """Check the filter settings of the current tab and, if connected,
+        send them. Raises CommandError for a setting out of range."""
+        commands = self.current_mode.filter_commands(self)
+        self.filter_command = " ".join(commands)
         if self.connected:
-            self.I_source.write(self.cmd)
-#            print("Setting filtering")
-#            self.run_error_messages()
-            self.cmd = "SENS:AVER " + ("ON; " if self.filter_on else "OFF; ")
-            self.filter_command += " " + self.cmd
-            self.I_source.write(self.cmd)
-#            print("Toggling Filtering")
-#            self.run_error_messages()
-
-    def get_filter_string(self):
-        return ("Filter Type = " + self.get_filter_type()
-                         + "Filter Window = " + str(
-                           self.filter_window_switch.get(self.current_tab, 0)()
-                             )
-                         + "Filter Count = " + str(
-                           self.filter_count_switch.get(self.current_tab, 0)())
-                         )
+            for cmd in commands:
+                self.write_setting(cmd)
+            self.cmd = commands[-1]
+
+    def get_filter_string(self, tab=None):
+        tab = self.current_tab if tab is None else tab
+        return self.modes[tab].filter_string(self)
 
 
     def update_filter_on(self):
-        self.filter_on = self.filter_on_switch.get(self.current_tab, False)()
+        self.filter_on = self.current_mode.filter_on(self)
         self.set_filtering()
 
-    def get_filter_type(self):
-        if not self.current_tab:
-            return "REP"
-        elif self.current_tab == 1:
-            if self.DeltaFilterComboBox.currentIndex():
-                return "REP"
-            else:
-                return "MOV"
-        elif self.current_tab == 2:
-            if self.FixedPulseDeltaComboBox.currentIndex():
-                return "REP"
-            else:
-                return "MOV"
-        else:
-            return "MOV"
-
-
+    def get_filter_type(self, tab=None):
+        tab = self.current_tab if tab is None else tab
+        return self.modes[tab].get_filter_type(self)
 
     #%% General Methods
     def set_compliance_abort(self):
         """TEST"""
         self.CAB = "ON" if self.ComplianceAbortCheckBox.isChecked() else "OFF"
 
-    def set_low_measure(self):
-        """TEST"""
-
-        if self.current_tab-2:
-            self.low_measure = ("2"
-                                if self.SweepPulseDeltaLowMeasure.isChecked()
-                                else "1")
-        else:
-            self.low_measure = ("2"
-                                if self.FixedPulseDeltaLowMeasure.isChecked()
-                                else "1")
-
-    def num_points_sweep(self, start, stop, step):
-        """Calculate the number of points in a sweep."""
-        return(abs((stop - start)//step) + 1)
-
     def update_source_range_type(self):
         """If instruments are connected, set the source range type based on the
-        combo box selection and the measurement type. The function inside get()
-        returns unique keys for all non-differential conductance measurements.
-        Since differential conductance automatically has 'best' ranging, its
-        keys don't matter.
+        combo box selection and the measurement mode. Modes without range
+        commands (differential conductance always uses 'best' ranging) are
+        left alone.
 
         WORKING"""
         self.source_range_type_index = self.SourceRangeType.currentIndex()
         self.cmd = None
-        if self.current_tab:
-            self.cmd = self.source_range_type_switch.get(
-                    self.current_tab + 3*self.source_range_type_index, None)
+        if self.current_mode.range_commands:
+            self.cmd = self.current_mode.range_commands[
+                    self.source_range_type_index]
         if self.cmd and self.connected:
-            self.I_source.write(self.cmd)
+            self.write_setting(self.cmd)
             self.update_source_range()
 
+    def prescan_ranges(self):
+        """Pick fixed 6221 and 2182a ranges for the current tab with a quick
+        pre-scan (see Keithley_dIdV_autorange) and send them. Returns the
+        choice, or None if the mode does not allow a pre-scan."""
+        mode = self.current_mode
+        skipped = mode.prescan_skipped(self)
+        if skipped:
+            message = "Ranges not pre-scanned: " + skipped
+            print(message)
+            self.statusBar().showMessage(message)
+            return None
+        self.update_mode_vars(self.current_tab)
+        config = self.configs[self.current_tab]
+        choice = Keithley_dIdV_autorange.Prescan(
+                self.I_source, self.V_meter).run(
+                        mode.bias_currents(self, config), self.voltmeter_rate)
+        # The pre-scan left the ranges in a different state from the one
+        # last sent.
+        self.forget_settings()
+        for (widget, index) in ((self.SourceRangeType, 1),
+                                (self.SourceRangeValue, choice.source_index),
+                                (self.VoltmeterRangeValue, choice.volt_index)):
+            widget.blockSignals(True)
+            widget.setCurrentIndex(index)
+            widget.blockSignals(False)
+        self.update_source_range_type()
+        self.update_volt_range()
+        print(Keithley_dIdV_autorange.Prescan.summary(choice))
+        self.statusBar().showMessage(
+                Keithley_dIdV_autorange.Prescan.summary(choice))
+        return choice
+
+    def tune_rate(self, target=None):
+        """Set the fastest voltmeter rate and filter count of the current tab
+        that keep the noise per point at or under target (nV), asked for if
+        not given (see Keithley_dIdV_tuning). Returns the Tuning."""
+        mode = self.current_mode
+        if not (self.connected and mode.rate_widget):
+            self.statusBar().showMessage(
+                    "Tuning needs the instruments and a tab with a "
+                    "voltmeter rate")
+            return None
+        if not target:
+            (target, ok) = QInputDialog.getDouble(
+                    self, "Tune Rate", "Noise per point (nV)",
+                    self.tune_target, 0, 1E9, 3)
+            if not ok:
+                return None
+        self.tune_target = target
+        self.flush_settings()
+        try:
+            self.update_mode_vars(self.current_tab)
+            config = self.configs[self.current_tab]
+            (low, high) = config.bias_range()
+            tuning = Keithley_dIdV_tuning.Tuner(
+                    self.I_source, self.V_meter, self.wait).tune(
+                            high, low, config.delay * 1E-3, target * 1E-9,
+                            self.volt_range_index)
+        except (CommandError, TraceError) as err:
+            self.error_messages["command"] = str(err)
+            self.error_queue.append("command")
+            self.run_error_messages()
+            return None
+        print(tuning.format(config.points))
+        # The bursts left the filter and rate in a different state from the
+        # one last sent.
+        self.forget_settings()
+        (window, count, checkbox) = mode.filter_widgets
+        getattr(self, mode.rate_widget).setValue(tuning.best.nplc)
+        getattr(self, checkbox).setChecked(tuning.best.count > 1)
+        if tuning.best.count > 1:
+            getattr(self, count).setValue(tuning.best.count)
+            if mode.filter_type_widget:
+                getattr(self, mode.filter_type_widget).setCurrentIndex(1)
+        self.update_filter_on()
+        self.update_mode_vars(self.current_tab)
+        self.statusBar().showMessage(
+                "Tuned: %g NPLC, filter count %d, %.3g V per point%s"
+                % (tuning.best.nplc, tuning.best.count, tuning.best.noise,
+                   "" if tuning.met else " (target not reached)"))
+        return tuning
+
     def update_source_range(self):
         """If instruments are connected and 'fixed' ranging is selected for the
         source, set the range for the current source.
@@ -822,7 +774,7 @@ class dIdVGui(QtGui.QMainWindow, Keithley_dIdV_design2.Ui_MainWindow):
         if self.source_range_type_index and self.connected:
             self.cmd = self.source_range_switch.get(
                     self.source_range_index, None)
-            self.I_source.write(self.cmd)
+            self.write_setting(self.cmd)
 
     def update_volt_range(self):
         """"If instruments connected and the voltmeter is set to manual
@@ -831,34 +783,42 @@ class dIdVGui(QtGui.QMainWindow, Keithley_dIdV_design2.Ui_MainWindow):
         WORKING"""
         self.volt_range_index = self.VoltmeterRangeValue.currentIndex()
         self.cmd = self.volt_range_switch.get(self.volt_range_index, None)
-        if self.connected:
-           self.I_source.write(self.cmd)
+        if self.connected and self.V_meter:
+            if self.setting_changed("2182a RANG", self.volt_range_index):
+                self.V_meter.set_range(Keithley_dIdV_filters.VOLT_RANGES[
+                        self.volt_range_index])
+        elif self.connected:
+           self.write_setting(self.cmd)
 
     def update_volt_rate(self):
-        """If instruments connected, update voltmeter rate. Only functional for
-        dIdV and delta measurements.
+        """If instruments connected, update voltmeter rate from the rate field
+        of the current mode. Only functional for modes the 2182a times (dIdV
+        and delta measurements).
 
         WORKING"""
         self.cmd = None
-        if self.connected:
+        rate_widget = self.current_mode.rate_widget
+        if self.connected and rate_widget:
+            self.voltmeter_rate = self.current_mode.voltmeter_rate(self)
             self.cmd = ("SYST:COMM:SER:SEND ':SENS:VOLT:NPLC "
-                        + (str(self.DeltaRate.value()) if self.current_tab
-                           else str(self.dIdVRate.value())) + "'")
-            self.voltmeter_rate = (str(self.DeltaRate.value())
-                                    if self.current_tab
-                                    else str(self.dIdVRate.value()))
-            self.I_source.write(self.cmd)
+                        + self.voltmeter_rate + "'")
+            if self.V_meter:
+                if self.setting_changed("2182a NPLC", self.voltmeter_rate):
+                    self.V_meter.set_rate(self.voltmeter_rate)
+            else:
+                self.write_setting(self.cmd)
 
     def update_compliance(self):
         """If the instruments are connected and the user alters the compliance
-        voltage, send a command to update the instruments.
+        voltage, send a command to update the instruments. Raises
+        CommandError for a voltage out of range.
 
         WORKING"""
         self.compliance_voltage = str(self.ComplianceVoltage.value())
         #self.cmd = None
         if self.connected:
-            self.cmd = "CURR:COMP " + self.compliance_voltage
-            self.I_source.write(self.cmd)
+            self.cmd = COMMANDS["compliance"].render(self.compliance_voltage)
+            self.write_setting(self.cmd)
 
     def update_units(self):
         """If instruments connected and the user alters the specified units in
@@ -869,15 +829,18 @@ class dIdVGui(QtGui.QMainWindow, Keithley_dIdV_design2.Ui_MainWindow):
         self.cmd = None
         if self.connected:
             self.cmd = self.unit_switch.get(self.units_index, None)
-            self.I_source.write(self.cmd)
+            self.write_setting(self.cmd)
             self.update_header_string()
 
 
     def clear_buffer(self):
-        """FIGURE OUT HOW TO DO PROPERLY"""
-        self.cmd = "TRAC:CLE"
-        self.I_source.write(self.cmd)
-        self.in_buffer = int(self.I_source.query("TRAC:POIN:ACT?"))
+        """Abort anything armed and empty the 6221 buffer, confirmed (see
+        Keithley_dIdV_trace). Raises TraceError if it will not empty.
+        Called once per run, so the settings sent are forgotten here and
+        the run sends each of them again."""
+        self.forget_settings()
+        self.trace.clear()
+        self.in_buffer = self.trace.count
 
     def calibrate_meter(self):
         """FIGURE OUT HOW TO DO PROPERLY
@@ -894,44 +857,176 @@ class dIdVGui(QtGui.QMainWindow, Keithley_dIdV_design2.Ui_MainWindow):
         update the variables and the ranging.
 
         WORKING"""
+        self.flush_settings()
         self.current_tab = self.TabWidget.currentIndex()
 #        print("Tab = " + str(self.current_tab))
         self.update_source_range_type()
-        self.update_variables_switch[self.current_tab]()
+        self.update_mode_vars(self.current_tab)
         self.update_header_string()
         self.update_filter_on()
 
     def update_GPIB(self):
-        """Check GPIB address of current source and initialize if valid.
-
-        If the user-given GPIB address for the 6221 is in the list of
-        resources, then assign it to self.I_source and send the following
-        commands: reset instrument, change output response to slow.
-        Note if GPIB address is not in the resource list. Either way, update
-        connected flag accordingly."""
-        self.check_errors(False, False)
-        #self.I_source_list = [
-        #        x for x in self.resources
-        #        if (str(self.GPIB.value()) and 'GPIB') in x
-        #        ]
-
-        if not self.errors_exist:
-            self.I_source = self.rm.open_resource(self.I_source_list[0])
-            self.I_source.write('*RST; OUTP:RESP SLOW')
-            self.connected = bool(self.I_source) and self.V_meter_connected
+        """Start looking for the current source at the user-given GPIB
+        address.
+
+        Finding the 6221 (and a 2182a on GPIB) and attaching to it (warm if
+        it is already set up, otherwise *RST; OUTP:RESP SLOW) runs in the
+        background so the window comes up straight away and
+        a wedged bus cannot hang it; check_discovery picks up the result.
+        The program is not connected until then."""
+        if (self.discovery and self.discovery.is_alive()
+                and not self.discovery.timed_out):
+            self.discovery_pending = True
+            return
+        self.connected = False
+        self.discovery_pending = False
+        self.discovery = Keithley_dIdV_discovery.Discovery(self.GPIB.value(),
+                                                           self.rm)
+        self.discovery.start()
+        self.discovery_timer.start(50)
+        self.statusBar().showMessage("Looking for instruments...")
+
+    def check_discovery(self):
+        """Connect to what the background discovery found once it is done.
+
+        Called by discovery_timer. Gives up if discovery takes longer than
+        Keithley_dIdV_discovery.TIMEOUT. If the 2182a is also on GPIB,
+        voltmeter settings are written to it directly instead of through
+        the 6221's serial port. After a warm attach only the settings that
+        differ from the UI are written. Returns True once discovery is
+        over."""
+        if self.discovery.timed_out:
+            self.discovery_timer.stop()
+            self.statusBar().showMessage(
+                    "No response from the instruments after "
+                    + str(Keithley_dIdV_discovery.TIMEOUT) + " s. Check the "
+                    + "bus and the GPIB address.")
+            return True
+        if self.discovery.is_alive():
+            return False
+        self.discovery_timer.stop()
+        self.rm = self.discovery.transport
+        self.resources = self.discovery.resources
+        self.I_source_list = self.discovery.source_list
+        self.I_source = self.discovery.source
+        self.V_meter_connected = self.discovery.nvpr
+        self.connected = bool(self.I_source) and self.V_meter_connected
+        name = self.discovery.voltmeter_name
+        self.V_meter = (Keithley_dIdV_2182a.Voltmeter2182a(
+                self.rm.open_resource(name)) if name else None)
+        if self.discovery.error:
+            self.statusBar().showMessage("Could not reach the instruments: "
+                                         + str(self.discovery.error))
+        else:
+            self.statusBar().showMessage(
+                    (("Attached" if self.discovery.warm
+                      else "Reset and connected") if self.connected
+                     else self.error_messages[0 if not self.I_source else 1])
+                    + (" (2182a on " + name + ")" if name else "")
+                    + " in %.2f s" % self.discovery.elapsed)
+        self.start_error_monitor()
         if self.connected:
+            self.forget_settings()
+            self.attach_state = self.discovery.state
             self.update_source_range_type()
             self.update_source_range()
             self.update_volt_range()
             self.set_compliance_abort()
-            self.in_buffer = int(self.I_source.query("TRAC:POIN:ACT?"))
+            self.update_compliance()
+            self.update_units()
+            self.attach_state = {}
+            self.in_buffer = self.trace.read_count()
+            self.offer_resume()
+        if self.discovery_pending:
+            self.update_GPIB()
+        return True
+
+    def start_error_monitor(self):
+        """Drain the 6221 error queue in the background while the bus is
+        idle; check_instrument_errors reports what it finds.
+
+        Called whenever I_source may have changed: the monitor is moved to
+        the new session, or stopped if there is no 6221."""
+        if self.error_monitor and self.error_monitor.session is self.I_source:
+            return
+        if self.error_monitor:
+            self.error_monitor.stop()
+            self.error_monitor = None
+        if not self.I_source:
+            return
+        self.error_monitor = Keithley_dIdV_errors.ErrorMonitor(self.I_source)
+        self.error_monitor.start()
+        self.error_timer.start(500)
+
+    def check_instrument_errors(self):
+        """Called by error_timer. Report errors the monitor has found."""
+        if self.error_monitor:
+            self.instrument_errors += self.error_monitor.new_errors()
+        if self.instrument_errors:
+            self.run_error_messages()
+
+    def write_setting(self, cmd):
+        """Write a setting to the 6221 unless it is already set that way:
+        it is the same as the last command sent for that setting, or (for a
+        single 'HEADER value') the state read on a warm attach matches."""
+        if not self.setting_changed(setting_key(cmd), cmd):
+            return
+        (header, _, value) = cmd.partition(' ')
+        if ';' in cmd or not Keithley_dIdV_discovery.setting_matches(
+                self.attach_state.get(header), value):
+            self.I_source.write(cmd)
+
+    def forget_settings(self):
+        """Forget the settings sent, so the next write of each goes out.
+        For whenever the 6221 may not hold them any more: after a reset,
+        for a new run, or after commands sent around write_setting."""
+        self.sent_settings = {}
+
+    def setting_changed(self, key, value):
+        """Record value as the last one sent for key. Returns False if it
+        already was, so the write can be skipped."""
+        if key in self.sent_settings and self.sent_settings[key] == value:
+            return False
+        self.sent_settings[key] = value
+        return True
+
+    def defer(self, slot):
+        """Return a slot that marks slot as due instead of calling it, so
+        edits in quick succession (tabbing through a form) are sent once,
+        SETTINGS_DELAY after the last one."""
+        def mark_dirty():
+            if slot not in self.dirty_slots:
+                self.dirty_slots.append(slot)
+            self.settings_timer.start(SETTINGS_DELAY)
+        return mark_dirty
+
+    def checked(self, slot):
+        """Return a slot that calls slot and reports a setting that fails
+        its check (CommandError) the way a bad run setting is reported.
+        Nothing has been sent for it; arming checks it again."""
+        def check_slot():
+            try:
+                slot()
+            except CommandError as err:
+                self.error_messages["command"] = str(err)
+                self.error_queue.append("command")
+                self.run_error_messages()
+        return check_slot
+
+    def flush_settings(self):
+        """Apply the settings edited since the last flush, each update once.
+        Called by settings_timer and before anything that depends on them
+        (arming, dry runs, changing tabs)."""
+        self.settings_timer.stop()
+        while self.dirty_slots:
+            self.checked(self.dirty_slots.pop(0))()
 
     def update_header_string(self):
         self.header_string = ''.join(
-                [self.measurement_type_switch.get(self.current_tab)(),
+                [self.configs[self.current_tab].parameter_string(),
                 self.header_string_unit_switch.get(self.units_index), '\t',
-                'timestamp (s)', '\t', 'Current (A)', '\t', 'Avg. Voltage (V)',
-                '\t', 'Reading Number']
+                'timestamp (s)', '\t', 'Reading Number', '\t', 'Current (A)',
+                '\t', 'Avg. Voltage (V)']
                 )
 #        print(self.header_string)
 
@@ -957,189 +1052,288 @@ class dIdVGui(QtGui.QMainWindow, Keithley_dIdV_design2.Ui_MainWindow):
     def clear_graphs(self):
         print("graphs cleared")
 
-    def arm_dIdV(self):
-        # Send all commands, then arm.
-        # MOSTLY WORKING VERIFY BUFFER
-        #self.update_volt_rate()
-        self.set_filtering()
-        self.update_units()
-        self.update_dIdV_vars()
-        self.update_volt_range()
-        self.update_source_range_type()
-        self.cmd = (#"*RST"
-                    "SOUR:DCON:STAR " + str(self.dIdV_start)
-                    + "; STEP " + str(self.dIdV_step)
-                    + "; STOP " + str(self.dIdV_stop)
-                    + "; DELTA " + str(self.dIdV_delta)
-                    + "; DELAY " + str(self.dIdV_delay)
-                    + "; CAB " + self.CAB
-                    )
-        self.I_source.write(self.cmd)
-        self.I_source.write("TRAC:POIN " + str(self.dIdV_num_points))
-#        print(self.dIdV_num_points)
-        self.I_source.write("SOUR:DCON:ARM")
-        self.armed = '1' in self.I_source.query("SOUR:DCON:ARM?")
-
-    def arm_delta(self):
-        # Send all commands, then arm
-        # MOSTLY WORKING VERIFY BUFFER
-        self.set_filtering()
-        self.update_volt_rate()
-        self.update_source_range_type()
-        self.update_delta_vars()
-        self.cmd = None
-        self.cmd = ("SOUR:DELT:HIGH " + str(self.delta_high)
-                    + "; LOW " + str(self.delta_low)
-                    + "; DEL " + str(self.delta_delay)
-                    + "; COUN " + str(self.delta_num_points)
-                    + "; CAB " + self.CAB
-                    )
-        self.I_source.write(self.cmd)
-        self.I_source.write("TRAC:POIN " + str(self.delta_num_points))
-        self.I_source.write("SOUR:DELT:ARM")
-        self.armed = '1' in self.I_source.query("SOUR:DELT:ARM?")
-#        self.num_points = self.delta_num_points
-
-    def arm_fixed_pulse_delta(self):
-        # Send all commands, then arm
-        # MOSTLY WORKING VERIFY BUFFER
-        self.set_filtering()
-        self.update_source_range_type()
-        self.update_fixed_pulse_delta_vars()
-        self.cmd = None
-        self.cmd = ("SOUR:PDEL:HIGH " + str(self.fpd_high)
-                    + "; LOW " + str(self.fpd_low)
-                    + "; WIDT " + str(self.fpd_width)
-                    + "; SDEL " + str(self.fpd_delay)
-                    + "; COUN " + str(self.fpd_num_points)
-                    + "; INT " + str(self.fpd_cycle)
-                    + "; SWE OFF"
-                    + "; LME " + self.low_measure
-                    )
-        self.I_source.write(self.cmd)
-        self.I_source.write("TRAC:POIN " + str(self.fpd_num_points))
-        self.I_source.write("SOUR:PDEL:ARM")
-        self.armed = '1' in self.I_source.query("SOUR:PDEL:ARM?")
-#        print("fixed pulse delta armed = " + str(self.armed))
-
-    def arm_sweep_pulse_delta(self):
-        # Send all commands, then arm.
-        # MOSTLY WORKING VERIFY BUFFER
-        self.set_filtering()
-        self.update_source_range_type()
-        self.update_sweep_pulse_delta_vars()
-        self.cmd = None
-        self.cmd = (
-                    "SOUR:PDEL:WIDT " + str(self.spd_width)
-                    + "; COUN " + str(self.spd_points) # or spd_points*spd_num_sweeps
-                    + "; LME " + self.low_measure
-                    + "; SWE ON")
-        self.I_source.write(self.cmd)
-        self.cmd = (
-                    "SOUR:SWE:COUN " + str(self.spd_num_sweeps)
-                    + "; CAB " + self.CAB
-                )
-        self.I_source.write(self.cmd)
-        self.spd_sweep_arm_switch.get(self.spd_type_index, None)()
-        self.I_source.write("TRAC:POIN " + str(self.spd_num_points))
-        self.I_source.write("SOUR:PDEL:ARM")
-        self.armed = '1' in self.I_source.query("SOUR:PDEL:ARM?")
-#        print("sweep pulse delta armed = " + str(self.armed))
+    def dry_run(self):
+        """Work out what a run of the current tab would send, how many
+        readings it stores and how long it takes, without the instruments.
+
+        The arm and start code runs against a recording session in place of
+        the 6221 (and the 2182a, whose commands are marked "2182a>"). The
+        plan is printed along with what changed since the last dry run of
+        the same tab, and returned."""
+        self.flush_settings()
+        saved = (self.I_source, self.V_meter, self.connected, self.armed,
+                 self.cmd, dict(self.sent_settings), self.trace_buffer)
+        script = []
+        self.I_source = Keithley_dIdV_dryrun.RecordingSession(script)
+        if self.V_meter:
+            self.V_meter = Keithley_dIdV_2182a.Voltmeter2182a(
+                    Keithley_dIdV_dryrun.RecordingSession(script, "2182a> "))
+        self.connected = True
+        try:
+            self.clear_buffer()
+            self.arm_mode()
+            self.I_source.write("FORM:ELEM "
+                                + Keithley_dIdV_buffer.ELEMENT_STRING)
+            self.trace.start()
+            self.trace.poll()
+            self.trace.fetch(0, self.num_points)
+            self.trace.finish()
+        except (CommandError, TraceError) as err:
+            self.error_messages["command"] = str(err)
+            self.error_queue.append("command")
+            self.run_error_messages()
+            return None
+        finally:
+            (self.I_source, self.V_meter, self.connected, self.armed,
+             self.cmd, self.sent_settings, self.trace_buffer) = saved
+        config = self.configs[self.current_tab]
+        plan = Keithley_dIdV_dryrun.Plan(
+                config.parameter_string().splitlines()[0].strip(),
+                script, config.points, config.reading_period())
+        print(plan.format())
+        if self.current_tab in self.dry_runs:
+            print(plan.diff(self.dry_runs[self.current_tab])
+                  or "No change since the last dry run")
+        self.dry_runs[self.current_tab] = plan
+        self.statusBar().showMessage(
+                "Dry run: %d commands, %d points, %.1f s"
+                % (len(script), plan.points, plan.duration))
+        return plan
 
     def run_measurement(self):
         # Part where it arms the measurement
+        self.flush_settings()
         self.check_errors(False, True) # Change to True, True once files worked out
         if not self.errors_exist:
-            self.clear_buffer()
-            self.arm_switch[self.current_tab]()
+            try:
+                if self.AutoRangeCheckBox.isChecked():
+                    self.prescan_ranges()
+                self.snapshot.invalidate()
+                self.clear_buffer()
+                self.arm_mode()
+            except (CommandError, TraceError) as err:
+                # Nothing has been sent for a setting that failed its check,
+                # and nothing armed on a buffer that would not clear
+                self.armed = False
+                self.error_messages["command"] = str(err)
+                self.error_queue.append("command")
+                self.run_error_messages()
+            if self.armed and self.error_monitor:
+                # Catch a bad configuration now rather than after the run
+                self.instrument_errors += self.error_monitor.drain(False)
+                self.armed = not self.instrument_errors
             if self.armed:
+                # Read before locking; a locked checkbox reads unchecked
+                self.run_widgets = Keithley_dIdV_checkpoint.read_widgets(
+                        self.setting_widgets())
                 self.RunningButton.setChecked(True)
-                for k, v in self.signals_slots_dict["combo"].items():
-                    k.setEnabled(False)
-                for k, v in self.signals_slots_dict["field"].items():
-                    k.setReadOnly(True)
-                for k, v in self.signals_slots_dict["button1"].items():
-                    k.blockSignals(True)
-                for k, v in self.signals_slots_dict["checkbox"].items():
-                    k.setCheckable(False)
-                for k, v in self.signals_slots_dict["tab"].items():
-                    k.blockSignals(True)
+                self.lock_controls(True)
+                self.I_source.write("FORM:ELEM "
+                                    + Keithley_dIdV_buffer.ELEMENT_STRING)
                 if self.currentfile:
+                    self.snapshot.capture(
+                            self.I_source,
+                            self.V_meter.resource if self.V_meter else None)
+                    print("Instrument state read in %.1f ms"
+                          % (self.snapshot.elapsed * 1E3))
+                    self.currentfile.write(self.snapshot.format())
                     self.currentfile.write(self.header_string)
-                self.I_source.write("FORM:ELEM READ, TST, RNUM, SOUR, AVOL")
-                self.I_source.write("INIT:IMM")
-                time.sleep(5)
+                self.trace.start()
                 print("Initializing and starting")
                 self.run_error_messages()
-                self.i = 0
-                while (self.in_buffer < self.num_points
-                       and self.i < 1000 * self.num_points):
-                    self.in_buffer = int(self.I_source.query("TRAC:POIN:ACT?"))
-                    self.i += 1
-                    time.sleep(2)
-#                    print("points in buffer = " + str( self.in_buffer) + '\n'
-#                          + "total points = " + str(self.num_points))
-                self.datalist = self.I_source.query("TRAC:DATA?").split(',')
-                self.volt_array = [
-                        x for (i, x) in enumerate(self.datalist)
-                        if (not i % 5)
-                        ]
-                self.time_array = [
-                        x for (i, x) in enumerate(self.datalist)
-                        if (i % 5 == 1)
-                        ]
-                self.curr_array = [
-                        x for (i, x) in enumerate(self.datalist)
-                        if (i % 5 == 2)
-                        ]
-                self.avg_volt_array = [
-                        x for (i, x) in enumerate(self.datalist)
-                        if (i % 5 == 3)
-                        ]
-                self.num_array = [
-                        x for (i, x) in enumerate(self.datalist)
-                        if (i % 5 == 4)
-                        ]
-                self.num_array[-1].rstrip()
-                self.datalist = [
-                        x for y in (
-                                self.datalist[i:i+1]
-                                + (['\t'] * (i < len(self.datalist) - 0)
-                                if (i % 5 != 4) else ['\n'])
-                                for i in range(0, len(self.datalist), 1)
-                                )
-                        for x in y
-                        ]
-                del self.datalist[-1]
-                self.datalist = ['\n'] + self.datalist
-                self.datalist[-1].rstrip()
-#                print(''.join(self.datalist))
                 if self.currentfile:
-                    self.currentfile.write(''.join(self.datalist))
-                self.stop_measurement()
+                    self.currentfile.write('\n')
+                self.acquire(self.current_mode,
+                             self.configs[self.current_tab])
             else:
                 print('Unarmed')
                 self.run_error_messages()
 
+    def acquire(self, mode, config, saved=(), resumed_from=0):
+        """Read the buffer of an armed and started run until it is over,
+        then wrap the run up.
+
+        saved are the buffer fields of readings of a resumed run that were
+        in the save file before the current arm (resumed_from readings in
+        all, not all of them in saved); they count toward the averages and
+        the stored records."""
+        self.i = 0
+        self.points_read = 0
+        self.datalist = []
+        self.integrity_problems = []
+        self.sentinel_readings = 0
+        self.sweep_averager = None
+        self.noise_monitor = None
+        self.stop_reason = None
+        mode.begin_run(self, config)
+        if saved:
+            self.add_readings(list(saved),
+                              Keithley_dIdV_buffer.decode_fields(saved))
+        if self.currentfile:
+            self.start_checkpoint(mode, config, resumed_from)
+        while self.acquiring():
+            try:
+                self.in_buffer = self.trace.poll()
+            except TraceError as err:
+                self.integrity_problems.append(str(err))
+                self.stop_reason = BUFFER_FAULT
+                break
+            if self.in_buffer > self.points_read:
+                self.read_buffer_chunk(self.points_read,
+                                       self.in_buffer - self.points_read)
+            if self.points_read < self.num_points:
+                self.i += 1
+                self.wait(2)
+#            print("points in buffer = " + str( self.in_buffer) + '\n'
+#                  + "total points = " + str(self.num_points))
+        (self.volt_array, self.time_array, self.num_array,
+         self.curr_array, self.avg_volt_array) = (
+                Keithley_dIdV_buffer.deinterleave(self.datalist))
+        self.report_integrity()
+        mode.post_process(self, config, mode.to_records(self.datalist))
+        self.stop_measurement()
+
+    def read_buffer_chunk(self, start, count):
+        """Read count readings from the trace buffer starting at start.
+
+        Each transfer is checked (see Keithley_dIdV_buffer.check_transfer)
+        against the readings before it and fetched again if it is short or
+        out of sequence, so nothing from a bad transfer reaches the save
+        file. What is still wrong after FETCH_TRIES transfers is kept for
+        report_integrity. The readings are appended to the save file as they
+        arrive, with a checkpoint after them, and kept by add_readings."""
+        num_elements = Keithley_dIdV_buffer.NUM_ELEMENTS
+        previous = (Keithley_dIdV_buffer.decode_fields(
+                            self.datalist[-num_elements:])[0]
+                    if self.points_read else None)
+        for attempt in range(Keithley_dIdV_buffer.FETCH_TRIES):
+            fields = Keithley_dIdV_buffer.split_ascii(
+                    self.trace.fetch(start, count))
+            (values, problems) = Keithley_dIdV_buffer.check_transfer(
+                    fields, count, previous)
+            if not problems:
+                break
+            print("Readings %d to %d: %s"
+                  % (start, start + count - 1, "; ".join(problems)))
+        else:
+            self.integrity_problems.append(
+                    "Readings %d to %d after %d transfers: %s"
+                    % (start, start + count - 1, attempt + 1,
+                       "; ".join(problems)))
+        if values is None:
+            # Nothing usable; the next poll starts from the same reading.
+            return
+        self.sentinel_readings += len(
+                Keithley_dIdV_buffer.find_sentinels(values))
+        self.points_read += len(values)
+        if self.currentfile:
+            self.currentfile.write(
+                    Keithley_dIdV_buffer.format_rows(fields, leading=''))
+            if self.checkpoint:
+                self.save_checkpoint(values[-1])
+        self.add_readings(fields, values)
+
+    def add_readings(self, fields, values):
+        """Keep readings (string fields and decoded values) for the end of
+        the run and, for multi-sweep pulse delta, add them to the per-sweep
+        averages."""
+        self.datalist += fields
+        if self.sweep_averager:
+            self.sweep_averager.add(
+                    values[:, Keithley_dIdV_buffer.COLUMNS["READ"]],
+                    values[:, Keithley_dIdV_buffer.COLUMNS["SOUR"]])
+        if self.noise_monitor:
+            self.noise_monitor.add(
+                    values[:, Keithley_dIdV_buffer.COLUMNS["READ"]],
+                    values[:, Keithley_dIdV_buffer.COLUMNS["TST"]])
+            self.statusBar().showMessage(self.noise_monitor.summary())
+
+    def report_integrity(self):
+        """Print and show what the readout checks found in the run, and
+        whether the run stored the readings expected. A run stopped on
+        purpose (by the user or at the noise target) is short by design;
+        that is only printed. Returns the messages."""
+        messages = list(self.integrity_problems)
+        if self.sentinel_readings:
+            messages.append("%d readings over range or invalid"
+                            % self.sentinel_readings)
+        if self.points_read != self.num_points:
+            stored = ("%d of %d readings stored (%s)"
+                      % (self.points_read, self.num_points, self.stop_reason))
+            if self.stop_reason in LOST_READINGS:
+                messages.append(stored)
+            else:
+                print(stored)
+        if messages:
+            print("\n".join(messages))
+            self.statusBar().showMessage("; ".join(messages))
+        return messages
+
+    def acquiring(self):
+        """Return True while the run should keep reading the buffer--until
+        all points are in, the user stops the run, or the noise target of a
+        delta run is reached. Records why it stopped in stop_reason."""
+        if self.noise_monitor and self.noise_monitor.target_reached():
+            print("Noise target reached")
+            self.stop_reason = NOISE_TARGET
+        elif self.points_read >= self.num_points:
+            self.stop_reason = COMPLETE
+        elif not self.RunningButton.isChecked():
+            self.stop_reason = USER_STOP
+        elif self.i >= 1000 * self.num_points:
+            self.stop_reason = TIMEOUT
+        else:
+            return True
+        return False
+
+    def wait(self, seconds):
+        """Sleep without freezing the UI, so the Stop button still works."""
+        end = time.time() + seconds
+        while time.time() < end:
+            QtGui.QApplication.processEvents()
+            time.sleep(0.05)
+
+    def write_sweep_averages(self):
+        """Write the per-point mean and standard deviation over all sweeps
+        to a second file next to the raw data (<name>_avg.txt)."""
+        with open(self.base_name + "_avg" + self.ext, 'w') as avgfile:
+            avgfile.write(self.snapshot.format())
+            avgfile.write(''.join(
+                    [self.configs[self.current_tab].parameter_string(),
+                     'Source (A)', '\t',
+                     'Mean ', self.header_string_unit_switch.get(
+                             self.units_index), '\t',
+                     'Std. Dev.', '\t', 'Sweeps Averaged']))
+            avgfile.write(self.sweep_averager.format_averages())
+
+    def lock_controls(self, locked):
+        """Lock the settings, the buttons that start things and the tabs
+        for a run, or unlock them after it."""
+        for k, v in self.signals_slots_dict["combo"].items():
+            k.setEnabled(not locked)
+        for k, v in self.signals_slots_dict["field"].items():
+            k.setReadOnly(locked)
+        for k, v in self.signals_slots_dict["button1"].items():
+            k.blockSignals(locked)
+        for k, v in self.signals_slots_dict["checkbox"].items():
+            k.setCheckable(not locked)
+        for k, v in self.signals_slots_dict["tab"].items():
+            k.blockSignals(locked)
+
     def stop_measurement(self):
         # Part where it disarms the measurement and wraps up
         if self.RunningButton.isChecked():
-            for k, v in self.signals_slots_dict["combo"].items():
-                k.setEnabled(True)
-            for k, v in self.signals_slots_dict["field"].items():
-                k.setReadOnly(False)
-            for k, v in self.signals_slots_dict["button1"].items():
-                k.blockSignals(False)
-            for k, v in self.signals_slots_dict["checkbox"].items():
-                k.setCheckable(True)
-            for k, v in self.signals_slots_dict["tab"].items():
-                k.blockSignals(False)
-            self.I_source.write("SOUR:SWE:ABOR")
+            self.lock_controls(False)
+            self.trace.finish()
             print("Stopping Measurement")
             self.run_error_messages()
             #self.I_source.write("OUTP OFF; *RST")
-            self.update_spd_sweep_type() # To reenable properly?
+            # Unlocking cleared the read only fields of the sweep type
+            self.set_spd_read_only()
             # File closing stuff
+            if self.checkpoint:
+                Keithley_dIdV_checkpoint.clear()
+                self.checkpoint = None
             if self.currentfile:
                 self.currentfile.close()
                 self.currentfile = None
@@ -1147,21 +1341,185 @@ class dIdVGui(QtGui.QMainWindow, Keithley_dIdV_design2.Ui_MainWindow):
             print("measurement stopped")
             self.RunningButton.setChecked(False)
 
+    #%% Checkpoints
+    def setting_widgets(self):
+        """{attribute name: widget} of the settings a run depends on."""
+        widgets = set(self.signals_slots_dict["combo"])
+        widgets.update(self.signals_slots_dict["field"],
+                       self.signals_slots_dict["checkbox"])
+        widgets.difference_update((self.GPIB, self.FilePath))
+        return {name: widget for (name, widget) in vars(self).items()
+                if isinstance(widget, QtCore.QObject) and widget in widgets}
+
+    def start_checkpoint(self, mode, config, resumed_from=0):
+        """Start checkpointing a run saved to currentfile, whose readings
+        (after the resumed_from of a resumed run) start at the current end
+        of the file."""
+        self.currentfile.flush()
+        offset = self.currentfile.tell()
+        self.checkpoint = Keithley_dIdV_checkpoint.Checkpoint(
+                path=os.path.abspath(self.currentfile.name),
+                tab=self.current_tab, mode=mode.name,
+                config_type=type(config).__name__,
+                config_values=list(config),
+                config_hash=Keithley_dIdV_checkpoint.config_hash(config),
+                widgets=self.run_widgets,
+                expected=self.num_points, resumed_from=resumed_from,
+                buffer_offset=offset, buffer_points=0, offset=offset,
+                segment_points=mode.segment_points(config))
+        self.checkpoint.save()
+
+    def save_checkpoint(self, last):
+        """Checkpoint the readings saved so far; last is the decoded last
+        one. The file is synced first, so the checkpoint is never ahead of
+        it."""
+        self.currentfile.flush()
+        os.fsync(self.currentfile.fileno())
+        columns = Keithley_dIdV_buffer.COLUMNS
+        self.checkpoint.update(
+                self.points_read, self.currentfile.tell(),
+                (last[columns["RNUM"]], last[columns["TST"]]))
+        self.checkpoint.save()
+
+    def offer_resume(self):
+        """Offer to finish a run that the last session did not (see
+        Keithley_dIdV_checkpoint). A run that is not taken up is
+        forgotten."""
+        checkpoint = Keithley_dIdV_checkpoint.load()
+        if not checkpoint:
+            return
+        if (os.path.exists(checkpoint.path or '')
+                and QMessageBox.question(
+                        self, "Unfinished run",
+                        checkpoint.summary() + ". Finish it?",
+                        QMessageBox.Yes | QMessageBox.No)
+                == QMessageBox.Yes):
+            self.resume_run(checkpoint)
+        else:
+            Keithley_dIdV_checkpoint.clear()
+
+    def resume_run(self, checkpoint):
+        """Finish the run of a checkpoint: from the 6221 buffer if it still
+        holds the run, otherwise by measuring the segments the run did not
+        get to. Returns False if the run cannot be finished."""
+        mode = self.modes[checkpoint.tab]
+        config = checkpoint.run_config()
+        Keithley_dIdV_checkpoint.restore_widgets(self.setting_widgets(),
+                                                 checkpoint.widgets)
+        self.run_widgets = checkpoint.widgets
+        self.TabWidget.blockSignals(True)
+        self.TabWidget.setCurrentIndex(checkpoint.tab)
+        self.TabWidget.blockSignals(False)
+        self.current_tab = checkpoint.tab
+        if config is None:
+            return self.not_resumed("the checkpoint does not match its "
+                                    "config")
+        rows = Keithley_dIdV_checkpoint.saved_rows(checkpoint.path,
+                                                   checkpoint.offset)
+        recover = checkpoint.buffer_intact(self.I_source)
+        if recover:
+            # The 6221 kept the run; read it again from the start of the
+            # buffer, sending nothing that could disturb it.
+            (keep, resumed_from) = (checkpoint.buffer_offset,
+                                    checkpoint.resumed_from)
+            self.configs[checkpoint.tab] = config
+            self.num_points = checkpoint.expected
+            if '1' not in self.I_source.query(mode.arm_command + "?"):
+                # Over or aborted: take what the buffer has
+                self.num_points = min(self.num_points,
+                                      self.trace.read_count())
+            self.trace.resume(self.num_points)
+        else:
+            resumed_from = checkpoint.segments_done * checkpoint.segment_points
+            remaining = mode.remaining(config, resumed_from)
+            if remaining is None:
+                return self.not_resumed(mode.name + " runs cannot be resumed")
+            if len(rows) < resumed_from:
+                return self.not_resumed("the data file is missing readings")
+            if resumed_from >= mode.expected_points(config):
+                return self.not_resumed("the run has all its readings")
+            keep = (rows[resumed_from][0] if resumed_from < len(rows)
+                    else checkpoint.offset)
+            try:
+                for update in (self.update_compliance, self.update_units,
+                               self.update_source_range_type,
+                               self.update_source_range,
+                               self.update_volt_range):
+                    update()
+                self.update_mode_vars(checkpoint.tab)
+                if (Keithley_dIdV_checkpoint.config_hash(
+                        self.configs[checkpoint.tab])
+                        != checkpoint.config_hash):
+                    return self.not_resumed("the settings of the run could "
+                                            "not be restored")
+                self.clear_buffer()
+                self.arm_mode(remaining)
+            except (CommandError, TraceError) as err:
+                return self.not_resumed(str(err))
+            if not self.armed:
+                return self.not_resumed("the rest of the run did not arm")
+        self.currentfile = open(checkpoint.path, 'r+')
+        self.currentfile.truncate(keep)
+        self.currentfile.seek(keep)
+        (self.base_name, self.ext) = os.path.splitext(checkpoint.path)
+        self.FilePath.setText(checkpoint.path)
+        self.RunningButton.setChecked(True)
+        self.lock_controls(True)
+        if recover:
+            print("Recovering the run from the 6221 buffer")
+        else:
+            print("Resuming the run after %d readings" % resumed_from)
+            self.currentfile.write(
+                    "Resumed after %d readings on %s\n"
+                    % (resumed_from, time.strftime("%Y-%m-%d %H:%M:%S")))
+            self.I_source.write("FORM:ELEM "
+                                + Keithley_dIdV_buffer.ELEMENT_STRING)
+            self.trace.start()
+        self.acquire(mode, config,
+                     [x for (offset, fields) in rows[:resumed_from]
+                      for x in fields],
+                     resumed_from)
+        return True
+
+    def not_resumed(self, reason):
+        """Report why an unfinished run was not resumed and forget it.
+        Returns False."""
+        Keithley_dIdV_checkpoint.clear()
+        message = "Run not resumed: " + reason
+        print(message)
+        self.statusBar().showMessage(message)
+        return False
+
+    def open_source(self):
+        """Open the 6221 at I_source_list[0] and ask whether the 2182a is
+        attached. The pool hands back the open session; if it has gone bad,
+        drop it and try once more on a fresh one. Returns False if the 6221
+        does not answer either time."""
+        for attempt in range(2):
+            try:
+                self.I_source = self.rm.open_resource(self.I_source_list[0])
+                self.V_meter_connected = self.I_source.query(
+                        'SOUR:DCON:NVPR?')
+                return True
+            except Exception:
+                self.rm.discard(self.I_source_list[0])
+        return False
+
     def check_errors(self, checkfile, checkbuffer):
         self.errors_exist = False
         self.error_queue = deque([])
-        self.I_source_list = [
-                x for x in self.resources
-                if (str(self.GPIB.value()) and 'GPIB') in x
-                ]
+        self.I_source_list = (self.rm.find(self.resources, self.GPIB.value())
+                              if self.rm else [])
+        if self.I_source_list and not self.open_source():
+            self.I_source_list = []
         if not self.I_source_list:
             self.I_source = False
+            self.start_error_monitor()
             self.error_queue.append(0)
             self.errors_exist = True
             self.run_error_messages()
         else:
-            self.I_source = self.rm.open_resource(self.I_source_list[0])
-            self.V_meter_connected = self.I_source.query('SOUR:DCON:NVPR?')
+            self.start_error_monitor()
             if not self.V_meter_connected:
                 self.error_queue.append(1)
                 self.errors_exist = True
@@ -1172,34 +1530,36 @@ class dIdVGui(QtGui.QMainWindow, Keithley_dIdV_design2.Ui_MainWindow):
                 self.errors_exist = True
                 if not checkbuffer:
                     self.run_error_messages
-            if checkbuffer and ((self.dIdV_num_points > 65536
-                                 and self.current_tab == 0)
-                                or (self.delta_num_points > 65536
-                                    and self.current_tab == 1)
-                                or (self.fpd_num_points > 65536
-                                    and self.current_tab == 2)
-                                or (self.spd_num_points > 65536
-                                    and self.current_tab == 3)):
+            if checkbuffer and self.configs[self.current_tab].points > 65536:
                 self.error_queue.append(3)
                 self.errors_exist = True
                 self.run_error_messages()
 
 
     def run_error_messages(self):
-        """Create a dialog box explaining why measurement cannot start."""
-        self.error = ""
-        #while self.error_queue:
-            #self.error += (self.error_messages.get(
-             #       self.error_queue.popleft, None
-              #      ) + " ")
-        #self.error += self.I_source.query("STAT:QUE?")
-        #print(self.error)
-        #self.I_source.write("STAT:QUE:CLE")
-        #self.message_box.setText(self.error)
-        #self.message_box.exec_()
+        """Report why a measurement cannot start and any errors the 6221
+        has reported, in the status bar and the console.
+
+        The 6221 errors come from the background error monitor, so this
+        never waits on the bus."""
+        messages = []
+        while self.error_queue:
+            messages.append(self.error_messages.get(
+                    self.error_queue.popleft(), ""))
+        messages += [Keithley_dIdV_errors.format_error(x)
+                     for x in self.instrument_errors]
+        self.instrument_errors = []
+        self.error = " ".join(messages)
+        if self.error:
+            print(self.error)
+            self.statusBar().showMessage(self.error)
 
     def exit(self):
         self.stop_measurement()
+        if self.error_monitor:
+            self.error_monitor.stop()
+        if self.rm:
+            self.rm.close()
         sys.exit()
 
 def main():
@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+"""
+This module holds the measurement modes of the dI/dV program and the registry
+they are looked up in--one Mode object per tab, with everything the GUI needs
+to know about a mode: how to read its settings from the UI into a config,
+which commands arm it, how to range the source and filter the readings, the
+layout of its stored records and what to do with them after a run.
+
+The GUI has no per-mode code of its own; it asks the mode of the current tab.
+The four 6221 modes are registered here, in the order of the tabs in the
+designer file. A new mode is a Mode subclass with the @register decorator,
+imported before the GUI is built; modes past the fourth get a tab of their
+own from create_tab().
+
+Usage:
+    @Keithley_dIdV_modes.register
+    class PulseTrainMode(Keithley_dIdV_modes.Mode):
+        name = "Pulse Train"
+        arm_command = "SOUR:PDEL:ARM"
+        def create_tab(self, gui): ...
+        def configure(self, gui): ...
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import abc
+import numpy as np
+import Keithley_dIdV_buffer
+import Keithley_dIdV_config
+import Keithley_dIdV_autorange
+import Keithley_dIdV_stats
+from Keithley_dIdV_commands import COMMANDS
+
+__author__ = "Sarah Friedensen"
+__credits__ = "Sarah Friedensen"
+__license__ = "GPL3+"
+__version__ = "1.0"
+__maintainer__ = "Sarah Friedensen"
+__email__ = "safrie@sas.upenn.edu"
+__status__ = "Development"
+
+MODES = []
+
+
+def register(mode_class):
+    """Class decorator: add a mode to the registry. Tabs follow the order of
+    registration."""
+    MODES.append(mode_class)
+    return mode_class
+
+
+def registered():
+    return list(MODES)
+
+
+class Mode(object, metaclass=abc.ABCMeta):
+    """One measurement mode.
+
+    Subclasses set the class attributes below and implement configure(); a
+    mode without it cannot be made.
+    Widget attributes are names of widgets on the GUI.
+        name                shown on the tab and in dry runs
+        arm_command         arms the mode; the same with ? checks it
+        range_commands      (best or auto, fixed) source range type
+                            commands, or None to leave the ranging alone
+        rate_widget         2182a rate (PLC) field, or None if the 6221
+                            times the readings
+        filter_widgets      (window, count, on checkbox) of the 6221 filter
+        filter_type_widget  combo box (moving, repeating), or None to use
+                            filter_type
+        elements            buffer elements of a stored reading"""
+
+    name = ""
+    arm_command = None
+    range_commands = None
+    rate_widget = None
+    filter_widgets = (None, None, None)
+    filter_type_widget = None
+    filter_type = "MOV"
+    elements = Keithley_dIdV_buffer.ELEMENTS
+
+    def __init__(self, index):
+        self.index = index
+
+    #%% UI
+    def create_tab(self, gui):
+        """Return the tab widget for a mode the designer file has no tab
+        for, with its fields connected to gui.defer(gui.mode_updaters[
+        self.index]). Only called for modes past the designer's tabs,
+        which must override it."""
+        raise TypeError("%s is registered as tab %d, but the designer file "
+                        "has %d tabs and it does not override create_tab()"
+                        % (type(self).__name__, self.index + 1,
+                           gui.TabWidget.count()))
+
+    @abc.abstractmethod
+    def configure(self, gui):
+        """Read the settings from the UI and return the mode's config
+        (see Keithley_dIdV_config)."""
+
+    def configured(self, gui, config):
+        """Show anything derived from a new config in the UI."""
+
+    def _value(self, gui, name, method, default):
+        return getattr(getattr(gui, name), method)() if name else default
+
+    def filter_window(self, gui):
+        return self._value(gui, self.filter_widgets[0], "value", 0)
+
+    def filter_count(self, gui):
+        return self._value(gui, self.filter_widgets[1], "value", 10)
+
+    def filter_on(self, gui):
+        return self._value(gui, self.filter_widgets[2], "isChecked", False)
+
+    def get_filter_type(self, gui):
+        if self.filter_type_widget:
+            return ("REP" if getattr(gui, self.filter_type_widget)
+                    .currentIndex() else "MOV")
+        return self.filter_type
+
+    def filter_commands(self, gui):
+        """The commands that set the filter of the mode: type, window and
+        count, then on or off. Raises Keithley_dIdV_commands.CommandError
+        for a setting out of range."""
+        return [COMMANDS["filter"].render(self.get_filter_type(gui),
+                                          self.filter_window(gui),
+                                          self.filter_count(gui)),
+                "SENS:AVER " + ("ON; " if self.filter_on(gui) else "OFF; ")]
+
+    def filter_string(self, gui):
+        return ("Filter Type = " + self.get_filter_type(gui)
+                + "Filter Window = " + str(self.filter_window(gui))
+                + "Filter Count = " + str(self.filter_count(gui)))
+
+    def voltmeter_rate(self, gui):
+        """The 2182a rate (PLC) in rate_widget, as sent."""
+        return str(getattr(gui, self.rate_widget).value())
+
+    def filter_repeats(self, gui):
+        """Readings averaged into each stored reading: the filter count for
+        a repeating filter that is on, otherwise 1."""
+        if self.filter_on(gui) and self.get_filter_type(gui) == "REP":
+            return self.filter_count(gui)
+        return 1
+
+    #%% Instrument
+    def prepare(self, gui):
+        """Send settings the mode needs before its own commands."""
+
+    def commands(self, config):
+        """The commands that set the mode up. Raises
+        Keithley_dIdV_commands.CommandError for a bad config."""
+        return config.commands()
+
+    def expected_points(self, config):
+        return config.points
+
+    def segment_points(self, config):
+        """Readings in a segment: the smallest part of a run that can be
+        measured again on its own when an interrupted run is resumed."""
+        return 1
+
+    def remaining(self, config, done):
+        """The config for the rest of the run after done readings (whole
+        segments), or None if the mode cannot resume a run."""
+        return None
+
+    def bias_currents(self, gui, config):
+        """Currents (A) for the range pre-scan, spanning the run."""
+        return Keithley_dIdV_autorange.scan_points(*config.bias_range())
+
+    def prescan_skipped(self, gui):
+        """Why the range pre-scan must not run for this mode, or None. The
+        pre-scan holds each of the bias currents as DC."""
+        return None
+
+    def arm(self, gui, commands):
+        """Send commands and arm. Returns True if the 6221 is armed."""
+        for cmd in commands:
+            gui.cmd = cmd
+            gui.I_source.write(cmd)
+        gui.I_source.write(self.arm_command)
+        return '1' in gui.I_source.query(self.arm_command + "?")
+
+    #%% Data
+    @property
+    def record_dtype(self):
+        return np.dtype([(x, 'f8') for x in self.elements])
+
+    def to_records(self, fields):
+        """Structured array of the stored readings from buffer fields."""
+        values = Keithley_dIdV_buffer.decode_fields(fields,
+                                                    len(self.elements))
+        return np.rec.fromarrays(values.T, dtype=self.record_dtype)
+
+    def begin_run(self, gui, config):
+        """Set up whatever follows the readings during a run."""
+
+    def post_process(self, gui, config, records):
+        """Called with the stored readings after a run."""
+
+
+#%% Built-in modes
+@register
+class DifferentialConductanceMode(Mode):
+    name = "Differential Conductance"
+    arm_command = "SOUR:DCON:ARM"
+    rate_widget = "dIdVRate"
+    filter_widgets = ("dIdVFilterWindow", "dIdVFilterCount",
+                      "dIdVFilterCheckbox")
+    filter_type = "REP"
+
+    def configure(self, gui):
+        return Keithley_dIdV_config.DIdVConfig(
+                gui.dIdVStartCurr.value(), gui.dIdVStopCurr.value(),
+                gui.dIdVStepSize.value(), gui.dIdVDeltaCurr.value(),
+                gui.dIdVDelay.value(), self.voltmeter_rate(gui),
+                gui.compliance_voltage, gui.CAB,
+                " ".join(self.filter_commands(gui)),
+                self.filter_repeats(gui))
+
+    def prepare(self, gui):
+        gui.update_units()
+        gui.update_volt_range()
+
+    def remaining(self, config, done):
+        # Rounded so the sweep keeps its last point
+        return config._replace(start=round(config.start + done * config.step,
+                                           9))
+
+
+@register
+class DeltaMode(Mode):
+    name = "Delta"
+    arm_command = "SOUR:DELT:ARM"
+    range_commands = ("CURR:RANG:AUTO ON", "CURR:RANG:AUTO OFF")
+    rate_widget = "DeltaRate"
+    filter_widgets = ("DeltaFilterWindow", "DeltaFilterCount",
+                      "DeltaFilterCheckbox")
+    filter_type_widget = "DeltaFilterComboBox"
+
+    def configure(self, gui):
+        return Keithley_dIdV_config.DeltaConfig(
+                gui.DeltaHighCurr.value(), gui.DeltaLowCurr.value(),
+                gui.DeltaPulseCount.value(), gui.DeltaDelay.value(),
+                self.voltmeter_rate(gui), gui.DeltaNoiseTarget.value(),
+                gui.compliance_voltage, gui.CAB,
+                " ".join(self.filter_commands(gui)),
+                self.filter_repeats(gui))
+
+    def prepare(self, gui):
+        gui.update_volt_rate()
+
+    def remaining(self, config, done):
+        return config._replace(count=config.count - done)
+
+    def begin_run(self, gui, config):
+        # Stop the run once the noise target is reached
+        gui.noise_monitor = Keithley_dIdV_stats.NoiseMonitor(
+                config.noise_target_volts)
+
+
+class PulseMode(Mode):
+    """A pulse delta mode. Its config has a timing() (see
+    Keithley_dIdV_pulse), checked against the duty cycle limit in
+    duty_limit_widget whenever it changes while its tab is open."""
+
+    duty_limit_widget = None
+
+    def configured(self, gui, config):
+        if self.index == gui.current_tab:
+            gui.show_pulse_timing(config.timing(),
+                                  getattr(gui, self.duty_limit_widget).value())
+
+    def prescan_skipped(self, gui):
+        limit = getattr(gui, self.duty_limit_widget).value()
+        if limit:
+            return ("it would hold the pulse currents as DC, past the "
+                    + str(limit) + "% duty limit")
+        return None
+
+
+@register
+class FixedPulseDeltaMode(PulseMode):
+    name = "Fixed Pulse Delta"
+    arm_command = "SOUR:PDEL:ARM"
+    range_commands = ("SOUR:PDEL:RANG BEST", "SOUR:PDEL:RANG FIX")
+    filter_widgets = ("FixedPulseDeltaFilterWindow",
+                      "FixedPulseDeltaFilterCount",
+                      "FixedPulseDeltaFilterCheckbox")
+    filter_type_widget = "FixedPulseDeltaComboBox"
+    duty_limit_widget = "FixedPulseDeltaDutyLimit"
+
+    def configure(self, gui):
+        return Keithley_dIdV_config.FixedPulseDeltaConfig(
+                gui.FixedPulseDeltaHighI.value(),
+                gui.FixedPulseDeltaLowI.value(),
+                gui.FixedPulseDeltaCount.value(),
+                gui.FixedPulseDeltaDelay.value(),
+                gui.FixedPulseDeltaWidth.value(),
+                gui.FixedPulseDeltaCycle.value(),
+                "2" if gui.FixedPulseDeltaLowMeasure.isChecked() else "1",
+                gui.compliance_voltage, " ".join(self.filter_commands(gui)),
+                self.filter_repeats(gui))
+
+    def configured(self, gui, config):
+        gui.DutyCycle.setValue(config.duty_cycle)
+        PulseMode.configured(self, gui, config)
+
+    def remaining(self, config, done):
+        return config._replace(count=config.count - done)
+
+
+@register
+class SweepPulseDeltaMode(PulseMode):
+    name = "Sweep Pulse Delta"
+    arm_command = "SOUR:PDEL:ARM"
+    range_commands = ("SOUR:SWE:RANG BEST", "SOUR:SWE:RANG FIX")
+    filter_widgets = ("SweepPulseDeltaFilterWindow",
+                      "SweepPulseDeltaFilterCount",
+                      "SweepPulseDeltaFilterCheckbox")
+    duty_limit_widget = "SweepPulseDeltaDutyLimit"
+
+    def configure(self, gui):
+        gui.spd_type_index = int(gui.SweepTypeComboBox.currentIndex())
+        gui.spd_points = gui.spd_points_switch.get(gui.spd_type_index, None)()
+        if gui.spd_type_index != 1:
+            gui.SweepPulseDeltaPoints.setReadOnly(False)
+            gui.SweepPulseDeltaPoints.setValue(gui.spd_points)
+            gui.SweepPulseDeltaPoints.setReadOnly(True)
+        return Keithley_dIdV_config.SweepPulseDeltaConfig(
+                gui.spd_type_index, gui.SweepPulseDeltaStartI.value(),
+                gui.SweepPulseDeltaEndI.value(),
+                gui.SweepPulseDeltaIStep.value(), gui.spd_points,
+                gui.SweepPulseDeltaWidth.value(),
+                gui.SweepPulseDeltaCycle.value(),
+                "2" if gui.SweepPulseDeltaLowMeasure.isChecked() else "1",
+                gui.SweepPulseDeltaSweeps.value(), gui.compliance_voltage,
+                gui.CAB, " ".join(self.filter_commands(gui)),
+                ("\n" + self.filter_string(gui) if self.filter_on(gui)
+                 else "\n #NoFilter"),
+                self.filter_repeats(gui))
+
+    def segment_points(self, config):
+        return config.sweep_points
+
+    def remaining(self, config, done):
+        return config._replace(
+                num_sweeps=config.num_sweeps - done // config.sweep_points)
+
+    def bias_currents(self, gui, config):
+        if config.sweep_type == 2 and gui.I_list_float:
+            return gui.I_list_float
+        return Mode.bias_currents(self, gui, config)
+
+    def begin_run(self, gui, config):
+        # Per-point averages over the sweeps
+        gui.sweep_averager = Keithley_dIdV_stats.SweepAverager(
+                config.sweep_points, config.num_sweeps)
+
+    def post_process(self, gui, config, records):
+        if gui.currentfile:
+            gui.write_sweep_averages()
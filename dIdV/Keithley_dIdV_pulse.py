@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""
+This module holds the pulse timing planner for the pulse delta modes of the
+dI/dV program--a model of the 6221 pulse delta timing limits that checks a
+pulse width, source delay, low measurement count, filter count and cycle
+interval against each other, and works out the fastest legal cycle and the
+readings per second it gives.
+
+Timing model of one pulse delta cycle (see the cycle interval tooltip):
+    The low and high measurements each start on a power line cycle, so a
+    cycle needs low_measure + 1 line cycles, and the 6221 allows no fewer
+    than MIN_INTERVAL. The pulse has to end inside the interval.
+    The 2182a reading starts source_delay after the pulse edge and must be
+    over before the pulse ends: source_delay + MEASURE_TIME <= width.
+    A repeating filter stores one reading per filter_count cycles.
+    The duty cycle is the pulse width over the interval; the sample's
+    thermal limit caps it, which sets a floor on the interval for a given
+    width.
+
+Usage:
+    timing = Keithley_dIdV_pulse.PulseTiming(110E-6, 16E-6, 5, 2, 1)
+    timing.problems(duty_limit=1.0)
+    timing.fastest(duty_limit=1.0).points_per_second
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import math
+from collections import namedtuple
+from Keithley_dIdV_commands import PARAMS
+
+__author__ = "Sarah Friedensen"
+__credits__ = "Sarah Friedensen"
+__license__ = "GPL3+"
+__version__ = "1.0"
+__maintainer__ = "Sarah Friedensen"
+__email__ = "safrie@sas.upenn.edu"
+__status__ = "Development"
+
+LINE_PERIOD = 1 / 60.0  # s per power line cycle
+WIDTH = PARAMS["SOUR:PDEL:WIDT"]
+SOURCE_DELAY = PARAMS["SOUR:PDEL:SDEL"]
+MIN_INTERVAL = PARAMS["SOUR:PDEL:INT"].low  # PLC
+MAX_INTERVAL = PARAMS["SOUR:PDEL:INT"].high  # PLC
+DEFAULT_SOURCE_DELAY = SOURCE_DELAY.low  # s, the 6221 default
+MEASURE_TIME = 34E-6  # s, about, for a 2182a pulse mode reading
+
+
+class PulseTiming(namedtuple("PulseTiming", (
+        "width", "source_delay", "interval", "low_measure",
+        "filter_count"))):
+    """Pulse width and source delay in s, cycle interval in PLC,
+    low_measure 1 or 2, filter_count readings per stored reading. Duty
+    limits are in percent; None or 0 is no limit."""
+
+    __slots__ = ()
+
+    @property
+    def duty_cycle(self):
+        """Percent of the cycle interval the pulse is on."""
+        return self.width / (self.interval * LINE_PERIOD) * 100
+
+    @property
+    def period(self):
+        """Seconds per stored reading."""
+        return self.interval * LINE_PERIOD * self.filter_count
+
+    @property
+    def points_per_second(self):
+        return 1 / self.period
+
+    def min_interval(self, duty_limit=None):
+        """Shortest legal cycle interval (PLC) for this width."""
+        interval = max(MIN_INTERVAL, self.low_measure + 1,
+                       math.floor(self.width / LINE_PERIOD) + 1)
+        if duty_limit:
+            interval = max(interval, math.ceil(
+                    self.width * 100 / (duty_limit * LINE_PERIOD) - 1E-9))
+        return min(interval, MAX_INTERVAL)
+
+    def problems(self, duty_limit=None):
+        """What the instrument or the duty limit would not allow, as a
+        list of messages."""
+        found = []
+        for (value, param, name) in ((self.width, WIDTH, "Pulse width"),
+                                     (self.source_delay, SOURCE_DELAY,
+                                      "Source delay")):
+            if not param.low <= value <= param.high:
+                found.append("%s %g us is outside %g to %g us"
+                             % (name, value * 1E6, param.low * 1E6,
+                                param.high * 1E6))
+        if self.source_delay + MEASURE_TIME > self.width:
+            found.append("Pulse ends before the reading: width must be at "
+                         "least source delay + %g us"
+                         % (MEASURE_TIME * 1E6))
+        if self.interval < self.min_interval():
+            found.append("Cycle interval must be at least %d PLC"
+                         % self.min_interval())
+        if duty_limit and self.duty_cycle > duty_limit:
+            found.append("Duty cycle %.3g%% is over the %.3g%% limit"
+                         % (self.duty_cycle, duty_limit))
+        return found
+
+    def fastest(self, duty_limit=None):
+        """The legal timing with the shortest cycle, keeping the source
+        delay and the width where they are legal."""
+        source_delay = min(max(self.source_delay, SOURCE_DELAY.low),
+                           SOURCE_DELAY.high)
+        width = min(max(self.width, source_delay + MEASURE_TIME, WIDTH.low),
+                    WIDTH.high)
+        timing = self._replace(width=width, source_delay=source_delay)
+        return timing._replace(interval=timing.min_interval(duty_limit))
+
+    def shortest(self, duty_limit=None):
+        """fastest() with the pulse cut to the least that holds the
+        reading."""
+        timing = self.fastest(duty_limit)
+        timing = timing._replace(width=max(
+                WIDTH.low, timing.source_delay + MEASURE_TIME))
+        return timing._replace(interval=timing.min_interval(duty_limit))
+
+    def summary(self, duty_limit=None):
+        """One line on the timing, its problems and the fastest legal
+        cycle."""
+        parts = ["%d PLC cycle, %.3g readings/s, duty %.3g%%"
+                 % (self.interval, self.points_per_second, self.duty_cycle)]
+        parts += self.problems(duty_limit)
+        fastest = self.fastest(duty_limit)
+        if fastest.interval != self.interval or parts[1:]:
+            parts.append("fastest legal %d PLC (%.3g readings/s)"
+                         % (fastest.interval, fastest.points_per_second))
+        shortest = self.shortest(duty_limit)
+        if shortest.interval < fastest.interval:
+            parts.append("%d PLC with %g us pulses"
+                         % (shortest.interval, shortest.width * 1E6))
+        return "; ".join(parts)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+This module holds the instrument state snapshot that goes into every data
+file--the settings the 6221 and the 2182a actually have at the start of a
+run, as opposed to what the UI thinks it sent.
+
+The settings are read with a few semicolon-joined queries rather than one
+query each, so the snapshot costs a handful of bus transactions. The 2182a
+is read directly if it is on GPIB and otherwise through the 6221's serial
+port (one relayed query for all of its settings).
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import time
+
+__author__ = "Sarah Friedensen"
+__credits__ = "Sarah Friedensen"
+__license__ = "GPL3+"
+__version__ = "1.0"
+__maintainer__ = "Sarah Friedensen"
+__email__ = "safrie@sas.upenn.edu"
+__status__ = "Development"
+
+SOURCE_SETTINGS = (
+        "OUTP", "OUTP:RESP", "OUTP:LTE", "OUTP:ISH",
+        "SOUR:CURR", "SOUR:CURR:RANG", "SOUR:CURR:RANG:AUTO",
+        "SOUR:CURR:COMP", "SOUR:CURR:FILT", "UNIT", "UNIT:POW",
+        "SOUR:DCON:STAR", "SOUR:DCON:STEP", "SOUR:DCON:STOP",
+        "SOUR:DCON:DELT", "SOUR:DCON:DEL", "SOUR:DCON:CAB",
+        "SOUR:DELT:HIGH", "SOUR:DELT:LOW", "SOUR:DELT:DEL",
+        "SOUR:DELT:COUN", "SOUR:DELT:CAB",
+        "SOUR:PDEL:HIGH", "SOUR:PDEL:LOW", "SOUR:PDEL:WIDT",
+        "SOUR:PDEL:SDEL", "SOUR:PDEL:COUN", "SOUR:PDEL:RANG",
+        "SOUR:PDEL:INT", "SOUR:PDEL:SWE", "SOUR:PDEL:LME",
+        "SOUR:SWE:SPAC", "SOUR:SWE:POIN", "SOUR:SWE:RANG",
+        "SOUR:SWE:COUN", "SOUR:SWE:CAB",
+        "SOUR:CURR:STAR", "SOUR:CURR:STOP", "SOUR:CURR:STEP",
+        "SENS:AVER", "SENS:AVER:TCON", "SENS:AVER:WIND", "SENS:AVER:COUN",
+        "TRAC:POIN", "FORM:ELEM", "FORM:DATA"
+        )
+
+VOLTMETER_SETTINGS = (
+        "SENS:FUNC", "SENS:VOLT:RANG", "SENS:VOLT:RANG:AUTO",
+        "SENS:VOLT:NPLC", "SENS:VOLT:DFIL:STAT", "SENS:VOLT:DFIL:TCON",
+        "SENS:VOLT:DFIL:COUN", "SENS:VOLT:LPAS", "SENS:VOLT:REF:STAT"
+        )
+
+BATCH_SIZE = 24  # queries per message, well inside the input buffer
+
+
+def batched_query(session, headers, batch=BATCH_SIZE):
+    """Query every header, batch at a time, and return {header: answer}."""
+    state = {}
+    for first in range(0, len(headers), batch):
+        chunk = headers[first:first + batch]
+        answers = session.query(
+                '; '.join(':' + x + '?' for x in chunk)).split(';')
+        state.update(zip(chunk, (x.strip() for x in answers)))
+    return state
+
+
+def relayed_query(source, headers):
+    """Query the 2182a through the 6221's serial port with one relayed
+    message and return {header: answer}."""
+    source.write("SYST:COMM:SER:SEND '"
+                 + '; '.join(':' + x + '?' for x in headers) + "'")
+    answers = source.query("SYST:COMM:SER:ENT?").split(';')
+    return dict(zip(headers, (x.strip() for x in answers)))
+
+
+class Snapshot(object):
+    """Cached instrument state for the current run.
+
+    capture() reads the state unless it is already cached; call invalidate()
+    when the settings may have changed (at the start of every run)."""
+
+    def __init__(self):
+        self.source_state = {}
+        self.voltmeter_state = {}
+        self.valid = False
+        self.elapsed = None
+        self.taken = None
+
+    def invalidate(self):
+        self.valid = False
+
+    def capture(self, source, voltmeter=None):
+        """Read the 6221 settings, and the 2182a settings directly from
+        voltmeter if given, otherwise through the 6221."""
+        if self.valid:
+            return self
+        start = time.perf_counter()
+        self.source_state = batched_query(source, SOURCE_SETTINGS)
+        self.voltmeter_state = (
+                batched_query(voltmeter, VOLTMETER_SETTINGS) if voltmeter
+                else relayed_query(source, VOLTMETER_SETTINGS))
+        self.elapsed = time.perf_counter() - start
+        self.taken = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.valid = True
+        return self
+
+    def format(self):
+        """Header lines for the data file (they start with letters, so the
+        loaders skip them)."""
+        return ("Instrument state at " + str(self.taken) + "\n"
+                + "Keithley 6221: " + self._join(self.source_state) + "\n"
+                + "Keithley 2182a: " + self._join(self.voltmeter_state)
+                + "\n")
+
+    def _join(self, state):
+        return '\t'.join(k + " = " + v for (k, v) in state.items())
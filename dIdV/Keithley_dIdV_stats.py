@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+"""
+This module holds the statistics that are updated while data streams in from
+the instrument--per-sweep splitting and averaging for multi-sweep pulse delta
+runs, and running mean, variance, drift and overlapping Allan deviation for
+long delta runs.
+
+Everything here is updated one chunk at a time with a fixed amount of work
+per reading, so the statistics can be shown live during a run.
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import numpy as np
+
+__author__ = "Sarah Friedensen"
+__credits__ = "Sarah Friedensen"
+__license__ = "GPL3+"
+__version__ = "1.0"
+__maintainer__ = "Sarah Friedensen"
+__email__ = "safrie@sas.upenn.edu"
+__status__ = "Development"
+
+
+class SweepAverager(object):
+    """Split a stream of sweep readings into a (sweeps x points) array and
+    keep a running mean and standard deviation per bias point.
+
+    Readings are added in buffer order with add(); the mean and standard
+    deviation over the sweeps seen so far are always up to date (Welford's
+    algorithm), so the averaged curve is ready as soon as the last sweep has
+    been added."""
+
+    def __init__(self, points, sweeps):
+        self.points = int(points)
+        self.sweeps = int(sweeps)
+        self.readings = np.full((self.sweeps, self.points), np.nan)
+        self.source = np.full(self.points, np.nan)
+        self.count = np.zeros(self.points, dtype=int)
+        self.mean = np.zeros(self.points)
+        self.m2 = np.zeros(self.points)
+        self.n = 0
+
+    @property
+    def complete(self):
+        return self.n >= self.points * self.sweeps
+
+    @property
+    def sweeps_done(self):
+        return self.n // self.points
+
+    def add(self, readings, source=None):
+        """Add the next readings (and optionally their source values)."""
+        readings = np.asarray(readings, dtype=float)
+        readings = readings[:self.points * self.sweeps - self.n]
+        start = 0
+        while start < len(readings):
+            (sweep, point) = divmod(self.n, self.points)
+            stop = start + min(len(readings) - start, self.points - point)
+            chunk = readings[start:stop]
+            where = slice(point, point + len(chunk))
+            self.readings[sweep, where] = chunk
+            if source is not None and not sweep:
+                self.source[where] = source[start:stop]
+            self.count[where] += 1
+            delta = chunk - self.mean[where]
+            self.mean[where] += delta / self.count[where]
+            self.m2[where] += delta * (chunk - self.mean[where])
+            self.n += len(chunk)
+            start = stop
+
+    @property
+    def std(self):
+        """Sample standard deviation per point (NaN with fewer than two
+        sweeps)."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 1,
+                            np.sqrt(self.m2 / (self.count - 1)), np.nan)
+
+    def format_averages(self):
+        """Tab-separated rows of source, mean, standard deviation and the
+        number of sweeps averaged, one bias point per line."""
+        rows = np.column_stack((self.source, self.mean, self.std,
+                                self.count))
+        return ('\n' + '\n'.join('%+.6E\t%+.6E\t%+.6E\t%d' % tuple(row)
+                                 for row in rows.tolist()) + '\n')
+
+
+class RunningStats(object):
+    """Running mean, variance and linear drift of a reading stream.
+
+    Chunks are merged with the parallel form of Welford's algorithm, and the
+    drift (slope of reading vs. time) comes from the running co-moment of
+    reading and timestamp."""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.t_mean = 0.0
+        self.t_m2 = 0.0
+        self.co_moment = 0.0
+
+    def add(self, readings, times):
+        readings = np.asarray(readings, dtype=float)
+        times = np.asarray(times, dtype=float)
+        n_b = len(readings)
+        if not n_b:
+            return
+        (mean_b, t_mean_b) = (readings.mean(), times.mean())
+        m2_b = np.sum((readings - mean_b) ** 2)
+        t_m2_b = np.sum((times - t_mean_b) ** 2)
+        co_b = np.sum((readings - mean_b) * (times - t_mean_b))
+        n = self.n + n_b
+        (delta, t_delta) = (mean_b - self.mean, t_mean_b - self.t_mean)
+        weight = self.n * n_b / n
+        self.m2 += m2_b + delta ** 2 * weight
+        self.t_m2 += t_m2_b + t_delta ** 2 * weight
+        self.co_moment += co_b + delta * t_delta * weight
+        self.mean += delta * n_b / n
+        self.t_mean += t_delta * n_b / n
+        self.n = n
+
+    @property
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else np.nan
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    @property
+    def std_error(self):
+        """Standard error of the mean."""
+        return self.std / np.sqrt(self.n) if self.n > 1 else np.nan
+
+    @property
+    def drift(self):
+        """Least-squares slope of reading vs. timestamp (units/s)."""
+        return self.co_moment / self.t_m2 if self.t_m2 else np.nan
+
+
+class AllanDeviation(object):
+    """Overlapping Allan deviation at octave averaging factors 1, 2, 4, ...
+
+    Readings are integrated into a running phase, and for every averaging
+    factor m the sum of squared second differences of the phase is updated
+    with each new reading. Only the last 2*max_factor phase values are kept,
+    so the memory and the work per reading do not grow with the run
+    length."""
+
+    def __init__(self, max_octave=16):
+        self.factors = 2 ** np.arange(max_octave + 1)
+        self.sums = np.zeros(len(self.factors))
+        self.terms = np.zeros(len(self.factors), dtype=int)
+        self.phase = np.zeros(1)
+        self.keep = 2 * int(self.factors[-1]) + 1
+        self.offset = None
+        self.n = 0
+
+    def add(self, readings):
+        readings = np.asarray(readings, dtype=float)
+        if not len(readings):
+            return
+        if self.offset is None:
+            # The deviation does not depend on a constant offset, and
+            # removing it keeps the phase small enough for the differences
+            # to stay precise in long runs.
+            self.offset = readings[0]
+        new = len(readings)
+        phase = np.concatenate((self.phase, self.phase[-1]
+                                + np.cumsum(readings - self.offset)))
+        for (i, m) in enumerate(self.factors):
+            # Second differences ending in the new phase values
+            first = max(len(phase) - new, 2 * m)
+            if first >= len(phase):
+                break
+            end = np.arange(first, len(phase))
+            diff = phase[end] - 2 * phase[end - m] + phase[end - 2 * m]
+            self.sums[i] += np.dot(diff, diff)
+            self.terms[i] += len(diff)
+        self.n += new
+        self.phase = phase[-self.keep:]
+
+    def deviations(self, tau0=1.0, min_terms=1):
+        """Return (taus, deviations) for every factor with at least
+        min_terms terms. tau0 is the time between readings."""
+        use = self.terms >= max(min_terms, 1)
+        m = self.factors[use]
+        return (m * tau0,
+                np.sqrt(self.sums[use] / (2.0 * m ** 2 * self.terms[use])))
+
+
+class NoiseMonitor(object):
+    """Running statistics and Allan deviation for a delta run, with a check
+    against a target noise floor."""
+
+    def __init__(self, target=None, min_terms=8):
+        self.target = target
+        self.min_terms = min_terms
+        self.stats = RunningStats()
+        self.allan = AllanDeviation()
+        self.first_time = None
+        self.last_time = None
+
+    def add(self, readings, times):
+        times = np.asarray(times, dtype=float)
+        if len(times):
+            self.first_time = (times[0] if self.first_time is None
+                               else self.first_time)
+            self.last_time = times[-1]
+        self.stats.add(readings, times)
+        self.allan.add(readings)
+
+    @property
+    def tau0(self):
+        """Mean time between readings."""
+        if self.stats.n < 2:
+            return 1.0
+        return (self.last_time - self.first_time) / (self.stats.n - 1)
+
+    def noise_floor(self):
+        """Lowest Allan deviation with enough terms, and its tau."""
+        (taus, devs) = self.allan.deviations(self.tau0, self.min_terms)
+        if not len(devs):
+            return (np.nan, np.nan)
+        i = int(np.argmin(devs))
+        return (devs[i], taus[i])
+
+    def target_reached(self):
+        return bool(self.target) and self.noise_floor()[0] <= self.target
+
+    def summary(self):
+        (floor, tau) = self.noise_floor()
+        return ("N = %d   Mean = %.6e   Std. Dev. = %.3e   "
+                "Drift = %.3e /s   Allan floor = %.3e at %.3g s"
+                % (self.stats.n, self.stats.mean, self.stats.std,
+                   self.stats.drift, floor, tau))
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+This module holds the trace buffer manager of the dI/dV program--the state
+of the 6221 buffer from one run to the next, with every change of state
+confirmed on the instrument.
+
+States and the calls that move between them:
+    UNKNOWN, DONE, any  --clear()-->   EMPTY    abort, clear, count is 0
+    EMPTY               --arm(n)-->    ARMED    mode armed for n readings
+    ARMED               --start()-->   FILLING  INIT:IMM
+    FILLING             --poll()-->    FULL     count reached n
+    FILLING, FULL       --finish()-->  DONE     abort; readings stay
+    any                 --resume(n)--> FILLING  take over a run in progress
+
+A run used to rely on TRAC:CLE having worked. The 6221 ignores it while a
+sweep is armed, so the count of the last run stayed in the buffer and the
+wait loop of the next run read stale readings. clear() aborts first, then
+checks the count with one query. If the buffer is not empty, it reads the
+error queue (so the errors of the failed clear are reported, not lost) and
+tries again before giving up, so a run that was left armed (by a crash or a
+stop at the wrong moment) does not need a restart.
+poll() costs one query. It stops trusting the buffer if the count goes
+backwards or past the size, which means something else cleared or refilled
+it.
+
+Usage:
+    trace = Keithley_dIdV_trace.TraceBuffer(source, error_monitor.drain)
+    trace.clear()
+    # arm the mode for points readings
+    trace.arm(points)
+    trace.start()
+    while trace.state != Keithley_dIdV_trace.FULL:
+        count = trace.poll()
+    raw = trace.fetch(0, count)
+    trace.finish()
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import Keithley_dIdV_errors
+
+__author__ = "Sarah Friedensen"
+__credits__ = "Sarah Friedensen"
+__license__ = "GPL3+"
+__version__ = "1.0"
+__maintainer__ = "Sarah Friedensen"
+__email__ = "safrie@sas.upenn.edu"
+__status__ = "Development"
+
+(UNKNOWN, EMPTY, ARMED, FILLING, FULL, DONE) = (
+        "unknown", "empty", "armed", "filling", "full", "done")
+CLEAR_TRIES = 3
+
+
+class TraceError(Exception):
+    """The buffer is not in the state it should be in."""
+
+
+class TraceBuffer(object):
+    """The trace buffer of a 6221 session (anything with write and query).
+    count is the last count read, expected the readings of the run.
+    drain, if given, reads the error queue and returns its errors (as
+    Keithley_dIdV_errors.ErrorMonitor.drain does); errors holds those read
+    by the last clear()."""
+
+    def __init__(self, source, drain=None):
+        self.source = source
+        self.drain = drain
+        self.state = UNKNOWN
+        self.count = None
+        self.expected = 0
+        self.errors = []
+
+    def read_count(self):
+        self.count = int(self.source.query("TRAC:POIN:ACT?"))
+        return self.count
+
+    def clear(self):
+        """Abort whatever is armed and empty the buffer. Raises TraceError
+        if it will not empty."""
+        self.errors = []
+        for attempt in range(CLEAR_TRIES):
+            self.source.write("SOUR:SWE:ABOR; :TRAC:CLE")
+            if not self.read_count():
+                self.state = EMPTY
+                self.expected = 0
+                return
+            if self.drain:
+                # Why the clear failed, if the 6221 says
+                self.errors += self.drain()
+        self.state = UNKNOWN
+        raise TraceError("The 6221 buffer still holds %d readings after %d "
+                         "clears" % (self.count, CLEAR_TRIES)
+                         + "".join("; " + Keithley_dIdV_errors.format_error(x)
+                                   for x in self.errors))
+
+    def arm(self, points):
+        """Record that a mode was armed to store points readings."""
+        if self.state != EMPTY:
+            raise TraceError("Armed with the buffer " + self.state
+                             + "; clear it first")
+        self.expected = int(points)
+        self.state = ARMED
+
+    def start(self):
+        self.source.write("INIT:IMM")
+        self.state = FILLING
+
+    def resume(self, points):
+        """Take over a buffer already filling with a run of points readings
+        (after a restart)."""
+        self.expected = int(points)
+        self.count = 0
+        self.state = FILLING
+
+    def poll(self):
+        """Read the count during a run. Raises TraceError if the count has
+        gone backwards or past the size of the run."""
+        last = self.count or 0
+        count = self.read_count()
+        if count < last or count > self.expected:
+            self.state = UNKNOWN
+            raise TraceError("The 6221 buffer count went from %d to %d in a "
+                             "run of %d readings" % (last, count,
+                                                     self.expected))
+        if count == self.expected:
+            self.state = FULL
+        return count
+
+    def fetch(self, start, count):
+        """The raw TRAC:DATA:SEL? answer for count readings from start."""
+        return self.source.query("TRAC:DATA:SEL? " + str(start) + ", "
+                                 + str(count))
+
+    def finish(self):
+        """Stop the run. The readings stay until the next clear()."""
+        self.source.write("SOUR:SWE:ABOR")
+        self.state = DONE
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+"""
+This module holds the transcript recorder and replay transport--a record of
+every command, answer and call time on the bus, and a transport that plays
+such a record back to the program with no instruments attached.
+
+A recording wraps whatever transport is in use, so a session on the real
+stack can be kept and replayed later (to chase a slowdown away from the lab,
+or as a benchmark fixture for the parse and save path). Transcripts are gzip
+compressed JSON lines: a header, then one entry per call as
+    [time, resource, kind, message, answer, duration]
+with times in seconds from the start of the recording and binary answers
+base64 encoded.
+
+Replay answers each call with the next recorded entry for the same resource
+and message, so the program sees the same answers in the same order. Calls
+that happen at different times in different runs (the background error
+monitor, idle checks) are matched with the first unused entry that fits, and
+once those run out the last answer is repeated. By default answers come back
+at once; pass speed=1 to take as long as the recorded calls did, or speed=10
+for ten times faster.
+
+Usage:
+    KEITHLEY_RECORD=run.jsonl.gz python Keithley_dIdV_logic4.py
+    KEITHLEY_TRANSPORT=replay KEITHLEY_TRANSCRIPT=run.jsonl.gz \\
+        KEITHLEY_REPLAY_SPEED=1 python Keithley_dIdV_logic4.py
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import gzip
+import json
+import time
+import base64
+import atexit
+import threading
+from collections import defaultdict
+
+__author__ = "Sarah Friedensen"
+__credits__ = "Sarah Friedensen"
+__license__ = "GPL3+"
+__version__ = "1.0"
+__maintainer__ = "Sarah Friedensen"
+__email__ = "safrie@sas.upenn.edu"
+__status__ = "Development"
+
+TRANSCRIPT_VERSION = 1
+TRANSPORT = ""  # resource name of entries for the transport itself
+
+
+class TranscriptMismatch(IOError):
+    """The program made a call the transcript has no entry for."""
+
+
+def _encode(answer):
+    if isinstance(answer, bytes):
+        return {"b64": base64.b64encode(answer).decode('ascii')}
+    return answer
+
+
+def _decode(answer):
+    if isinstance(answer, dict):
+        return base64.b64decode(answer["b64"])
+    return answer
+
+
+def load_transcript(path):
+    """Return (header, entries) from a transcript file."""
+    with gzip.open(path, 'rt') as transcript:
+        header = json.loads(transcript.readline())
+        if header.get("version") != TRANSCRIPT_VERSION:
+            raise ValueError(path + " is not a version "
+                             + str(TRANSCRIPT_VERSION) + " transcript")
+        return (header, [json.loads(x) for x in transcript if x.strip()])
+
+
+#%% Recording
+class TranscriptSession(object):
+    """Session wrapper that records each call to its transcript."""
+
+    def __init__(self, session, name, recorder):
+        self.session = session
+        self.resource_name = name
+        self.recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def _call(self, kind, func, message=None):
+        start = time.perf_counter()
+        answer = func(message) if message is not None else func()
+        self.recorder.record(self.resource_name, kind, message, answer,
+                             start)
+        return answer
+
+    def write(self, message):
+        return self._call("write", self.session.write, message)
+
+    def query(self, message):
+        return self._call("query", self.session.query, message)
+
+    def read(self):
+        return self._call("read", self.session.read)
+
+    def read_raw(self, length=None):
+        return self._call("read_raw", self.session.read_raw, length)
+
+    def clear(self):
+        return self._call("clear", self.session.clear)
+
+    def close(self):
+        self.session.close()
+
+
+class RecordingTransport(object):
+    """Transport wrapper that records everything done through it to a
+    transcript at path. The file is complete once close() has been called
+    (which also happens at exit)."""
+
+    def __init__(self, transport, path):
+        self.transport = transport
+        self.path = path
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.file = gzip.open(path, 'wt')
+        self.file.write(json.dumps({
+                "version": TRANSCRIPT_VERSION,
+                "transport": type(transport).__name__,
+                "recorded": time.strftime("%Y-%m-%d %H:%M:%S")}) + '\n')
+        atexit.register(self.close)
+
+    def record(self, resource, kind, message, answer, start):
+        duration = time.perf_counter() - start
+        entry = [round(start - self.started, 6), resource, kind, message,
+                 _encode(answer), round(duration, 6)]
+        with self.lock:
+            if self.file:
+                self.file.write(json.dumps(entry) + '\n')
+
+    def list_resources(self):
+        start = time.perf_counter()
+        resources = tuple(self.transport.list_resources())
+        self.record(TRANSPORT, "list", None, list(resources), start)
+        return resources
+
+    def find(self, resources, address):
+        start = time.perf_counter()
+        found = self.transport.find(resources, address)
+        self.record(TRANSPORT, "find", str(address), list(found), start)
+        return found
+
+    def open_resource(self, resource_name):
+        start = time.perf_counter()
+        session = self.transport.open_resource(resource_name)
+        self.record(TRANSPORT, "open", resource_name, None, start)
+        return TranscriptSession(session, resource_name, self)
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+        if hasattr(self.transport, "close"):
+            self.transport.close()
+
+
+#%% Replay
+class ReplaySession(object):
+    """Plays back the recorded calls for one resource."""
+
+    def __init__(self, name, player):
+        self.resource_name = name
+        self.player = player
+        self.timeout = 2000
+
+    def write(self, message):
+        self.player.play(self.resource_name, "write", message)
+        return len(message)
+
+    def query(self, message):
+        return self.player.play(self.resource_name, "query", message)
+
+    def read(self):
+        return self.player.play(self.resource_name, "read")
+
+    def read_raw(self, length=None):
+        return self.player.play(self.resource_name, "read_raw", length)
+
+    def clear(self):
+        self.player.play(self.resource_name, "clear")
+
+    def close(self):
+        pass
+
+
+class ReplayTransport(object):
+    """Transport that answers from a transcript instead of the bus.
+
+    speed None answers at once; otherwise each call takes its recorded
+    duration divided by speed."""
+
+    def __init__(self, path, speed=None):
+        (self.header, entries) = load_transcript(path)
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.pending = defaultdict(list)
+        self.last = {}
+        for entry in entries:
+            self.pending[(entry[1], entry[2], entry[3])].append(entry)
+        # Discovery may list the bus or not depending on the cache.
+        self.last[(TRANSPORT, "list", None)] = [
+                0, TRANSPORT, "list", None,
+                sorted(set(x[1] for x in entries) - {TRANSPORT}), 0]
+        self.played = 0
+        self.total = len(entries)
+
+    def play(self, resource, kind, message=None):
+        """Answer a call with the first unused matching entry, or the last
+        one used if they have all been played."""
+        key = (resource, kind, message)
+        with self.lock:
+            entries = self.pending.get(key)
+            if entries:
+                entry = self.last[key] = entries.pop(0)
+                self.played += 1
+            elif key in self.last:
+                entry = self.last[key]
+            else:
+                raise TranscriptMismatch(
+                        "No recorded " + kind + " " + str(message or '')
+                        + " for " + (resource or "the transport"))
+        if self.speed:
+            time.sleep(entry[5] / self.speed)
+        return _decode(entry[4])
+
+    @property
+    def remaining(self):
+        return self.total - self.played
+
+    def list_resources(self):
+        return tuple(self.play(TRANSPORT, "list"))
+
+    def find(self, resources, address):
+        try:
+            found = self.play(TRANSPORT, "find", str(address))
+        except TranscriptMismatch:
+            return []
+        return [x for x in found if x in resources]
+
+    def open_resource(self, resource_name):
+        try:
+            self.play(TRANSPORT, "open", resource_name)
+        except TranscriptMismatch:
+            if resource_name not in self.last[(TRANSPORT, "list", None)][4]:
+                raise
+        return ReplaySession(resource_name, self)
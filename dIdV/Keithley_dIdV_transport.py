@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+"""
+This module holds the transports the program can talk to the instruments
+over--VISA over GPIB, VISA over LAN (VXI-11), a raw socket to the 6221's
+Ethernet port (port 1394), and the in-process simulated stack.
+
+Every transport looks like a VISA resource manager: list_resources() gives
+the resources it can reach, find() picks out the 6221, and open_resource()
+returns an object with write/read/read_raw/query/clear/close. The measurement
+code only uses those calls, so it runs the same way over any of them.
+
+The transport is chosen with the environment variables
+    KEITHLEY_TRANSPORT  gpib (default), tcpip, socket, fake or replay
+    KEITHLEY_HOST       host name or IP address of the 6221 for tcpip/socket
+    KEITHLEY_TRANSCRIPT transcript to play back with replay
+    KEITHLEY_REPLAY_SPEED  replay at this multiple of the recorded speed
+                        (default: no delays)
+    KEITHLEY_RECORD     record a transcript of the session to this file
+(see Keithley_dIdV_transcript).
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import os
+import time
+import select
+import socket
+import threading
+import importlib
+from collections import deque
+import Keithley_dIdV_fake
+import Keithley_dIdV_transcript
+
+__author__ = "Sarah Friedensen"
+__credits__ = "Sarah Friedensen"
+__license__ = "GPL3+"
+__version__ = "1.0"
+__maintainer__ = "Sarah Friedensen"
+__email__ = "safrie@sas.upenn.edu"
+__status__ = "Development"
+
+SOCKET_PORT = 1394
+CHUNK_SIZE = 65536
+CHECK_INTERVAL = 30.0  # s a session can sit idle before it is checked
+LOG_SIZE = 256  # transactions kept per session
+FAKE_VOLTMETER = "GPIB0::7::INSTR"  # the 2182a of the fake stack
+
+# PyVISA, imported on first use by load_visa(). Importing it is slow, and the
+# socket and fake transports do not need it. Set this to stand in another
+# module.
+visa = None
+
+
+def load_visa():
+    global visa
+    if visa is None:
+        visa = importlib.import_module("visa")
+    return visa
+
+
+class SocketInstrument(object):
+    """VISA-like resource over a raw TCP socket.
+
+    Messages are terminated with a newline. read_raw() understands
+    IEEE-488.2 binary blocks, so REAL,32 buffer reads work like ASCII ones.
+    The 6221 and 2182a send indefinite (#0) blocks, which have no length
+    and may hold newline bytes; pass read_raw() the length of the data to
+    end one exactly."""
+
+    def __init__(self, host, port=SOCKET_PORT, timeout=2000):
+        self.resource_name = ("TCPIP0::" + host + "::" + str(port)
+                              + "::SOCKET")
+        self.timeout = timeout
+        self.sock = socket.create_connection((host, port), timeout / 1000)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.pending = b''
+
+    def write(self, message):
+        data = (message + '\n').encode('ascii')
+        self.sock.sendall(data)
+        return len(data)
+
+    def _receive(self):
+        chunk = self.sock.recv(CHUNK_SIZE)
+        if not chunk:
+            raise IOError("Connection to " + self.resource_name + " closed")
+        self.pending += chunk
+
+    def _waiting(self):
+        return bool(select.select([self.sock], [], [], 0)[0])
+
+    def _take(self, length):
+        (data, self.pending) = (self.pending[:length], self.pending[length:])
+        return data
+
+    def read_raw(self, length=None):
+        """Read one response. length is the number of data bytes of an
+        indefinite block, if the caller knows it."""
+        while not self.pending:
+            self._receive()
+        if self.pending[:1] == b'#':
+            while len(self.pending) < 2:
+                self._receive()
+            digits = int(self.pending[1:2])
+            if digits:
+                while len(self.pending) < 2 + digits:
+                    self._receive()
+                length = int(self.pending[2:2 + digits])
+            if digits or length is not None:
+                end = 2 + digits + length
+                while len(self.pending) < end + 1:
+                    self._receive()
+                return self._take(end + 1)
+            # Indefinite block of unknown length: a newline byte can be part
+            # of the data, so only stop at one that ends a whole number of
+            # 4-byte values with nothing more on the way. This can still
+            # stop early if the rest is slow to arrive.
+            while True:
+                end = self.pending.find(b'\n', 2)
+                while end >= 0 and ((end - 2) % 4 or self._waiting()):
+                    end = self.pending.find(b'\n', end + 1)
+                if end >= 0:
+                    return self._take(end + 1)
+                self._receive()
+        while b'\n' not in self.pending:
+            self._receive()
+        return self._take(self.pending.index(b'\n') + 1)
+
+    def read(self):
+        return self.read_raw().decode('ascii')
+
+    def query(self, message):
+        self.write(message)
+        return self.read()
+
+    def clear(self):
+        self.pending = b''
+        self.write("\x03")  # Device clear over the raw socket
+
+    def close(self):
+        self.sock.close()
+
+
+class VisaTransport(object):
+    """VISA resource manager restricted to one interface type (GPIB or
+    TCPIP)."""
+
+    def __init__(self, interface="GPIB", host=None):
+        self.interface = interface
+        self.host = host
+        self.rm = load_visa().ResourceManager()
+
+    def list_resources(self):
+        resources = tuple(x for x in self.rm.list_resources()
+                          if x.startswith(self.interface))
+        if self.host and self.interface == "TCPIP":
+            name = "TCPIP0::" + self.host + "::INSTR"
+            resources = resources if name in resources else resources + (name,)
+        return resources
+
+    def find(self, resources, address):
+        """Resources for the 6221: the one at the GPIB address, or the one
+        at the configured host over LAN."""
+        resources = [x for x in resources if x.startswith(self.interface)]
+        if self.interface == "GPIB":
+            return [x for x in resources
+                    if x.split('::')[1] == str(address)]
+        return [x for x in resources if not self.host or self.host in x]
+
+    def open_resource(self, resource_name):
+        return self.rm.open_resource(resource_name)
+
+    def close(self):
+        """Close the VISA resource manager and every session it opened."""
+        self.rm.close()
+
+
+class SocketTransport(object):
+    """Raw socket connection to the 6221's Ethernet port."""
+
+    def __init__(self, host, port=SOCKET_PORT):
+        if not host:
+            raise ValueError("The socket transport needs KEITHLEY_HOST")
+        self.host = host
+        self.port = port
+
+    def list_resources(self):
+        return ("TCPIP0::" + self.host + "::" + str(self.port) + "::SOCKET",)
+
+    def find(self, resources, address):
+        return [x for x in resources if x in self.list_resources()]
+
+    def open_resource(self, resource_name):
+        host, port = resource_name.split('::')[1:3]
+        return SocketInstrument(host, int(port))
+
+
+class FakeTransport(Keithley_dIdV_fake.FakeResourceManager):
+    """The simulated stack from Keithley_dIdV_fake, in process."""
+
+    def find(self, resources, address):
+        return [x for x in resources
+                if 'GPIB' in x and x.split('::')[1] == str(address)]
+
+
+class LoggedSession(object):
+    """Session wrapper that logs every transaction and serializes access.
+
+    Everything the program sends goes through write/query/read here, so a
+    background task (the error monitor) can hold lock for a few queries of
+    its own without splitting a query from its answer. awaiting is True
+    between a write of a query and the read of its answer. Anything else is
+    passed through to the wrapped session."""
+
+    def __init__(self, session, log_size=LOG_SIZE):
+        self.session = session
+        self.lock = threading.RLock()
+        self.log = deque(maxlen=log_size)
+        self.sequence = 0
+        self.last_activity = time.time()
+        self.awaiting = False
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def _record(self, kind, message):
+        self.sequence += 1
+        self.log.append((self.sequence, time.time(), kind, message))
+        self.last_activity = time.time()
+
+    @property
+    def idle(self):
+        """Seconds since the last transaction."""
+        return time.time() - self.last_activity
+
+    def since(self, sequence, kind="write"):
+        """Messages of the given kind logged after sequence."""
+        return [x[3] for x in list(self.log) if x[0] > sequence
+                and x[2] == kind]
+
+    def write(self, message):
+        with self.lock:
+            self._record("write", message)
+            self.awaiting = '?' in message
+            return self.session.write(message)
+
+    def query(self, message):
+        with self.lock:
+            self._record("query", message)
+            return self.session.query(message)
+
+    def read(self):
+        with self.lock:
+            self.awaiting = False
+            return self.session.read()
+
+    def read_raw(self, length=None):
+        """Read one response. length (data bytes of an indefinite block) is
+        passed on if given; a VISA resource takes it as the chunk size and
+        still reads to the end of the message."""
+        with self.lock:
+            self.awaiting = False
+            if length is None:
+                return self.session.read_raw()
+            return self.session.read_raw(length)
+
+    def close(self):
+        with self.lock:
+            self.session.close()
+
+
+class SessionPool(object):
+    """Keep one open session per resource name on top of a transport.
+
+    The pool is used in place of the transport: open_resource() hands back
+    the session that is already open for that resource instead of opening
+    a new one. A session that has been idle for longer than check_interval
+    is checked with *OPC? first and reopened if it does not answer; discard()
+    drops a session that failed in use so the next open_resource() reopens
+    it. close() closes everything. Sessions are handed out wrapped in
+    LoggedSession."""
+
+    def __init__(self, transport, check_interval=CHECK_INTERVAL):
+        self.transport = transport
+        self.check_interval = check_interval
+        self.sessions = {}
+        self.last_used = {}
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    def list_resources(self):
+        return self.transport.list_resources()
+
+    def find(self, resources, address):
+        return self.transport.find(resources, address)
+
+    def healthy(self, session):
+        try:
+            return '1' in session.query("*OPC?")
+        except Exception:
+            return False
+
+    def open_resource(self, resource_name):
+        with self.lock:
+            session = self.sessions.get(resource_name)
+            idle = time.time() - self.last_used.get(resource_name, 0)
+            if session is not None and idle > self.check_interval:
+                if not self.healthy(session):
+                    self._close(resource_name)
+                    session = None
+            if session is None:
+                session = LoggedSession(
+                        self.transport.open_resource(resource_name))
+                self.sessions[resource_name] = session
+                self.opened += 1
+            self.last_used[resource_name] = time.time()
+            return session
+
+    def discard(self, resource_name):
+        with self.lock:
+            self._close(resource_name)
+
+    def _close(self, resource_name):
+        session = self.sessions.pop(resource_name, None)
+        self.last_used.pop(resource_name, None)
+        if session is not None:
+            try:
+                session.close()
+            except Exception:
+                pass
+
+    def close(self):
+        with self.lock:
+            for name in list(self.sessions):
+                self._close(name)
+        if hasattr(self.transport, "close"):
+            self.transport.close()
+
+
+TRANSPORTS = {
+        "gpib": lambda host: VisaTransport("GPIB"),
+        "tcpip": lambda host: VisaTransport("TCPIP", host),
+        "socket": lambda host: SocketTransport(host),
+        "fake": lambda host: FakeTransport(voltmeters=(FAKE_VOLTMETER,)),
+        "replay": lambda host: Keithley_dIdV_transcript.ReplayTransport(
+                os.environ["KEITHLEY_TRANSCRIPT"],
+                float(os.environ.get("KEITHLEY_REPLAY_SPEED", 0)) or None)
+        }
+
+
+def open_transport(name=None, host=None):
+    """Return the transport with the given name (see TRANSPORTS), by default
+    the one set in KEITHLEY_TRANSPORT and KEITHLEY_HOST, recording to the
+    transcript in KEITHLEY_RECORD if that is set."""
+    name = (name or os.environ.get("KEITHLEY_TRANSPORT", "gpib")).lower()
+    host = host or os.environ.get("KEITHLEY_HOST")
+    if name not in TRANSPORTS:
+        raise ValueError("Unknown transport " + name + "; choose from "
+                         + ', '.join(sorted(TRANSPORTS)))
+    transport = TRANSPORTS[name](host)
+    if os.environ.get("KEITHLEY_RECORD"):
+        transport = Keithley_dIdV_transcript.RecordingTransport(
+                transport, os.environ["KEITHLEY_RECORD"])
+    return transport
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+"""
+This module holds the rate and filter tuner for the dI/dV program--short
+delta bursts at a few 2182a rates (NPLC) that measure the noise per point and
+the time per point of each rate and 6221 repeating filter count, and pick the
+fastest setting that meets a noise target.
+
+One burst is taken per rate with the 6221 filter off. The repeating filter
+counts are then tried on the raw readings with
+Keithley_dIdV_filters.repeating_average, which gives the readings the
+instrument filter would have returned without a burst for every count. The
+noise per point is the Allan deviation at one point (the scatter between
+neighbouring points, insensitive to slow drift), and the time per point is
+the median spacing of the timestamps times the filter count.
+
+Results are cached in ~/.keithley_dIdV_tuning.json (or wherever
+KEITHLEY_TUNING_CACHE points) by voltmeter range, bias currents and sample
+resistance. The resistance comes from the first burst, so tuning a sample
+again on the same range only costs that burst.
+
+Usage:
+    tuner = Keithley_dIdV_tuning.Tuner(source, voltmeter)
+    tuning = tuner.tune(high, low, delay, target, volt_range)
+    (tuning.best.nplc, tuning.best.count)
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import os
+import json
+import time
+from collections import namedtuple
+import numpy as np
+import Keithley_dIdV_buffer
+import Keithley_dIdV_filters
+import Keithley_dIdV_stats
+import Keithley_dIdV_trace
+from Keithley_dIdV_commands import COMMANDS
+from Keithley_dIdV_autorange import RelayedVoltmeter
+
+__author__ = "Sarah Friedensen"
+__credits__ = "Sarah Friedensen"
+__license__ = "GPL3+"
+__version__ = "1.0"
+__maintainer__ = "Sarah Friedensen"
+__email__ = "safrie@sas.upenn.edu"
+__status__ = "Development"
+
+CACHE_FILE = os.environ.get(
+        "KEITHLEY_TUNING_CACHE",
+        os.path.join(os.path.expanduser("~"), ".keithley_dIdV_tuning.json"))
+RATES = (1, 2, 5, 10)  # NPLC, fastest first (whole PLC, as in the UI)
+COUNTS = (1, 2, 5, 10)  # repeating filter counts; 1 is the filter off
+BURST_POINTS = 100
+MIN_GROUPS = 8  # filtered points needed to judge a count
+POLL_INTERVAL = 0.5  # s between buffer checks during a burst
+BURST_TIMEOUT = 120.0  # s
+
+Setting = namedtuple("Setting", ("nplc", "count", "noise", "period"))
+
+
+def load_cache():
+    try:
+        with open(CACHE_FILE) as cachefile:
+            return json.load(cachefile)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache):
+    try:
+        with open(CACHE_FILE, 'w') as cachefile:
+            json.dump(cache, cachefile, indent=2)
+    except OSError:
+        pass
+
+
+def cache_key(volt_range, high, low, resistance):
+    """Key for a sample on a range: the bias currents and the resistance
+    to a quarter of a decade."""
+    decade = (round(4 * np.log10(abs(resistance))) / 4 if resistance
+              else None)
+    return ("range %d, high %g A, low %g A, R 1e%s ohm"
+            % (volt_range, high, low, decade))
+
+
+def evaluate(readings, times, nplc, counts=COUNTS):
+    """The Setting for each filter count that leaves MIN_GROUPS points from
+    one burst at nplc."""
+    readings = np.asarray(readings, dtype=float)
+    period = float(np.median(np.diff(times))) if len(times) > 1 else np.nan
+    settings = []
+    for count in counts:
+        filtered = (readings if count == 1 else
+                    Keithley_dIdV_filters.repeating_average(readings, count))
+        if len(filtered) < MIN_GROUPS:
+            continue
+        allan = Keithley_dIdV_stats.AllanDeviation(0)
+        allan.add(filtered)
+        settings.append(Setting(nplc, count,
+                                float(allan.deviations()[1][0]),
+                                period * count))
+    return settings
+
+
+def recommend(settings, target):
+    """The fastest setting with noise at or under target, or the quietest
+    setting if none is."""
+    meets = [x for x in settings if x.noise <= target]
+    if meets:
+        return min(meets, key=lambda x: x.period)
+    return min(settings, key=lambda x: x.noise)
+
+
+class Tuning(object):
+    """Outcome of a tuning: every setting tried, the recommended one and
+    whether the settings came from the cache."""
+
+    def __init__(self, key, settings, target, cached=False):
+        self.key = key
+        self.settings = sorted(settings, key=lambda x: x.period)
+        self.target = target
+        self.best = recommend(self.settings, target)
+        self.cached = cached
+
+    @property
+    def met(self):
+        return self.best.noise <= self.target
+
+    def format(self, points=None):
+        lines = ["Tuning for " + self.key
+                 + (" (cached)" if self.cached else ""),
+                 "NPLC\tCount\tNoise (V)\tTime/point (s)"]
+        lines += ["%g\t%d\t%.3e\t%.4g" % x for x in self.settings]
+        lines.append(("Fastest under %.3e V: " % self.target if self.met
+                      else "Target %.3e V not reached; quietest: "
+                      % self.target)
+                     + "%g NPLC, filter count %d"
+                     % (self.best.nplc, self.best.count)
+                     + ("" if points is None else
+                        ", %.1f s for %d points"
+                        % (self.best.period * points, points)))
+        return '\n'.join(lines)
+
+
+class Tuner(object):
+    """Runs delta bursts on the 6221 session source. The 2182a rate is set
+    through voltmeter (anything with write, such as
+    Keithley_dIdV_2182a.Voltmeter2182a), or through the 6221 without one.
+    wait(seconds) is called between buffer checks."""
+
+    def __init__(self, source, voltmeter=None, wait=time.sleep):
+        self.source = source
+        self.voltmeter = voltmeter or RelayedVoltmeter(source)
+        self.wait = wait
+
+    def burst(self, nplc, high, low, delay, points=BURST_POINTS):
+        """Take points delta readings at nplc with the filter off. Currents
+        in A, delay in s. Returns (readings, timestamps). Raises
+        Keithley_dIdV_trace.TraceError if the buffer will not clear."""
+        trace = Keithley_dIdV_trace.TraceBuffer(self.source)
+        trace.clear()
+        self.source.write("SENS:AVER OFF")
+        self.voltmeter.write(":SENS:VOLT:NPLC " + str(nplc))
+        self.source.write(COMMANDS["delta"].render(high, low, delay, points,
+                                                   "OFF"))
+        self.source.write(COMMANDS["trace"].render(points))
+        self.source.write("FORM:ELEM " + Keithley_dIdV_buffer.ELEMENT_STRING)
+        self.source.write("SOUR:DELT:ARM")
+        trace.arm(points)
+        trace.start()
+        start = time.time()
+        try:
+            while (trace.poll() < points
+                   and time.time() - start < BURST_TIMEOUT):
+                self.wait(POLL_INTERVAL)
+            values = Keithley_dIdV_buffer.decode_fields(
+                    Keithley_dIdV_buffer.split_ascii(
+                            trace.fetch(0, trace.count)))
+        finally:
+            trace.finish()
+        columns = Keithley_dIdV_buffer.COLUMNS
+        return (values[:, columns["READ"]], values[:, columns["TST"]])
+
+    def tune(self, high, low, delay, target, volt_range, rates=RATES,
+             counts=COUNTS):
+        """Find the fastest rate and filter count with noise per point at or
+        under target (V). Currents in A, delay in s, volt_range the index of
+        the 2182a range. Returns a Tuning."""
+        (readings, times) = self.burst(rates[0], high, low, delay)
+        span = high - low
+        resistance = 2 * float(np.mean(readings)) / span if span else 0.0
+        key = cache_key(volt_range, high, low, resistance)
+        cache = load_cache()
+        if key in cache:
+            return Tuning(key, [Setting(*x) for x in cache[key]], target,
+                          True)
+        settings = evaluate(readings, times, rates[0], counts)
+        for nplc in rates[1:]:
+            settings += evaluate(*self.burst(nplc, high, low, delay),
+                                 nplc=nplc, counts=counts)
+        cache[key] = [list(x) for x in settings]
+        save_cache(cache)
+        return Tuning(key, settings, target)
@@ -0,0 +1,28 @@
+"""
+This module holds the setup shared by the tests. The program modules are
+imported from the directory above, the instruments are the simulated stack
+in Keithley_dIdV_fake, and the discovery cache, checkpoint and tuning cache
+are kept in a temporary directory instead of the user's home directory.
+
+Run from the dIdV directory with
+    python -m pytest tests
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import os
+import sys
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Keithley_dIdV_bench
+
+STATE_DIR = tempfile.mkdtemp(prefix="keithley_tests_")
+os.environ.update(Keithley_dIdV_bench.fake_environment(STATE_DIR))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(STATE_DIR, ignore_errors=True)
@@ -0,0 +1,51 @@
+"""
+This module holds the tests of the transfer checks in Keithley_dIdV_buffer,
+on buffers filled by the simulated 6221.
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import pytest
+from Keithley_dIdV_bench import filled_instrument
+from Keithley_dIdV_buffer import (COLUMNS, NUM_ELEMENTS, check_transfer,
+                                  split_ascii)
+
+POINTS = 20
+
+
+@pytest.fixture
+def fields():
+    return split_ascii(filled_instrument(POINTS, "ASC").query("TRAC:DATA?"))
+
+
+def test_clean_transfer(fields):
+    (values, problems) = check_transfer(fields, POINTS)
+    assert problems == []
+    assert values.shape == (POINTS, NUM_ELEMENTS)
+
+
+def test_transfer_continues_previous(fields):
+    (values, _) = check_transfer(fields, POINTS)
+    rest = fields[10 * NUM_ELEMENTS:]
+    assert check_transfer(rest, POINTS - 10, values[9])[1] == []
+    assert "jumps" in check_transfer(rest, POINTS - 10, values[8])[1][0]
+
+
+def test_dropped_reading(fields):
+    del fields[5 * NUM_ELEMENTS:6 * NUM_ELEMENTS]
+    (values, problems) = check_transfer(fields, POINTS)
+    assert problems == ["%d of %d readings" % (POINTS - 1, POINTS),
+                        "reading number jumps from 4 to 6"]
+
+
+def test_timestamp_backwards(fields):
+    fields[3 * NUM_ELEMENTS + COLUMNS["TST"]] = "-1"
+    assert (check_transfer(fields, POINTS)[1]
+            == ["timestamp goes backwards 1 times"])
+
+
+def test_fields_that_do_not_decode(fields):
+    assert check_transfer(fields[:-1], POINTS)[0] is None
+    fields[0] = "garbage"
+    assert check_transfer(fields, POINTS) == (None, ["Fields do not decode"])
@@ -0,0 +1,83 @@
+"""
+This module holds the tests of the run checkpoints in
+Keithley_dIdV_checkpoint: saving and loading, matching a checkpoint to its
+config, finding the saved readings and checking the 6221 buffer still holds
+the run.
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import pytest
+import Keithley_dIdV_checkpoint
+from Keithley_dIdV_bench import filled_instrument
+from Keithley_dIdV_buffer import COLUMNS, decode_ascii
+from Keithley_dIdV_config import DeltaConfig
+from Keithley_dIdV_checkpoint import Checkpoint, config_hash
+
+CONFIG = DeltaConfig(10.0, 0.0, 100, 2.0, "1", 0.0, "10.0", "OFF",
+                     "SENS:AVER OFF; ", 1)
+
+
+def checkpoint(**values):
+    fields = dict(path="run.txt", tab=1, mode="Delta",
+                  config_type="DeltaConfig", config_values=list(CONFIG),
+                  config_hash=config_hash(CONFIG), widgets={}, expected=100,
+                  resumed_from=40, buffer_offset=0, buffer_points=20,
+                  offset=0, last_reading=[19.0, 1.9], segment_points=10)
+    fields.update(values)
+    return Checkpoint(**fields)
+
+
+def test_save_load_clear(tmp_path):
+    filename = str(tmp_path / "checkpoint.json")
+    checkpoint().save(filename)
+    loaded = Keithley_dIdV_checkpoint.load(filename)
+    assert (loaded.points, loaded.segments_done) == (60, 6)
+    assert loaded.run_config() == CONFIG
+    assert "Delta run into run.txt stopped after 60" in loaded.summary()
+    Keithley_dIdV_checkpoint.clear(filename)
+    assert Keithley_dIdV_checkpoint.load(filename) is None
+
+
+def test_load_bad_file(tmp_path):
+    filename = tmp_path / "checkpoint.json"
+    filename.write_text("{not json")
+    assert Keithley_dIdV_checkpoint.load(str(filename)) is None
+
+
+@pytest.mark.parametrize("values", [{"config_hash": "0" * 16},
+                                    {"config_type": "NoSuchConfig"},
+                                    {"config_values": [1, 2]}])
+def test_config_mismatch(values):
+    assert checkpoint(**values).run_config() is None
+
+
+def test_config_hash_stable():
+    assert config_hash(CONFIG) == config_hash(CONFIG._replace(count="100"))
+    assert config_hash(CONFIG) != config_hash(CONFIG._replace(count=101))
+
+
+def test_saved_rows(tmp_path):
+    path = tmp_path / "run.txt"
+    lines = ["Measured Delta\n", "\n", "Reading (V)\ttimestamp (s)\n",
+             "+1.0E-03\t+0.0E+00\n", "-2.0E-03\t+1.0E-01\n",
+             "# Resumed\n", "+3.0E-03\t+2.0E-01\n"]
+    path.write_text(''.join(lines))
+    rows = Keithley_dIdV_checkpoint.saved_rows(str(path),
+                                               path.stat().st_size)
+    starts = [sum(len(x) for x in lines[:i]) for i in (3, 4, 6)]
+    assert [x[0] for x in rows] == starts
+    assert rows[1][1] == ["-2.0E-03", "+1.0E-01"]
+    # Only what was saved before the end offset counts
+    assert len(Keithley_dIdV_checkpoint.saved_rows(str(path), starts[2])) == 2
+
+
+def test_buffer_intact():
+    source = filled_instrument(30, "ASC")
+    last = decode_ascii(source.query("TRAC:DATA:SEL? 19, 1"))
+    last_reading = [last[COLUMNS["RNUM"]], last[COLUMNS["TST"]]]
+    assert checkpoint(last_reading=last_reading).buffer_intact(source)
+    assert not checkpoint(last_reading=[19.0, -1.0]).buffer_intact(source)
+    assert not checkpoint(buffer_points=0).buffer_intact(source)
+    assert not checkpoint(buffer_points=31).buffer_intact(source)
@@ -0,0 +1,71 @@
+"""
+This module holds the tests of the command model in Keithley_dIdV_commands:
+parameter ranges and choices, the checks between parameters and rendering.
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import pytest
+from Keithley_dIdV_commands import (COMMANDS, PARAMS, MAX_BUFFER,
+                                    MAX_CURRENT, CommandError, check_buffer,
+                                    check_sweep_pulse, setting_key)
+
+
+def test_param_range():
+    param = PARAMS["SOUR:DELT:HIGH"]
+    assert param.validate("SOUR:DELT:HIGH", "1e-3") == 1E-3
+    # A limit reached through a unit conversion still passes
+    assert param.validate("SOUR:DELT:HIGH", MAX_CURRENT * (1 + 1E-12))
+    with pytest.raises(CommandError, match="SOUR:DELT:HIGH"):
+        param.validate("SOUR:DELT:HIGH", 2 * MAX_CURRENT)
+
+
+def test_param_kind_and_choices():
+    assert PARAMS["SOUR:DELT:COUN"].validate("SOUR:DELT:COUN", "10") == 10
+    with pytest.raises(CommandError, match="must be a number"):
+        PARAMS["SOUR:DELT:COUN"].validate("SOUR:DELT:COUN", "ten")
+    assert PARAMS["SOUR:DELT:CAB"].validate("SOUR:DELT:CAB", "on") == "ON"
+    with pytest.raises(CommandError, match="must be one of"):
+        PARAMS["SOUR:DELT:CAB"].validate("SOUR:DELT:CAB", "MAYBE")
+
+
+@pytest.mark.parametrize("header", ["SOUR:DELT:COUN", "SOUR:PDEL:COUN",
+                                    "TRAC:POIN"])
+def test_counts_fit_the_buffer(header):
+    PARAMS[header].validate(header, MAX_BUFFER)
+    with pytest.raises(CommandError):
+        PARAMS[header].validate(header, MAX_BUFFER + 1)
+
+
+def test_render():
+    assert (COMMANDS["delta"].render(1E-5, 0, 2E-3, 100, "off")
+            == "SOUR:DELT:HIGH 1e-05; LOW 0.0; DEL 0.002; COUN 100; CAB OFF")
+    assert COMMANDS["list_delay"].render(1E-3) == "SOUR:DEL 0.001"
+    with pytest.raises(CommandError, match="takes 5 values"):
+        COMMANDS["delta"].render(1E-5, 0)
+
+
+def test_checks_between_params():
+    with pytest.raises(CommandError, match="the same"):
+        COMMANDS["delta"].render(1E-5, 1E-5, 2E-3, 100, "OFF")
+    with pytest.raises(CommandError, match="Source delay"):
+        COMMANDS["fpd"].render(1E-5, 0, 100E-6, 200E-6, 10, 5, "OFF", "2")
+    with pytest.raises(CommandError, match="cycle"):
+        check_sweep_pulse(5E-3, 4E-3)
+    with pytest.raises(CommandError, match="wrong sign"):
+        COMMANDS["spd_linear"].render(1E-3, 0, 1E-5, -1E-6)
+    with pytest.raises(CommandError):
+        COMMANDS["list_delay"].render(0)
+
+
+def test_check_buffer():
+    check_buffer(MAX_BUFFER)
+    with pytest.raises(CommandError, match="do not fit"):
+        check_buffer(MAX_BUFFER + 1)
+
+
+def test_setting_key():
+    assert setting_key("SOUR:DELT:HIGH 1e-05; LOW 0.0") == "SOUR:DELT:HIGH"
+    assert (setting_key("SYST:COMM:SER:SEND ':SENS:VOLT:RANG 10e-3'")
+            == "SYST:COMM:SER:SEND :SENS:VOLT:RANG")
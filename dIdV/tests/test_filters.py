@@ -0,0 +1,63 @@
+"""
+This module holds the tests of the instrument filter reproductions and the
+spike filters in Keithley_dIdV_filters.
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import numpy as np
+import pytest
+from Keithley_dIdV_filters import (hampel_filter, instrument_filter,
+                                   median_filter, moving_average,
+                                   repeating_average)
+
+
+def naive_moving_average(x, count):
+    """The moving average one reading at a time, the stack starting full of
+    the first reading."""
+    stack = [x[0]] * (count - 1)
+    out = []
+    for value in x:
+        stack = (stack + [value])[-count:]
+        out.append(np.mean(stack))
+    return np.array(out)
+
+
+def test_moving_average():
+    x = np.random.default_rng(0).normal(size=1000)
+    np.testing.assert_allclose(moving_average(x, 10),
+                               naive_moving_average(x, 10))
+
+
+def test_moving_average_window_restart():
+    x = np.concatenate((np.ones(20), 5 * np.ones(20)))
+    out = moving_average(x, 4, window=10, range_value=10.0)
+    # The step is outside the 1.0 window, so the filter restarts on it
+    np.testing.assert_allclose(out[:20], 1.0)
+    np.testing.assert_allclose(out[20:], 5.0)
+
+
+def test_repeating_average():
+    x = np.arange(10, dtype=float)
+    np.testing.assert_allclose(repeating_average(x, 4), [1.5, 5.5])
+    np.testing.assert_allclose(instrument_filter(x, "REPeat", 4),
+                               [1.5, 5.5])
+
+
+def test_repeating_average_window_restart():
+    x = np.array([1, 1, 1, 1, 1, 1, 5, 5, 5, 5, 5, 5], dtype=float)
+    # The group with the step is dropped and the next starts on the step
+    np.testing.assert_allclose(
+            repeating_average(x, 4, window=10, range_value=10.0), [1, 5])
+
+
+def test_median_and_hampel():
+    x = np.linspace(0, 1, 21)
+    x[10] = 100.0
+    assert median_filter(x, 5)[10] < 1
+    (filtered, spikes) = hampel_filter(x, 5)
+    assert np.flatnonzero(spikes).tolist() == [10]
+    assert filtered[10] < 1
+    with pytest.raises(ValueError):
+        median_filter(x, 4)
@@ -0,0 +1,103 @@
+"""
+This module holds the end-to-end tests of the dI/dV program: the window is
+built and runs against the simulated stack in Keithley_dIdV_fake, from
+connecting through to the saved data file. Skipped where the Qt bindings
+the program is written for are not installed.
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import pytest
+import Keithley_dIdV_analysis
+import Keithley_dIdV_checkpoint
+
+logic = pytest.importorskip("Keithley_dIdV_logic4", exc_type=ImportError)
+
+DELTA_TAB = 1
+
+
+class Interrupted(Exception):
+    """Stands in for the program dying in the middle of a run."""
+
+
+@pytest.fixture(scope="module")
+def app():
+    return (logic.QtGui.QApplication.instance()
+            or logic.QtGui.QApplication([]))
+
+
+@pytest.fixture
+def make_gui(app, tmp_path, monkeypatch):
+    """Return a function that opens a window, connects it and selects tab
+    (if given), with its checkpoint in tmp_path and run.txt there as the file
+    to save to."""
+    monkeypatch.setattr(Keithley_dIdV_checkpoint, "CHECKPOINT_FILE",
+                        str(tmp_path / "checkpoint.json"))
+    monkeypatch.setattr(logic.QFileDialog, "getSaveFileName", staticmethod(
+            lambda *args: (str(tmp_path / "run.txt"), "")))
+    monkeypatch.setattr(logic.QMessageBox, "question", staticmethod(
+            lambda *args: logic.QMessageBox.Yes))
+    guis = []
+
+    def make(tab=None):
+        gui = logic.dIdVGui()
+        guis.append(gui)
+        gui.discovery.join()
+        gui.check_discovery()
+        if tab is not None:
+            gui.TabWidget.setCurrentIndex(tab)
+        return gui
+
+    yield make
+    for gui in guis:
+        if gui.error_monitor:
+            gui.error_monitor.stop()
+
+
+def interrupt_after(gui, points):
+    """Make the run stop dead once the buffer reports points readings."""
+    query = gui.I_source.query
+    polls = []
+
+    def interrupting(cmd):
+        if cmd == "TRAC:POIN:ACT?" and gui.RunningButton.isChecked():
+            polls.append(cmd)
+            if len(polls) > 1:
+                raise Interrupted()
+            return str(points)
+        return query(cmd)
+    gui.I_source.query = interrupting
+
+
+def test_delta_run(make_gui, tmp_path):
+    gui = make_gui(DELTA_TAB)
+    assert gui.connected
+    gui.new_file()
+    gui.run_measurement()
+    assert (gui.points_read, gui.num_points) == (100, 100)
+    assert gui.stop_reason == logic.COMPLETE
+    data = Keithley_dIdV_analysis.load_data(str(tmp_path / "run.txt"))
+    assert data["RNUM"].tolist() == list(range(100))
+    assert Keithley_dIdV_checkpoint.load() is None
+
+
+def test_interrupted_run_resumes(make_gui, tmp_path):
+    gui = make_gui(DELTA_TAB)
+    gui.DeltaPulseCount.setValue(300)
+    gui.new_file()
+    interrupt_after(gui, 100)
+    with pytest.raises(Interrupted):
+        gui.run_measurement()
+    gui.currentfile.close()
+    checkpoint = Keithley_dIdV_checkpoint.load()
+    assert (checkpoint.tab, checkpoint.points) == (DELTA_TAB, 100)
+
+    # The next session offers the run, and the new 6221 has an empty
+    # buffer, so the rest of it is measured again.
+    gui = make_gui()
+    assert gui.current_tab == DELTA_TAB
+    assert gui.DeltaPulseCount.value() == 300
+    data = Keithley_dIdV_analysis.load_data(str(tmp_path / "run.txt"))
+    assert len(data["READ"]) == 300
+    assert Keithley_dIdV_checkpoint.load() is None
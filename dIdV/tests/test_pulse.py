@@ -0,0 +1,46 @@
+"""
+This module holds the tests of the pulse timing rules in
+Keithley_dIdV_pulse.
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import pytest
+from Keithley_dIdV_pulse import LINE_PERIOD, MEASURE_TIME, PulseTiming
+
+TIMING = PulseTiming(width=1E-3, source_delay=16E-6, interval=5,
+                     low_measure=2, filter_count=2)
+
+
+def test_duty_cycle_and_rate():
+    assert TIMING.duty_cycle == pytest.approx(1E-3 / (5 * LINE_PERIOD) * 100)
+    assert TIMING.period == pytest.approx(10 * LINE_PERIOD)
+    assert TIMING.points_per_second == pytest.approx(6.0)
+
+
+def test_min_interval():
+    assert TIMING.min_interval() == 5
+    assert TIMING._replace(width=11E-3).min_interval() == 5
+    # 1 ms pulses at most 0.5% of the cycle: 12 PLC
+    assert TIMING.min_interval(0.5) == 12
+
+
+def test_problems():
+    assert TIMING.problems() == []
+    assert TIMING.problems(0.5) == ["Duty cycle 1.2% is over the 0.5% limit"]
+    short = TIMING._replace(width=40E-6)
+    assert any("outside" in x for x in short.problems())
+    assert any("before the reading" in x for x in short.problems())
+    assert TIMING._replace(interval=2).problems() == [
+            "Cycle interval must be at least 5 PLC"]
+
+
+def test_fastest_and_shortest():
+    fastest = TIMING.fastest(0.5)
+    assert (fastest.width, fastest.interval) == (1E-3, 12)
+    assert fastest.problems(0.5) == []
+    shortest = TIMING.shortest(0.5)
+    assert shortest.width == pytest.approx(16E-6 + MEASURE_TIME)
+    assert shortest.interval == 5
+    assert "fastest legal 12 PLC" in TIMING.summary(0.5)
@@ -0,0 +1,75 @@
+"""
+This module holds the tests of the running statistics in
+Keithley_dIdV_stats against numpy computed on the whole run at once.
+
+Copyright 2018 Sarah Friedensen
+This file is part of Keithley_dIdV
+."""
+
+import numpy as np
+from Keithley_dIdV_stats import (AllanDeviation, NoiseMonitor, RunningStats,
+                                 SweepAverager)
+
+CHUNKS = (1, 7, 3, 50, 11)
+
+
+def chunks(x):
+    """Split x into uneven chunks, the way buffer reads arrive."""
+    bounds = np.cumsum((0,) + CHUNKS * (len(x) // sum(CHUNKS) + 1))
+    return [x[a:b] for (a, b) in zip(bounds[:-1], bounds[1:]) if a < len(x)]
+
+
+def test_sweep_averager():
+    sweeps = np.random.default_rng(1).normal(size=(4, 9))
+    averager = SweepAverager(9, 4)
+    for chunk in chunks(sweeps.ravel()):
+        averager.add(chunk)
+    averager.add([1.0])  # past the end of the run
+    assert averager.complete and averager.sweeps_done == 4
+    np.testing.assert_allclose(averager.mean, sweeps.mean(axis=0))
+    np.testing.assert_allclose(averager.std, sweeps.std(axis=0, ddof=1))
+    assert averager.format_averages().count('\n') == 10
+
+
+def test_running_stats():
+    rng = np.random.default_rng(2)
+    times = np.arange(500) * 0.1
+    readings = 3.0 + 0.02 * times + rng.normal(size=500)
+    stats = RunningStats()
+    for (x, t) in zip(chunks(readings), chunks(times)):
+        stats.add(x, t)
+    assert stats.n == 500
+    np.testing.assert_allclose(stats.mean, readings.mean())
+    np.testing.assert_allclose(stats.variance, readings.var(ddof=1))
+    np.testing.assert_allclose(stats.drift,
+                               np.polyfit(times, readings, 1)[0])
+
+
+def direct_allan(x, m):
+    """Overlapping Allan deviation at averaging factor m."""
+    phase = np.concatenate(([0.0], np.cumsum(x)))
+    diff = phase[2 * m:] - 2 * phase[m:-m] + phase[:-2 * m]
+    return np.sqrt(np.sum(diff ** 2) / (2.0 * m ** 2 * len(diff)))
+
+
+def test_allan_deviation():
+    x = 1.0 + np.random.default_rng(3).normal(size=300)
+    allan = AllanDeviation(max_octave=5)
+    for chunk in chunks(x):
+        allan.add(chunk)
+    (taus, devs) = allan.deviations(tau0=0.5)
+    np.testing.assert_allclose(taus, 0.5 * 2 ** np.arange(6))
+    np.testing.assert_allclose(devs, [direct_allan(x, 2 ** k)
+                                      for k in range(6)])
+
+
+def test_noise_monitor():
+    rng = np.random.default_rng(4)
+    readings = rng.normal(scale=1E-6, size=2000)
+    times = np.arange(2000) * 0.1
+    monitors = [NoiseMonitor(target) for target in (None, 1E-6, 1E-12)]
+    for monitor in monitors:
+        monitor.add(readings, times)
+    np.testing.assert_allclose(monitors[0].tau0, 0.1)
+    assert [x.target_reached() for x in monitors] == [False, True, False]
+    assert "N = 2000" in monitors[0].summary()